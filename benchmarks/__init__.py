@@ -0,0 +1 @@
+"""Benchmarks for the loading pipeline of the plugin"""
@@ -0,0 +1,178 @@
+"""Times the stages of the loading pipeline on synthetic city models and
+records the results as JSON, so that they can be compared between commits.
+
+Run from the root of the repository with the Python of a QGIS install:
+
+    python -m benchmarks.run_benchmarks --sizes 1000 10000 --output results.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+from qgis.core import Qgis, QgsApplication
+
+from benchmarks.synthetic import create_citymodel
+from core.jsonio import get_json_backend
+from core.loading import CityJSONLoader, load_cityjson_model
+from core.utils import get_subset_bbox
+
+class StageTimer:
+    """A class that records the duration of the stages of a run"""
+
+    def __init__(self):
+        self.stages = {}
+
+    def time(self, stage, function, *args, **kwargs):
+        """Calls the function and records its duration under stage"""
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        self.stages[stage] = time.perf_counter() - start
+        return result
+
+def build_features(loader):
+    """Creates the features of all city objects without adding them"""
+    field_map = loader.layer_manager.get_field_map()
+    features = []
+    for key, obj in loader.citymodel["CityObjects"].items():
+        features.extend(loader.feature_builder.create_features(field_map, key, obj))
+    return features
+
+def insert_features(loader, features):
+    """Adds the features to the layers of the loader"""
+    loader.layer_manager.add_features(features)
+    loader.layer_manager.flush()
+
+def style_layers(loader):
+    """Applies the styling of the loader to all its layers"""
+    for layer in loader.layer_manager.get_all_layers():
+        loader.styler.apply(layer)
+
+def run_case(filepath, options):
+    """Runs all stages for a file with the given loading options and returns
+    their durations in seconds
+    """
+    timer = StageTimer()
+
+    citymodel = timer.time("parse", load_cityjson_model, filepath)
+    # The loader discovers the schema of the model (attributes, types and
+    # LoDs) when it is created, so field_discovery only creates the fields
+    loader = timer.time("loader_init", CityJSONLoader, filepath, citymodel, **options)
+
+    timer.time("vertex_cache", loader.init_vertices)
+    timer.time("field_discovery", loader.fields_builder.get_fields)
+    features = timer.time("feature_build", build_features, loader)
+    timer.time("provider_insert", insert_features, loader, features)
+    timer.time("styling", style_layers, loader)
+
+    bbox = [85000.0, 445000.0, 85000.0 + 100.0, 445000.0 + 100.0]
+    timer.time("subset_bbox", get_subset_bbox, citymodel, bbox)
+
+    return {"stages": timer.stages,
+            "features": len(features),
+            "skipped_geometries": loader.geometry_reader.skipped_geometries()}
+
+def get_git_revision():
+    """Returns the current commit of the repository, if available"""
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline):
+    """Prints the change of every stage against the runs of a baseline"""
+    baseline_runs = {(run["objects"], run["case"]): run for run in baseline["runs"]}
+    for run in results["runs"]:
+        old_run = baseline_runs.get((run["objects"], run["case"]))
+        if old_run is None:
+            continue
+        changes = []
+        for stage, duration in run["stages"].items():
+            old_duration = old_run["stages"].get(stage)
+            if old_duration:
+                changes.append("{} {:+.0%}".format(stage, duration / old_duration - 1))
+        print("{:>8} objects, {:<10} {}".format(run["objects"], run["case"], ", ".join(changes)),
+              file=sys.stderr)
+
+CASES = {
+    "simple": {},
+    "lod_layers": {"lod_as": "LAYERS"},
+    "semantics": {"load_semantic_surfaces": True},
+    "by_type": {"divide_by_object": True}
+}
+
+def main(argv=None):
+    """Runs the benchmarks"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000],
+                        help="Number of city objects of the synthetic models")
+    parser.add_argument("--cases", nargs="+", choices=sorted(CASES), default=sorted(CASES),
+                        help="Loading options to benchmark")
+    parser.add_argument("--lods", nargs="+", default=["1", "2.2"],
+                        help="LoDs of the geometries of every building")
+    parser.add_argument("--no-semantics", action="store_true",
+                        help="Generate geometries without semantic surfaces")
+    parser.add_argument("--no-templates", action="store_true",
+                        help="Generate no geometry templates")
+    parser.add_argument("--no-attributes", action="store_true",
+                        help="Generate no attributes")
+    parser.add_argument("--output", help="JSON file to write the results to")
+    parser.add_argument("--baseline", help="JSON results of a previous run to compare with")
+    args = parser.parse_args(argv)
+
+    qgs = QgsApplication([], False)
+    qgs.initQgis()
+
+    results = {
+        "revision": get_git_revision(),
+        "qgis": Qgis.QGIS_VERSION,
+        "python": platform.python_version(),
+        "json_backend": get_json_backend(),
+        "platform": platform.platform(),
+        "runs": []
+    }
+
+    with tempfile.TemporaryDirectory() as directory:
+        for size in args.sizes:
+            citymodel = create_citymodel(size,
+                                         lods=args.lods,
+                                         semantics=not args.no_semantics,
+                                         templates=not args.no_templates,
+                                         attributes=not args.no_attributes)
+            filepath = os.path.join(directory, "synthetic_{}.city.json".format(size))
+            with open(filepath, "w") as file:
+                json.dump(citymodel, file)
+            del citymodel
+
+            for case in args.cases:
+                run = run_case(filepath, CASES[case])
+                run.update({"objects": size, "case": case,
+                            "file_size": os.path.getsize(filepath)})
+                results["runs"].append(run)
+
+                stages = ", ".join("{} {:.3f}s".format(stage, duration)
+                                   for stage, duration in run["stages"].items())
+                print("{:>8} objects, {:<10} {}".format(size, case, stages),
+                      file=sys.stderr)
+
+    qgs.exitQgis()
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            compare(results, json.load(file))
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output)
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""A module that generates synthetic city models for benchmarks"""
+
+import random
+
+ROOF = 0
+WALL = 1
+GROUND = 2
+
+FUNCTIONS = ["residential", "office", "industrial", "education", "retail"]
+
+def box_vertices(x, y, width, depth, height):
+    """Returns the 8 (quantized) vertices of a box"""
+    return [[x, y, 0], [x + width, y, 0], [x + width, y + depth, 0], [x, y + depth, 0],
+            [x, y, height], [x + width, y, height],
+            [x + width, y + depth, height], [x, y + depth, height]]
+
+def box_surfaces(offset):
+    """Returns the 6 surfaces of a box whose vertices start at offset, as
+    (surface, semantic value) pairs
+    """
+    faces = [([0, 3, 2, 1], GROUND), ([4, 5, 6, 7], ROOF),
+             ([0, 1, 5, 4], WALL), ([1, 2, 6, 5], WALL),
+             ([2, 3, 7, 6], WALL), ([3, 0, 4, 7], WALL)]
+    return [([[offset + i for i in face]], value) for face, value in faces]
+
+def create_geometry(lod, offset, semantics):
+    """Returns a geometry of the box whose vertices start at offset"""
+    surfaces = box_surfaces(offset)
+    boundaries = [surface for surface, _ in surfaces]
+    values = [value for _, value in surfaces]
+
+    if lod == "1":
+        geometry = {"type": "Solid", "lod": lod, "boundaries": [boundaries]}
+        values = [values]
+    else:
+        geometry = {"type": "MultiSurface", "lod": lod, "boundaries": boundaries}
+
+    if semantics:
+        geometry["semantics"] = {
+            "surfaces": [{"type": "RoofSurface", "slope": 0.0},
+                         {"type": "WallSurface"},
+                         {"type": "GroundSurface"}],
+            "values": values
+        }
+
+    return geometry
+
+def create_template():
+    """Returns the geometry templates of a simple tree"""
+    vertices = [[-1.0, -1.0, 0.0], [1.0, -1.0, 0.0], [1.0, 1.0, 0.0],
+                [-1.0, 1.0, 0.0], [0.0, 0.0, 5.0]]
+    boundaries = [[[0, 3, 2, 1]], [[0, 1, 4]], [[1, 2, 4]], [[2, 3, 4]], [[3, 0, 4]]]
+
+    return {"templates": [{"type": "MultiSurface", "lod": "2", "boundaries": boundaries}],
+            "vertices-templates": vertices}
+
+def create_attributes(rng, height):
+    """Returns a set of attributes of mixed types"""
+    return {
+        "measuredHeight": height / 100.0,
+        "storeysAboveGround": max(1, int(height / 300)),
+        "yearOfConstruction": rng.randint(1850, 2020),
+        "function": rng.choice(FUNCTIONS),
+        "dateOfSurvey": "20{:02d}-{:02d}-{:02d}".format(rng.randint(0, 22),
+                                                        rng.randint(1, 12),
+                                                        rng.randint(1, 28)),
+        "isMonument": rng.random() < 0.05
+    }
+
+def create_citymodel(objects, lods=("1", "2.2"), semantics=True,
+                     templates=True, attributes=True, seed=0):
+    """Returns a CityJSON city model with the given number of city objects.
+
+    Buildings are boxes laid out in a grid, with one geometry per LoD.
+    When templates are enabled, every tenth object is a tree made of a
+    GeometryInstance.
+    """
+    rng = random.Random(seed)
+    citymodel = {
+        "type": "CityJSON",
+        "version": "1.1",
+        "transform": {"scale": [0.01, 0.01, 0.01], "translate": [85000.0, 445000.0, 0.0]},
+        "metadata": {"referenceSystem": "https://www.opengis.net/def/crs/EPSG/0/7415"},
+        "CityObjects": {},
+        "vertices": []
+    }
+    if templates:
+        citymodel["geometry-templates"] = create_template()
+
+    columns = max(1, int(objects ** 0.5))
+    vertices = citymodel["vertices"]
+    for i in range(objects):
+        x = (i % columns) * 2000
+        y = (i // columns) * 2000
+
+        if templates and i % 10 == 9:
+            vertices.append([x + 500, y + 500, 0])
+            citymodel["CityObjects"]["tree-{}".format(i)] = {
+                "type": "SolitaryVegetationObject",
+                "geometry": [{"type": "GeometryInstance",
+                              "template": 0,
+                              "boundaries": [len(vertices) - 1],
+                              "transformationMatrix": [1.0, 0.0, 0.0, 0.0,
+                                                       0.0, 1.0, 0.0, 0.0,
+                                                       0.0, 0.0, 1.0, 0.0,
+                                                       0.0, 0.0, 0.0, 1.0]}]
+            }
+            continue
+
+        height = rng.randint(300, 3000)
+        offset = len(vertices)
+        vertices.extend(box_vertices(x, y, rng.randint(500, 1500), rng.randint(500, 1500), height))
+
+        building = {
+            "type": "Building",
+            "geometry": [create_geometry(lod, offset, semantics) for lod in lods]
+        }
+        if attributes:
+            building["attributes"] = create_attributes(rng, height)
+        citymodel["CityObjects"]["building-{}".format(i)] = building
+
+    return citymodel
@@ -22,7 +22,6 @@
  ***************************************************************************/
 """
 import os.path
-import json
 
 from PyQt5.QtCore import (QCoreApplication, QSettings, QTranslator, QVariant,
                           qVersion)
@@ -40,7 +39,14 @@ from .core.layers import (AttributeFieldsDecorator, BaseFieldsBuilder,
                           LodNamingDecorator, SemanticSurfaceFeatureDecorator,
                           SemanticSurfaceFieldsDecorator, SimpleFeatureBuilder,
                           TypeNamingIterator)
-from .core.loading import CityJSONLoader, load_cityjson_model, get_model_epsg
+from .core.cache import get_conversion_cache
+from .core.provider import (create_on_demand_layer, is_provider_available,
+                            register_provider)
+from .core.loading import (add_layers_to_project, create_styler,
+                           get_model_epsg, is_cityjsonseq,
+                           peek_cityjson_header)
+from .core.filters import parse_lods
+from .core.tasks import CityJSONLoadingTask
 from .core.styling import (Copy2dStyling, NullStyling, SemanticSurfacesStyling,
                            is_3d_styling_available,
                            is_rule_based_3d_styling_available)
@@ -92,8 +98,10 @@ class CityJsonLoader:
         self.dlg.browseButton.clicked.connect(self.select_cityjson_file)
         self.dlg.changeCrsPushButton.clicked.connect(self.select_crs)
         self.dlg.semanticsLoadingCheckBox.stateChanged.connect(self.semantics_loading_changed)
+        self.dlg.onDemandLoadingCheckBox.stateChanged.connect(self.on_demand_loading_changed)
 
         self.provider = None
+        self.task = None
     
     def initProcessing(self):
         """Initialises the processing provider"""
@@ -105,7 +113,7 @@ class CityJsonLoader:
         filename, _ = QFileDialog.getOpenFileName(self.dlg,
                                                   "Select CityJSON file",
                                                   "",
-                                                  "*.json")
+                                                  "CityJSON (*.json *.jsonl)")
         if filename == "":
             self.clear_file_information()
         else:
@@ -131,6 +139,17 @@ class CityJsonLoader:
         """
         if is_rule_based_3d_styling_available():
             self.dlg.semanticSurfacesStylingCheckBox.setEnabled(self.dlg.semanticsLoadingCheckBox.isChecked())
+        self.dlg.semanticSurfacesGroupingCheckBox.setEnabled(self.dlg.semanticsLoadingCheckBox.isChecked())
+
+    def on_demand_loading_changed(self):
+        """Update the GUI according to the new state of on demand loading,
+        which only supports one feature per city object
+        """
+        on_demand = self.dlg.onDemandLoadingCheckBox.isChecked()
+        self.dlg.splitByTypeCheckBox.setEnabled(not on_demand)
+        self.dlg.loDLoadingComboBox.setEnabled(not on_demand)
+        self.dlg.lodsLineEdit.setEnabled(not on_demand)
+        self.dlg.semanticsLoadingCheckBox.setEnabled(not on_demand)
 
     def clear_file_information(self):
         """Clear all fields related to file information"""
@@ -146,11 +165,14 @@ class CityJsonLoader:
     def update_file_information(self, filename):
         """Update metadata fields according to the file provided"""
         try:
-            fstream = open(filename, encoding='utf-8-sig')
-            model = json.load(fstream)
-            fstream.close()
+            model, complete = peek_cityjson_header(filename)
             self.dlg.cityjsonVersionLineEdit.setText(model["version"])
-            self.dlg.compressedLineEdit.setText("Yes" if "transform" in model else "No")
+            if "transform" in model:
+                self.dlg.compressedLineEdit.setText("Yes")
+            elif complete:
+                self.dlg.compressedLineEdit.setText("No")
+            else:
+                self.dlg.compressedLineEdit.setText("Unknown")
 
             if "metadata" in model:
                 self.dlg.crsLineEdit.setText(get_model_epsg(model))
@@ -269,6 +291,7 @@ class CityJsonLoader:
             callback=self.run,
             parent=self.iface.mainWindow())
         
+        register_provider()
         self.initProcessing()
 
 
@@ -291,6 +314,8 @@ class CityJsonLoader:
         self.dlg.changeCrsPushButton.setEnabled(False)
         self.dlg.button_box.button(QDialogButtonBox.Ok).setEnabled(False)
         self.dlg.semanticSurfacesStylingCheckBox.setEnabled(False)
+        self.dlg.semanticSurfacesGroupingCheckBox.setEnabled(False)
+        self.dlg.onDemandLoadingCheckBox.setEnabled(is_provider_available())
         # Run the dialog event loop
         result = self.dlg.exec_()
         # See if OK was pressed
@@ -301,33 +326,79 @@ class CityJsonLoader:
     def load_cityjson(self, filepath):
         """Loads the given CityJSON"""
 
-        citymodel = load_cityjson_model(filepath)
-
         lod_as = 'NONE'
         if self.dlg.loDLoadingComboBox.currentIndex() == 1:
             lod_as = 'ATTRIBUTES'
         elif self.dlg.loDLoadingComboBox.currentIndex() == 2:
             lod_as = 'LAYERS'
 
-        loader = CityJSONLoader(filepath,
-                                citymodel,
-                                epsg=self.dlg.crsLineEdit.text(),
-                                divide_by_object=self.dlg.splitByTypeCheckBox.isChecked(),
-                                lod_as=lod_as,
-                                load_semantic_surfaces=self.dlg.semanticsLoadingCheckBox.isChecked(),
-                                style_semantic_surfaces=self.dlg.semanticsLoadingCheckBox.isChecked()
-                               )
+        options = dict(epsg=self.dlg.crsLineEdit.text(),
+                       divide_by_object=self.dlg.splitByTypeCheckBox.isChecked(),
+                       lod_as=lod_as,
+                       load_semantic_surfaces=self.dlg.semanticsLoadingCheckBox.isChecked(),
+                       group_semantic_surfaces=self.dlg.semanticSurfacesGroupingCheckBox.isChecked(),
+                       lods=parse_lods(self.dlg.lodsLineEdit.text()))
+        style_semantic_surfaces = self.dlg.semanticsLoadingCheckBox.isChecked()
+
+        if self.dlg.onDemandLoadingCheckBox.isChecked() and not is_cityjsonseq(filepath):
+            self.load_on_demand(filepath, options["epsg"])
+            return
+
+        # Reuse the layers of a previous conversion with the same options
+        cache = get_conversion_cache()
+        if cache is not None:
+            cached = cache.load(filepath, options)
+            if cached is not None:
+                layers, skipped_geometries = cached
+                filename, _ = os.path.splitext(os.path.basename(filepath))
+                styler = create_styler(options["load_semantic_surfaces"],
+                                       style_semantic_surfaces)
+                add_layers_to_project(filename, layers, styler)
+                self.show_loading_result(skipped_geometries)
+                return
+
+        # Parse and convert in the background, so that QGIS stays responsive
+        self.task = CityJSONLoadingTask(filepath,
+                                        options,
+                                        style_semantic_surfaces,
+                                        cache,
+                                        self.loading_finished)
+        QgsApplication.taskManager().addTask(self.task)
+
+    def loading_finished(self, task):
+        """Shows the outcome of a loading task"""
+        self.task = None
+        if task.exception is not None:
+            msg = QMessageBox()
+            msg.setIcon(QMessageBox.Critical)
+            msg.setText("CityJSON could not be loaded.")
+            msg.setDetailedText(str(task.exception))
+            msg.setWindowTitle("CityJSON loading failed")
+            msg.setStandardButtons(QMessageBox.Ok)
+            msg.exec_()
+            return
+
+        self.show_loading_result(task.skipped_geometries)
+
+    def load_on_demand(self, filepath, epsg):
+        """Adds a layer of the given CityJSON whose features are converted
+        when they are drawn or requested
+        """
+        layer = create_on_demand_layer(filepath, epsg)
 
-        skipped_geometries = loader.load()
+        filename, _ = os.path.splitext(os.path.basename(filepath))
+        add_layers_to_project(filename, [layer], create_styler(False, False))
 
-        # Show a message with the outcome of the loading process
+    def show_loading_result(self, skipped_geometries):
+        """Shows a message with the outcome of the loading process"""
         msg = QMessageBox()
         if skipped_geometries > 0:
             msg.setIcon(QMessageBox.Warning)
             msg.setText("CityJSON loaded with issues.")
             msg.setInformativeText("Some geometries were skipped.")
             msg.setDetailedText("{} geometries could not be loaded (p.s. "
-                                "GeometryInstances are not supported yet).".format(skipped_geometries))
+                                "points and lines are not supported yet, and "
+                                "invalid geometries are skipped).".format(skipped_geometries))
         else:
             msg.setIcon(QMessageBox.Information)
             msg.setText("CityJSON loaded successfully.")
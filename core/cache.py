@@ -0,0 +1,197 @@
+"""A module that caches the layers of converted city models on disk"""
+
+import hashlib
+import json
+import os
+
+from qgis.core import (QgsCoordinateTransformContext, QgsProject,
+                       QgsVectorFileWriter, QgsVectorLayer)
+
+from .settings import load_settings
+
+# The number of bytes read from the start and end of a file for its key
+SAMPLE_SIZE = 1024 * 1024
+
+# The version of the cached layers, to increase whenever the conversion
+# changes their geometries, attributes or fields
+CACHE_VERSION = 2
+
+def get_file_signature(filepath):
+    """Returns a hash of the path, size, modification time and the first
+    and last bytes of a file
+    """
+    stat = os.stat(filepath)
+    digest = hashlib.sha1()
+    digest.update(os.path.abspath(filepath).encode("utf-8"))
+    digest.update("{}|{}".format(stat.st_size, stat.st_mtime_ns).encode("utf-8"))
+
+    with open(filepath, "rb") as file:
+        digest.update(file.read(SAMPLE_SIZE))
+        if stat.st_size > SAMPLE_SIZE:
+            file.seek(max(SAMPLE_SIZE, stat.st_size - SAMPLE_SIZE))
+            digest.update(file.read(SAMPLE_SIZE))
+
+    return digest.hexdigest()
+
+def write_layer(layer, path, table, overwrite_file):
+    """Writes a vector layer as a table of a GeoPackage and returns True if
+    successful
+    """
+    options = QgsVectorFileWriter.SaveVectorOptions()
+    options.driverName = "GPKG"
+    options.layerName = table
+    if overwrite_file:
+        options.actionOnExistingFile = QgsVectorFileWriter.CreateOrOverwriteFile
+    else:
+        options.actionOnExistingFile = QgsVectorFileWriter.CreateOrOverwriteLayer
+
+    if hasattr(QgsVectorFileWriter, "writeAsVectorFormatV2"):
+        result = QgsVectorFileWriter.writeAsVectorFormatV2(layer,
+                                                           path,
+                                                           QgsCoordinateTransformContext(),
+                                                           options)
+    else:
+        result = QgsVectorFileWriter.writeAsVectorFormat(layer, path, options)
+
+    return result[0] == QgsVectorFileWriter.NoError
+
+def normalize_path(path):
+    """Returns a path in a form that can be compared with other ones"""
+    return os.path.normcase(os.path.abspath(path))
+
+def get_project_sources():
+    """Returns the (normalized) paths of the files that the layers of the
+    current project are read from. Must be called from the main thread.
+    """
+    paths = set()
+    for layer in QgsProject.instance().mapLayers().values():
+        path = layer.source().split("|")[0]
+        if path:
+            paths.add(normalize_path(path))
+
+    return paths
+
+class ConversionCache:
+    """A class that stores the converted layers of city models as
+    GeoPackages in a directory. Entries are keyed by the cache version,
+    the file and the loading options, and the least recently used ones are evicted when the
+    cache grows over `max_size` bytes.
+    """
+
+    def __init__(self, directory, max_size=2 * 1024 ** 3, version=CACHE_VERSION):
+        self._directory = directory
+        self._max_size = max_size
+        self._version = version
+
+    def get_key(self, filepath, options):
+        """Returns the key of a file loaded with the given options"""
+        digest = hashlib.sha1()
+        digest.update(str(self._version).encode("utf-8"))
+        digest.update(get_file_signature(filepath).encode("utf-8"))
+        digest.update(json.dumps(options, sort_keys=True).encode("utf-8"))
+
+        return digest.hexdigest()
+
+    def _paths(self, key):
+        """Returns the paths of the GeoPackage and the index of an entry"""
+        base = os.path.join(self._directory, key)
+        return base + ".gpkg", base + ".json"
+
+    def load(self, filepath, options):
+        """Returns the cached layers and count of skipped geometries of a
+        file, or None if it is not in the cache
+        """
+        gpkg_path, index_path = self._paths(self.get_key(filepath, options))
+        if not (os.path.exists(gpkg_path) and os.path.exists(index_path)):
+            return None
+
+        with open(index_path, encoding="utf-8") as file:
+            index = json.load(file)
+
+        layers = []
+        for name, table in index["layers"]:
+            uri = "{}|layername={}".format(gpkg_path, table)
+            layer = QgsVectorLayer(uri, name, "ogr")
+            if not layer.isValid():
+                return None
+            layers.append(layer)
+
+        # Mark the entry as recently used
+        os.utime(gpkg_path)
+        os.utime(index_path)
+
+        return layers, index["skipped_geometries"]
+
+    def store(self, filepath, options, layers, skipped_geometries=0):
+        """Stores the layers of a file. Returns True if the layers were
+        stored. Old entries are only removed by `evict`.
+        """
+        os.makedirs(self._directory, exist_ok=True)
+        gpkg_path, index_path = self._paths(self.get_key(filepath, options))
+        temp_path = gpkg_path + ".tmp.gpkg"
+
+        index = {"layers": [], "skipped_geometries": skipped_geometries}
+        try:
+            for i, layer in enumerate(layers):
+                table = "layer_{}".format(i)
+                if not write_layer(layer, temp_path, table, i == 0):
+                    return False
+                index["layers"].append([layer.name(), table])
+
+            os.replace(temp_path, gpkg_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+        with open(index_path, "w", encoding="utf-8") as file:
+            json.dump(index, file)
+
+        return True
+
+    def evict(self, in_use=()):
+        """Removes the least recently used entries until the cache is
+        smaller than its maximum size. The GeoPackages whose (normalized)
+        paths are in `in_use`, e.g. the sources of layers of the project,
+        and the ones that can't be removed are kept. Returns the paths of
+        the files that couldn't be removed.
+        """
+        if not os.path.isdir(self._directory):
+            return []
+
+        entries = []
+        for filename in os.listdir(self._directory):
+            if not filename.endswith(".gpkg") or filename.endswith(".tmp.gpkg"):
+                continue
+            path = os.path.join(self._directory, filename)
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        failed = []
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_size <= self._max_size:
+                break
+            if normalize_path(path) in in_use:
+                continue
+
+            # The index goes first, so that a GeoPackage that can't be
+            # removed (e.g. locked) is never loaded again
+            index_path = path[:-len(".gpkg")] + ".json"
+            try:
+                if os.path.exists(index_path):
+                    os.remove(index_path)
+                os.remove(path)
+            except OSError:
+                failed.append(path)
+                continue
+            total_size -= size
+
+        return failed
+
+def get_conversion_cache():
+    """Returns the conversion cache of the plugin, or None if disabled"""
+    settings = load_settings()
+    if not settings["cache_enabled"]:
+        return None
+
+    return ConversionCache(settings["cache_directory"], settings["cache_max_size"])
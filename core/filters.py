@@ -0,0 +1,264 @@
+"""A module to select city objects by their ids, types, attributes or LoDs
+before they are converted
+
+Attribute filters are simple predicates on the attributes of city objects,
+such as `measuredHeight > 30 and roofType = 'flat'`. Names can be quoted
+with double quotes and strings with single quotes, as in QGIS expressions.
+"""
+
+import operator
+import re
+
+from .subset import get_geometry_lod, get_subset
+
+TOKEN = re.compile(r"""\s*(?:
+    (?P<number>[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)|
+    (?P<string>'(?:[^'\\]|\\.)*')|
+    (?P<name>"[^"]+"|[A-Za-z_][\w.:-]*)|
+    (?P<operator><=|>=|!=|<>|==|=|<|>)|
+    (?P<paren>[()])
+)""", re.X)
+
+OPERATORS = {
+    "=": operator.eq,
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<>": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge
+}
+
+KEYWORDS = ("and", "or", "not")
+
+def tokenize(expression):
+    """Returns the list of (kind, text) tokens of an expression"""
+    tokens = []
+    pos = 0
+    expression = expression.rstrip()
+    while pos < len(expression):
+        match = TOKEN.match(expression, pos)
+        if match is None:
+            raise ValueError("Invalid attribute filter at: {}".format(expression[pos:]))
+        kind = match.lastgroup
+        text = match.group(kind)
+        if kind == "name" and text.lower() in KEYWORDS:
+            kind = "keyword"
+            text = text.lower()
+        tokens.append((kind, text))
+        pos = match.end()
+
+    return tokens
+
+def get_literal(kind, text):
+    """Returns the value of a number, string or bare word token"""
+    if kind == "number":
+        if re.fullmatch(r"[-+]?\d+", text):
+            return int(text)
+        return float(text)
+    if kind == "string":
+        return re.sub(r"\\(.)", r"\1", text[1:-1])
+    if text.lower() in ("true", "false"):
+        return text.lower() == "true"
+
+    return text
+
+def compare(value, op, literal):
+    """Compares an attribute value to a literal. Missing values and values
+    that can't be compared to the literal never match.
+    """
+    if value is None:
+        return False
+
+    if isinstance(literal, bool) or isinstance(value, bool):
+        if not (isinstance(literal, bool) and isinstance(value, bool)):
+            return False
+    elif isinstance(literal, (int, float)) and not isinstance(value, (int, float)):
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            return False
+    elif isinstance(literal, str) and not isinstance(value, str):
+        value = str(value)
+
+    try:
+        return OPERATORS[op](value, literal)
+    except TypeError:
+        return False
+
+class AttributeFilter:
+    """A class that parses an attribute filter and tells whether city
+    objects match it
+    """
+
+    def __init__(self, expression):
+        self.expression = expression
+        self._tokens = tokenize(expression)
+        self._pos = 0
+        if not self._tokens:
+            raise ValueError("Empty attribute filter")
+
+        self._predicate = self._parse_or()
+        if self._pos < len(self._tokens):
+            raise ValueError("Unexpected '{}' in attribute filter".format(self._tokens[self._pos][1]))
+
+    def matches(self, cityobject):
+        """Returns True if the attributes of the city object match"""
+        return self._predicate(cityobject.get("attributes", {}))
+
+    def _peek(self):
+        """Returns the next token, or (None, None) at the end"""
+        if self._pos < len(self._tokens):
+            return self._tokens[self._pos]
+        return None, None
+
+    def _next(self):
+        """Consumes and returns the next token"""
+        token = self._peek()
+        if token[0] is None:
+            raise ValueError("Unexpected end of attribute filter")
+        self._pos += 1
+        return token
+
+    def _parse_or(self):
+        """Parses predicates joined by `or`"""
+        predicates = [self._parse_and()]
+        while self._peek() == ("keyword", "or"):
+            self._pos += 1
+            predicates.append(self._parse_and())
+
+        if len(predicates) == 1:
+            return predicates[0]
+        return lambda attributes: any(p(attributes) for p in predicates)
+
+    def _parse_and(self):
+        """Parses predicates joined by `and`"""
+        predicates = [self._parse_not()]
+        while self._peek() == ("keyword", "and"):
+            self._pos += 1
+            predicates.append(self._parse_not())
+
+        if len(predicates) == 1:
+            return predicates[0]
+        return lambda attributes: all(p(attributes) for p in predicates)
+
+    def _parse_not(self):
+        """Parses a negated predicate, one in parentheses or a comparison"""
+        kind, text = self._next()
+        if (kind, text) == ("keyword", "not"):
+            predicate = self._parse_not()
+            return lambda attributes: not predicate(attributes)
+
+        if (kind, text) == ("paren", "("):
+            predicate = self._parse_or()
+            if self._next() != ("paren", ")"):
+                raise ValueError("Missing ')' in attribute filter")
+            return predicate
+
+        if kind != "name":
+            raise ValueError("Expected an attribute name instead of '{}'".format(text))
+        name = text.strip('"')
+
+        kind, op = self._next()
+        if kind != "operator":
+            raise ValueError("Expected an operator instead of '{}'".format(op))
+
+        kind, text = self._next()
+        if kind not in ("number", "string", "name"):
+            raise ValueError("Expected a value instead of '{}'".format(text))
+        literal = get_literal(kind, text)
+
+        return lambda attributes: compare(attributes.get(name), op, literal)
+
+class FilterPipeline:
+    """A class that combines filters by ids (e.g. of an extent), types,
+    attributes and LoDs. The objects matching all of them are selected in a
+    single scan of the model, which is then subset once.
+    """
+
+    def __init__(self):
+        self.ids = None
+        self.types = None
+        self.attribute_filter = None
+        self.lods = None
+
+    def restrict_ids(self, ids):
+        """Only keeps the objects of the given ids (on top of the ids of
+        previous calls)
+        """
+        ids = set(ids)
+        if self.ids is None:
+            self.ids = ids
+        else:
+            self.ids &= ids
+
+    def set_types(self, types):
+        """Only keeps the objects of the given types"""
+        self.types = set(types)
+
+    def set_attribute_filter(self, attribute_filter):
+        """Only keeps the objects that match an AttributeFilter"""
+        self.attribute_filter = attribute_filter
+
+    def set_lods(self, lods):
+        """Only keeps the geometries of the given LoDs (as strings)"""
+        self.lods = set(str(lod) for lod in lods)
+
+    def is_empty(self):
+        """Returns True if there is no filter"""
+        return (self.ids is None and self.types is None and
+                self.attribute_filter is None and self.lods is None)
+
+    def matches(self, citymodel, theid, cityobject):
+        """Returns True if a city object matches all filters"""
+        if self.ids is not None and theid not in self.ids:
+            return False
+        if self.types is not None and cityobject["type"] not in self.types:
+            return False
+        if self.attribute_filter is not None and not self.attribute_filter.matches(cityobject):
+            return False
+        if self.lods is not None and cityobject.get("geometry"):
+            return any(get_geometry_lod(citymodel, geom) in self.lods
+                       for geom in cityobject["geometry"])
+
+        return True
+
+    def select(self, citymodel):
+        """Returns the ids of the city objects that match all filters"""
+        return [theid for theid, co in citymodel["CityObjects"].items()
+                if self.matches(citymodel, theid, co)]
+
+    def apply(self, citymodel):
+        """Returns the subset of the model with the objects (and geometries)
+        that match all filters, or the model itself without filters
+        """
+        if self.is_empty():
+            return citymodel
+
+        return get_subset(citymodel, self.select(citymodel), self.lods)
+
+def select_by_attributes(cityobjects, attribute_filter):
+    """Returns the ids of the city objects that match an attribute filter"""
+    return [theid for theid, co in cityobjects.items() if attribute_filter.matches(co)]
+
+def parse_ids(text):
+    """Returns the list of ids separated by commas, semicolons or
+    whitespace in the text
+    """
+    return [theid for theid in re.split(r"[,;\s]+", text) if theid]
+
+def parse_lods(text):
+    """Returns the list of LoDs (as strings) separated by commas,
+    semicolons or whitespace in the text, or None if there are none
+    """
+    lods = parse_ids(text)
+    if len(lods) == 0:
+        return None
+
+    return lods
+
+def read_ids_file(filepath):
+    """Returns the ids listed in a text file (e.g. one per line)"""
+    with open(filepath, encoding="utf-8-sig") as file:
+        return parse_ids(file.read())
@@ -1,17 +1,34 @@
 """A module to provide classes for reading geometries of CityJSON"""
 
-from qgis.core import QgsPoint, QgsGeometry, QgsLineString, QgsPolygon, QgsMultiPolygon
+import struct
+from itertools import chain
+
+import numpy as np
+from qgis.core import QgsPoint, QgsGeometry
+
+# WKB type codes, as written by QGIS
+WKB_MULTIPOLYGON = 6
+WKB_POLYGONZ = 1003
+WKB_MULTIPOLYGONZ = 1006
+
+# The types of geometries that are converted to polygons (points and lines
+# aren't supported)
+SURFACE_TYPES = ("MultiSurface", "CompositeSurface", "Solid", "MultiSolid", "CompositeSolid")
 
 class VerticesCache:
-    """A class to hold the list of vertices of the city model"""
+    """A class to hold the list of vertices of the city model
+
+    The vertices are stored, already dequantized, in a contiguous (N, 3)
+    float64 array. Points are only created when a vertex is requested.
+    """
 
     def __init__(self, scale=(1, 1, 1), translate=(0, 0, 0), vertices=None):
         self._scale = scale
         self._translate = translate
-        self._vertices = []
+        self._vertices = np.empty((0, 3), dtype=np.float64)
+        self._pending = []
         if vertices is not None:
-            for vertex in vertices:
-                self.add_vertex(vertex)
+            self.set_vertices(vertices)
 
     def set_scale(self, scale):
         """Sets the scale for coordinates of the list"""
@@ -21,6 +38,19 @@ class VerticesCache:
         """Sets the translation for coordinates of the list"""
         self._translate = translate
 
+    def set_vertices(self, vertices):
+        """Replaces the list with the given vertices, applying the scale and
+        translation to all of them in one step
+
+        Keywords:
+        vertices - The original (N, 3) vertex coords from CityJSON
+        """
+        self._pending = []
+        coords = np.array(vertices, dtype=np.float64).reshape(-1, 3)
+        coords *= np.asarray(self._scale, dtype=np.float64)
+        coords += np.asarray(self._translate, dtype=np.float64)
+        self._vertices = coords
+
     def add_vertex(self, vertex):
         """Adds a vertex to the list
 
@@ -31,12 +61,33 @@ class VerticesCache:
         y = vertex[1] * self._scale[1] + self._translate[1]
         z = vertex[2] * self._scale[2] + self._translate[2]
 
-        p = QgsPoint(x, y, z)
-        self._vertices.append(p)
+        self._pending.append((x, y, z))
+
+    def _flush(self):
+        """Moves the vertices added one by one to the array"""
+        if self._pending:
+            pending = np.array(self._pending, dtype=np.float64)
+            self._vertices = np.concatenate((self._vertices, pending))
+            self._pending = []
+
+    def get_coords(self, indices):
+        """Returns the (N, 3) array of coordinates for the given indices"""
+        self._flush()
+        return self._vertices[np.asarray(indices, dtype=np.int64)]
 
     def get_vertex(self, index):
         """Get the vertex of a specified index"""
-        return self._vertices[index]
+        self._flush()
+        x, y, z = self._vertices[index]
+        return QgsPoint(float(x), float(y), float(z))
+
+    def as_array(self):
+        """Returns the (N, 3) array of all dequantized vertices"""
+        self._flush()
+        return self._vertices
+
+    def __len__(self):
+        return len(self._vertices) + len(self._pending)
 
 class TransformedVerticesCache:
     """A class that decorates a VerticesCache applying a decoration when
@@ -64,11 +115,19 @@ class TransformedVerticesCache:
 
     def get_vertex(self, index):
         """Get the vertex at the specified index"""
-        original_vertex = self._decorated.get_vertex(index)
-        x = original_vertex.x() + self._translation.x()
-        y = original_vertex.y() + self._translation.y()
-        z = original_vertex.z() + self._translation.z()
-        return QgsPoint(x, y, z)
+        x, y, z = self.get_coords([index])[0]
+        return QgsPoint(float(x), float(y), float(z))
+
+    def get_coords(self, indices):
+        """Returns the (N, 3) array of transformed coordinates for the
+        given indices
+        """
+        reference_point = np.array([self._translation.x(),
+                                    self._translation.y(),
+                                    self._translation.z()])
+        linear, offset = get_instance_transform(self._transformation_matrix,
+                                                reference_point)
+        return self._decorated.get_coords(indices) @ linear + offset
 
 class GeometryReader:
     """A class that translates CityJSON geometries to QgsGeometry"""
@@ -80,17 +139,44 @@ class GeometryReader:
         if self._geometry_templates is None:
             self._templates_vertices_cache = VerticesCache()
         else:
-            template_vertex_cache = VerticesCache()
-            for vertex in geometry_templates["vertices-templates"]:
-                template_vertex_cache.add_vertex(vertex)
+            template_vertex_cache = VerticesCache(vertices=geometry_templates["vertices-templates"])
             self._templates_vertices_cache = template_vertex_cache
+        self._templates = {}
 
     def read_geometry(self, geometry):
         """Reads a CityJSON geometry and returns it as QgsGeometry
         """
-        polygons, _ = self.get_polygons(geometry)
+        if len(geometry) == 1 and geometry[0]["type"] == "GeometryInstance":
+            return geometry_from_wkb(self.read_instance_wkb(geometry[0]))
 
-        return self.polygons_to_geometry(polygons)
+        return geometry_from_wkb(self.read_flat_polygons(geometry).to_wkb())
+
+    def get_template(self, template_index):
+        """Returns the template geometry of the given index, which is only
+        read the first time it is requested
+        """
+        if template_index not in self._templates:
+            geometry = self._geometry_templates["templates"][template_index]
+            polygons = read_flat_polygons(geometry, self._templates_vertices_cache)
+            self._templates[template_index] = TemplateGeometry(polygons)
+
+        return self._templates[template_index]
+
+    def get_reference_point(self, geometry):
+        """Returns the coordinates of the reference point of an instance"""
+        return self._vertices_cache.get_coords(geometry["boundaries"][:1])[0]
+
+    def read_instance_wkb(self, geometry):
+        """Returns the WKB of a GeometryInstance, placing its cached template
+        with a single affine transformation
+        """
+        try:
+            template = self.get_template(geometry["template"])
+            return template.place_wkb(geometry.get("transformationMatrix"),
+                                      self.get_reference_point(geometry))
+        except Exception:
+            self._skipped_geometries += 1
+            return FlatPolygons.concatenate([]).to_wkb()
 
     def get_lod(self, geometry):
         """Returns the lod of a give geometry"""
@@ -102,101 +188,399 @@ class GeometryReader:
 
     def polygons_to_geometry(self, polygons):
         """Returns a QgsGeometry object from a list of polygons"""
-        geoms = QgsMultiPolygon()
-        for polygon in polygons:
-            g = self.read_polygon(polygon)
-            geoms.addGeometry(g)
-        return QgsGeometry(geoms)
+        return geometry_from_wkb(polygons_to_wkb(polygons))
 
     def get_polygons(self, geometry):
-        """Returns a dictionary where keys are polygons and values
-        are the semantic surfaces
+        """Returns the list of polygons (as lists of ring coordinates) and
+        the list of their semantic surfaces
         """
-        polygons = []
-        semantics = []
+        flat_polygons = self.read_flat_polygons(geometry)
 
-        for geom in geometry:
-            if geom["type"] == "GeometryInstance":
-                template_index = geom["template"]
-                temp_geom = self._geometry_templates["templates"][template_index]
-                translation = self._vertices_cache.get_vertex(geom["boundaries"][0])
-                temp_vertices_cache = TransformedVerticesCache(self._templates_vertices_cache, translation)
-            else:
-                temp_geom = geom
-                temp_vertices_cache = self._vertices_cache
+        return flat_polygons.to_list(), flat_polygons.semantics
 
+    def read_flat_polygons(self, geometry):
+        """Returns the polygons of all geometries in the list as
+        FlatPolygons
+        """
+        parts = []
+
+        for geom in geometry:
             try:
-                if "semantics" in temp_geom:
-                    surfaces = temp_geom["semantics"]["surfaces"]
-                    values = temp_geom["semantics"]["values"]
+                if geom["type"] == "GeometryInstance":
+                    template = self.get_template(geom["template"])
+                    parts.append(template.place(geom.get("transformationMatrix"),
+                                                self.get_reference_point(geom)))
                 else:
-                    surfaces = None
-                    values = None
-                new_polygons, new_semantics = read_boundaries(temp_geom["boundaries"], surfaces, values)
-                new_polygons = self.indexes_to_points(new_polygons, temp_vertices_cache)
-                polygons = polygons + new_polygons
-                semantics = semantics + new_semantics
-
+                    parts.append(read_flat_polygons(geom, self._vertices_cache))
             except Exception as e:
                 self._skipped_geometries += 1
 
-        return polygons, semantics
+        return FlatPolygons.concatenate(parts)
 
     def indexes_to_points(self, polygons, vertices_cache):
-        """Returns the indexed vertices to vertices with coordinates"""
+        """Returns the polygons with every ring of indexes replaced by an
+        (N, 3) array of coordinates
+        """
         new_polygons = []
         for polygon in polygons:
-            new_polygon = []
-            for ring in polygon:
-                new_ring = []
-                for index in ring:
-                    new_ring.append(vertices_cache.get_vertex(index))
-                new_polygon.append(new_ring)
+            new_polygon = [vertices_cache.get_coords(ring) for ring in polygon]
             new_polygons.append(new_polygon)
 
         return new_polygons
 
-    def read_polygon(self, boundary):
-        """Reads the specified polygon"""
-        g = QgsPolygon()
-        i = 0
-        for ring in boundary:
-            poly = []
-            for point in ring:
-                poly.append(point)
-
-            r = QgsLineString(poly)
-            if i == 0:
-                g.setExteriorRing(r)
-            else:
-                g.addInteriorRing(r)
-            i = 1
-
-        return g
-
     def skipped_geometries(self):
         """Returns the count of geometries that were skipped while reading"""
         return self._skipped_geometries
 
+    def add_skipped_geometries(self, count):
+        """Adds to the count of skipped geometries (e.g. the ones skipped
+        by another reader)
+        """
+        self._skipped_geometries += count
+
+def read_flat_polygons(geometry, vertices_cache):
+    """Returns the polygons of a single (non-instance) geometry as
+    FlatPolygons, with coordinates from the given vertices cache
+    """
+    if geometry["type"] not in SURFACE_TYPES:
+        raise ValueError("Unsupported geometry type: {}".format(geometry["type"]))
+
+    if "semantics" in geometry:
+        surfaces = geometry["semantics"]["surfaces"]
+        values = geometry["semantics"]["values"]
+    else:
+        surfaces = None
+        values = None
+    boundaries = flatten_boundaries(geometry["boundaries"], values)
+    coords = vertices_cache.get_coords(boundaries.indices)
+    if surfaces is None:
+        semantics = [None] * len(boundaries)
+    else:
+        semantics = [None if value is None else surfaces[value]
+                     for value in boundaries.semantic_values]
+
+    return FlatPolygons(coords,
+                        boundaries.ring_offsets,
+                        boundaries.polygon_offsets,
+                        semantics)
+
+def get_instance_transform(transformation_matrix, reference_point):
+    """Returns the (3, 3) linear part, to multiply row vectors of
+    coordinates with, and the translation of a GeometryInstance. The
+    translation combines the matrix's translation and the reference point.
+    """
+    if transformation_matrix is None:
+        return np.identity(3), np.asarray(reference_point, dtype=np.float64)
+
+    matrix = np.asarray(transformation_matrix, dtype=np.float64).reshape(4, 4)
+    return matrix[:3, :3].T, matrix[:3, 3] + reference_point
+
+class TemplateGeometry:
+    """A geometry template converted once to FlatPolygons and WKB, which
+    is placed for every instance by transforming its coordinates only
+    """
+
+    def __init__(self, polygons):
+        self.polygons = polygons
+        self._wkb = np.frombuffer(polygons.to_wkb(), dtype=np.uint8)
+        self._wkb_vertices, _ = polygons.wkb_vertices()
+        self._coords_bytes = polygons.wkb_coordinate_bytes()
+
+    def transform(self, transformation_matrix, reference_point):
+        """Returns the (N, 3) coordinates of the template for an instance"""
+        linear, offset = get_instance_transform(transformation_matrix, reference_point)
+        return self.polygons.coords @ linear + offset
+
+    def place(self, transformation_matrix, reference_point):
+        """Returns the FlatPolygons of an instance of the template"""
+        return FlatPolygons(self.transform(transformation_matrix, reference_point),
+                            self.polygons.ring_offsets,
+                            self.polygons.polygon_offsets,
+                            self.polygons.semantics)
+
+    def place_wkb(self, transformation_matrix, reference_point):
+        """Returns the WKB of an instance of the template, by writing the
+        transformed coordinates over the ones of the template's WKB
+        """
+        coords = self.transform(transformation_matrix, reference_point)[self._wkb_vertices]
+        wkb = self._wkb.copy()
+        wkb[self._coords_bytes] = np.ascontiguousarray(coords, dtype="<f8").view(np.uint8).ravel()
+
+        return wkb.tobytes()
+
+def polygons_to_wkb(polygons):
+    """Returns the WKB of a MultiPolygonZ made of the given polygons, where
+    every polygon is a list of (N, 3) arrays of ring coordinates.
+
+    The result is byte-identical to the WKB of a QgsMultiPolygon built from
+    the same rings (open rings are closed by repeating their first vertex
+    and an empty geometry is a 2D MultiPolygon).
+    """
+    if len(polygons) == 0:
+        return struct.pack("<BII", 1, WKB_MULTIPOLYGON, 0)
+
+    parts = [struct.pack("<BII", 1, WKB_MULTIPOLYGONZ, len(polygons))]
+    for polygon in polygons:
+        parts.append(struct.pack("<BII", 1, WKB_POLYGONZ, len(polygon)))
+        for ring in polygon:
+            ring = np.ascontiguousarray(ring, dtype="<f8")
+            if len(ring) > 0 and (ring[0] != ring[-1]).any():
+                ring = np.concatenate([ring, ring[:1]])
+            parts.append(struct.pack("<I", len(ring)))
+            parts.append(ring.tobytes())
+
+    return b"".join(parts)
+
+def geometry_from_wkb(wkb):
+    """Returns a QgsGeometry from the given WKB"""
+    geometry = QgsGeometry()
+    geometry.fromWkb(wkb)
+
+    return geometry
+
+class FlatBoundaries:
+    """The polygons of a CityJSON boundaries list as flat arrays.
+
+    Attributes:
+    indices -- the vertex indices of all rings
+    ring_offsets -- the start of every ring in indices (plus the end)
+    polygon_offsets -- the first ring of every polygon (plus the end)
+    shell_offsets -- the first polygon of every shell (plus the end); a
+    MultiSurface is a single shell
+    semantic_values -- the semantic surface index of every polygon (or None)
+    """
+
+    def __init__(self, indices, ring_offsets, polygon_offsets, shell_offsets, semantic_values):
+        self.indices = indices
+        self.ring_offsets = ring_offsets
+        self.polygon_offsets = polygon_offsets
+        self.shell_offsets = shell_offsets
+        self.semantic_values = semantic_values
+
+    def __len__(self):
+        return len(self.polygon_offsets) - 1
+
+class FlatPolygons:
+    """Polygons as flat arrays of coordinates and offsets, along with their
+    semantic surfaces.
+
+    Attributes:
+    coords -- the (N, 3) coordinates of all rings
+    ring_offsets -- the start of every ring in coords (plus the end)
+    polygon_offsets -- the first ring of every polygon (plus the end)
+    semantics -- the semantic surface object of every polygon (or None)
+    """
+
+    def __init__(self, coords, ring_offsets, polygon_offsets, semantics):
+        self.coords = coords
+        self.ring_offsets = ring_offsets
+        self.polygon_offsets = polygon_offsets
+        self.semantics = semantics
+
+    def __len__(self):
+        return len(self.polygon_offsets) - 1
+
+    @classmethod
+    def concatenate(cls, parts):
+        """Returns the polygons of all the given FlatPolygons"""
+        coords = [np.empty((0, 3), dtype=np.float64)]
+        ring_offsets = [np.zeros(1, dtype=np.int64)]
+        polygon_offsets = [np.zeros(1, dtype=np.int64)]
+        semantics = []
+
+        vertex_count = 0
+        ring_count = 0
+        for part in parts:
+            coords.append(part.coords)
+            ring_offsets.append(part.ring_offsets[1:] + vertex_count)
+            polygon_offsets.append(part.polygon_offsets[1:] + ring_count)
+            semantics.extend(part.semantics)
+            vertex_count += part.ring_offsets[-1]
+            ring_count += part.polygon_offsets[-1]
+
+        return cls(np.concatenate(coords),
+                   np.concatenate(ring_offsets),
+                   np.concatenate(polygon_offsets),
+                   semantics)
+
+    def get_rings(self, polygon_index):
+        """Returns the list of (N, 3) ring coordinates of a polygon"""
+        first = self.polygon_offsets[polygon_index]
+        last = self.polygon_offsets[polygon_index + 1]
+        return [self.coords[self.ring_offsets[r]:self.ring_offsets[r + 1]]
+                for r in range(first, last)]
+
+    def to_list(self):
+        """Returns the polygons as lists of ring coordinates"""
+        return [self.get_rings(i) for i in range(len(self))]
+
+    def take(self, polygon_indices):
+        """Returns the polygons of the given indices, in their order"""
+        polygon_indices = np.asarray(polygon_indices, dtype=np.int64)
+        first_rings = self.polygon_offsets[polygon_indices]
+        ring_counts = self.polygon_offsets[polygon_indices + 1] - first_rings
+        rings = get_ranges(first_rings, ring_counts)
+
+        first_vertices = self.ring_offsets[rings]
+        vertex_counts = self.ring_offsets[rings + 1] - first_vertices
+
+        return FlatPolygons(self.coords[get_ranges(first_vertices, vertex_counts)],
+                            get_offsets(vertex_counts),
+                            get_offsets(ring_counts),
+                            [self.semantics[i] for i in polygon_indices.tolist()])
+
+    def group_by_semantics(self):
+        """Returns (semantic surface, FlatPolygons) pairs with the polygons
+        of every distinct semantic surface object, in the order they first
+        appear. The polygons without semantics are grouped together.
+        """
+        groups = {}
+        surfaces = {}
+        for i, semantic in enumerate(self.semantics):
+            groups.setdefault(id(semantic), []).append(i)
+            surfaces[id(semantic)] = semantic
+
+        return [(surfaces[key], self.take(indices)) for key, indices in groups.items()]
+
+    def wkb_vertices(self):
+        """Returns the index in coords of every point of the rings in the
+        WKB of `to_wkb`, and the number of points of every ring. Rings that
+        aren't closed get their first vertex again at their end, as QGIS
+        closes the rings of polygons.
+        """
+        starts = self.ring_offsets[:-1]
+        lengths = np.diff(self.ring_offsets)
+
+        is_open = lengths > 0
+        last = starts[is_open] + lengths[is_open] - 1
+        is_open[is_open] = (self.coords[starts[is_open]] != self.coords[last]).any(axis=1)
+
+        point_counts = lengths + is_open
+        vertices = get_ranges(starts, point_counts)
+        ring_of_point = np.repeat(np.arange(len(lengths)), point_counts)
+
+        # The closing point of a ring is past its last vertex
+        closing = vertices - starts[ring_of_point] == lengths[ring_of_point]
+        vertices[closing] = starts[ring_of_point[closing]]
+
+        return vertices, point_counts
+
+    def wkb_coordinate_bytes(self):
+        """Returns the positions of the bytes of every point in the WKB of
+        `to_wkb`, in the order of `wkb_vertices`
+        """
+        _, point_counts = self.wkb_vertices()
+        polygon_lengths = np.diff(self.polygon_offsets)
+        ring_of_point = np.repeat(np.arange(len(point_counts)), point_counts)
+        polygon_of_ring = np.repeat(np.arange(len(polygon_lengths)), polygon_lengths)
+
+        # Every point follows the multipolygon header, the headers of its
+        # polygon and the ones before, the lengths of its ring and the ones
+        # before, and the 24 bytes of every previous point
+        starts = (9 + 9 * (polygon_of_ring[ring_of_point] + 1) +
+                  4 * (ring_of_point + 1) + 24 * np.arange(len(ring_of_point)))
+
+        return (starts[:, np.newaxis] + np.arange(24)).ravel()
+
+    def to_wkb(self):
+        """Returns the WKB of a MultiPolygonZ made of the polygons"""
+        if len(self) == 0:
+            return struct.pack("<BII", 1, WKB_MULTIPOLYGON, 0)
+
+        vertices, point_counts = self.wkb_vertices()
+        points = np.ascontiguousarray(self.coords[vertices], dtype="<f8")
+        point_offsets = get_offsets(point_counts).tolist()
+        polygon_offsets = self.polygon_offsets.tolist()
+
+        parts = [struct.pack("<BII", 1, WKB_MULTIPOLYGONZ, len(self))]
+        for first, last in zip(polygon_offsets[:-1], polygon_offsets[1:]):
+            parts.append(struct.pack("<BII", 1, WKB_POLYGONZ, last - first))
+            for start, end in zip(point_offsets[first:last], point_offsets[first + 1:last + 1]):
+                parts.append(struct.pack("<I", end - start))
+                parts.append(points[start:end].tobytes())
+
+        return b"".join(parts)
+
+def get_offsets(lengths):
+    """Returns the offsets (starting with zero) of consecutive lengths"""
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return offsets
+
+def get_ranges(starts, lengths):
+    """Returns the concatenated ranges of the given starts and lengths"""
+    offsets = get_offsets(lengths)
+    return np.repeat(np.asarray(starts, dtype=np.int64) - offsets[:-1], lengths) + \
+        np.arange(offsets[-1], dtype=np.int64)
+
+def get_shells(boundaries, values):
+    """Returns the lists of polygons (shells) of a boundaries list along
+    with their lists of semantic values
+    """
+    if not isinstance(boundaries[0][0], list):
+        # A list of rings (e.g. a MultiLineString) is read as one polygon
+        return [[boundaries]], [None]
+
+    depth = 0
+    probe = boundaries
+    while isinstance(probe[0][0][0], list):
+        probe = probe[0]
+        depth += 1
+
+    shells = [boundaries]
+    shell_values = [values]
+    for _ in range(depth):
+        new_shells = []
+        new_values = []
+        for shell, value in zip(shells, shell_values):
+            new_shells.extend(shell)
+            if value is None:
+                new_values.extend([None] * len(shell))
+            else:
+                new_values.extend(value)
+        shells = new_shells
+        shell_values = new_values
+
+    return shells, shell_values
+
+def flatten_boundaries(boundaries, values=None):
+    """Returns the polygons of a boundaries list (of any depth) as
+    FlatBoundaries, in linear time
+    """
+    shells, shell_values = get_shells(boundaries, values)
+
+    polygons = list(chain.from_iterable(shells))
+    semantic_values = []
+    for shell, value in zip(shells, shell_values):
+        if value is None:
+            semantic_values.extend([None] * len(shell))
+        else:
+            semantic_values.extend(value)
+
+    rings = list(chain.from_iterable(polygons))
+    ring_lengths = [len(ring) for ring in rings]
+    indices = np.fromiter(chain.from_iterable(rings),
+                          dtype=np.int64,
+                          count=sum(ring_lengths))
+
+    return FlatBoundaries(indices,
+                          get_offsets(ring_lengths),
+                          get_offsets([len(polygon) for polygon in polygons]),
+                          get_offsets([len(shell) for shell in shells]),
+                          semantic_values)
+
 def read_boundaries(boundaries, surfaces, values):
     """Return the polygons from a boundaries list"""
+    shells, shell_values = get_shells(boundaries, values)
+
     polygons = []
     semantic_surfaces = []
-
-    if isinstance(boundaries[0][0], list):
-        if values is not None:
-            values_iter = iter(values)
-        else:
-            values_iter = iter([None for i in range(len(boundaries))])
-        for boundary in boundaries:
-            new_polygons, new_semantic_surfaces = read_boundaries(boundary, surfaces, next(values_iter))
-            polygons = polygons + new_polygons
-            semantic_surfaces = semantic_surfaces + new_semantic_surfaces
-    else:
-        polygons.append(boundaries)
-        if surfaces is None or values is None:
-            semantic_surfaces.append(None)
+    for shell, value in zip(shells, shell_values):
+        polygons.extend(shell)
+        if surfaces is None or value is None:
+            semantic_surfaces.extend([None] * len(shell))
         else:
-            semantic_surfaces.append(surfaces[values])
+            semantic_surfaces.extend([None if v is None else surfaces[v]
+                                      for v in value])
 
     return polygons, semantic_surfaces
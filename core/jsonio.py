@@ -0,0 +1,305 @@
+"""A module to parse JSON with the fastest library that is installed.
+
+orjson, ujson and simplejson are used in this order if available, and the
+standard library otherwise. Files are memory-mapped: orjson parses the
+memory map itself, ujson needs one copy of it as bytes, and simplejson and
+the standard library need it decoded to one large Python string.
+
+`peek_members` reads only some top-level members of a file (e.g. the
+metadata of a city model) and skips the others without parsing them.
+"""
+
+import json
+import mmap
+import os
+import re
+
+import numpy as np
+
+try:
+    import orjson
+    has_orjson = True
+except ImportError:
+    has_orjson = False
+
+try:
+    import ujson
+    has_ujson = True
+except ImportError:
+    has_ujson = False
+
+try:
+    import simplejson
+    has_simplejson = True
+except ImportError:
+    has_simplejson = False
+
+UTF8_BOM = b"\xef\xbb\xbf"
+
+def get_backends():
+    """Returns the names of the available JSON libraries, fastest first"""
+    backends = []
+    if has_orjson:
+        backends.append("orjson")
+    if has_ujson:
+        backends.append("ujson")
+    if has_simplejson:
+        backends.append("simplejson")
+    backends.append("json")
+
+    return backends
+
+def get_json_backend():
+    """Returns the name of the JSON library used by default"""
+    return get_backends()[0]
+
+def loads(data, backend=None):
+    """Parses JSON from bytes (or a str) with the given library, or the
+    fastest one available
+    """
+    if backend is None:
+        backend = get_json_backend()
+
+    if backend == "orjson":
+        return orjson.loads(data)
+    if backend == "ujson":
+        return ujson.loads(data)
+    if backend == "simplejson":
+        return simplejson.loads(data)
+    if backend == "json":
+        return json.loads(data)
+
+    raise ValueError("Unknown JSON backend: {}".format(backend))
+
+def load_file(filepath, backend=None):
+    """Parses a JSON file (with or without a UTF-8 BOM) through a memory
+    map of it. Only orjson reads the memory map without copying it; the
+    other libraries get one copy of it, as bytes (ujson) or as a string.
+    """
+    if backend is None:
+        backend = get_json_backend()
+
+    with open(filepath, "rb") as file:
+        # Empty files can't be memory-mapped
+        if os.fstat(file.fileno()).st_size == 0:
+            return loads(b"", backend)
+
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            start = len(UTF8_BOM) if buffer[:len(UTF8_BOM)] == UTF8_BOM else 0
+            view = memoryview(buffer)[start:]
+            try:
+                if backend == "orjson":
+                    return orjson.loads(view)
+                if backend == "ujson":
+                    return ujson.loads(view.tobytes())
+
+                # Decoded straight from the memory map, without a copy of
+                # it as bytes first
+                return loads(str(view, "utf-8"), backend)
+            finally:
+                view.release()
+
+WHITESPACE = re.compile(rb"[ \t\n\r]*")
+# The rest of a string after its opening quote, up to its closing quote
+STRING_REST = re.compile(rb'[^"\\]*(?:\\.[^"\\]*)*"', re.S)
+PRIMITIVE_END = re.compile(rb"[,\]} \t\n\r]")
+
+BRACKET_DELTAS = np.zeros(256, dtype=np.int8)
+BRACKET_DELTAS[[ord("["), ord("{")]] = 1
+BRACKET_DELTAS[[ord("]"), ord("}")]] = -1
+
+class JsonScanner:
+    """A class that reads the members of a JSON object from a file block
+    by block. The values of the members that aren't needed are skipped by
+    matching brackets, without parsing them.
+    """
+
+    def __init__(self, file, block_size=1024 * 1024):
+        self._file = file
+        self._block_size = block_size
+        self._buffer = b""
+        self._pos = 0
+        self._mark = None
+        # The stop key that `read_members` stopped at, if any
+        self.stopped_at = None
+
+    def _fill(self):
+        """Reads the next block, dropping what was consumed and isn't
+        marked. Returns False at the end of the file.
+        """
+        keep = self._pos if self._mark is None else min(self._pos, self._mark)
+        self._buffer = self._buffer[keep:]
+        self._pos -= keep
+        if self._mark is not None:
+            self._mark -= keep
+
+        block = self._file.read(self._block_size)
+        if not block:
+            return False
+
+        self._buffer += block
+        return True
+
+    def _fill_or_fail(self):
+        """Reads the next block or raises an error at the end of the file"""
+        if not self._fill():
+            raise ValueError("Unexpected end of JSON data")
+
+    def _peek(self):
+        """Skips whitespace and returns the next byte"""
+        while True:
+            self._pos = WHITESPACE.match(self._buffer, self._pos).end()
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos:self._pos + 1]
+            self._fill_or_fail()
+
+    def _expect(self, char):
+        """Consumes the next byte, which must be the given one"""
+        if self._peek() != char:
+            raise ValueError("Expected {} in JSON data".format(char.decode()))
+        self._pos += 1
+
+    def _skip_string_rest(self):
+        """Skips a string whose opening quote has been consumed"""
+        while True:
+            match = STRING_REST.match(self._buffer, self._pos)
+            if match is not None:
+                self._pos = match.end()
+                return
+            self._fill_or_fail()
+
+    def _count_backslashes(self, end, carried):
+        """Returns the number of backslashes right before end, including the
+        ones carried over from the previous block
+        """
+        count = 0
+        while end - count > self._pos and self._buffer[end - count - 1] == 0x5c:
+            count += 1
+        if end - count == self._pos:
+            count += carried
+        return count
+
+    def _skip_container(self):
+        """Skips an array or object, starting at its opening bracket.
+
+        Every block is scanned with NumPy: the quotes that aren't escaped
+        tell which brackets are in strings, and the others give the depth.
+        The state is carried over between blocks.
+        """
+        depth = 0
+        in_string = 0
+        backslashes = 0
+        while True:
+            segment = np.frombuffer(self._buffer, dtype=np.uint8, offset=self._pos)
+            deltas = BRACKET_DELTAS[segment]
+            brackets = np.flatnonzero(deltas)
+            quotes = np.flatnonzero(segment == 0x22)
+
+            # A quote is escaped if it follows an odd number of backslashes
+            after_backslash = np.flatnonzero(segment[np.maximum(quotes - 1, 0)] == 0x5c)
+            if backslashes > 0 and len(quotes) > 0 and quotes[0] == 0:
+                after_backslash = np.union1d(after_backslash, [0])
+            escaped = [i for i in after_backslash.tolist()
+                       if self._count_backslashes(self._pos + int(quotes[i]), backslashes) % 2 == 1]
+            if escaped:
+                quotes = np.delete(quotes, escaped)
+            backslashes = self._count_backslashes(len(self._buffer), backslashes)
+
+            outside = (np.searchsorted(quotes, brackets) + in_string) % 2 == 0
+            brackets = brackets[outside]
+            depths = depth + np.cumsum(deltas[brackets], dtype=np.int64)
+
+            # The segment starts with the opening bracket (or continues
+            # inside the container), so the depth only drops to zero when
+            # the container is closed
+            closed = np.flatnonzero(depths == 0)
+            if len(closed) > 0:
+                self._pos += int(brackets[closed[0]]) + 1
+                return
+
+            if len(depths) > 0:
+                depth = int(depths[-1])
+            in_string = (in_string + len(quotes)) % 2
+            self._pos = len(self._buffer)
+            self._fill_or_fail()
+
+    def skip_value(self):
+        """Skips the next value"""
+        char = self._peek()
+        if char == b'"':
+            self._pos += 1
+            self._skip_string_rest()
+        elif char in (b"[", b"{"):
+            self._skip_container()
+        else:
+            while True:
+                match = PRIMITIVE_END.search(self._buffer, self._pos)
+                if match is not None:
+                    self._pos = match.start()
+                    return
+                if not self._fill():
+                    self._pos = len(self._buffer)
+                    return
+
+    def read_value(self):
+        """Parses and returns the next value"""
+        self._peek()
+        self._mark = self._pos
+        try:
+            self.skip_value()
+            return loads(self._buffer[self._mark:self._pos])
+        finally:
+            self._mark = None
+
+    def read_members(self, keys, optional=(), stop_keys=()):
+        """Returns the given members of the JSON object at the start of the
+        file, along with the optional ones that are found. Reading stops as
+        soon as all of them have been found, or at one of the stop keys
+        (e.g. of large members) once only optional members remain. Then
+        `stopped_at` is that key, and calling `read_members` again resumes
+        from it to read members that come after it.
+        """
+        members = {}
+        remaining = set(keys)
+        remaining_optional = set(optional) - remaining
+
+        key = self.stopped_at
+        self.stopped_at = None
+        if key is None:
+            if self._peek() == UTF8_BOM[:1] and self._buffer.startswith(UTF8_BOM, self._pos):
+                self._pos += len(UTF8_BOM)
+
+            self._expect(b"{")
+            if self._peek() == b"}":
+                return members
+
+        while remaining or remaining_optional:
+            if key is None:
+                key = self.read_value()
+                if not remaining and key in stop_keys:
+                    self.stopped_at = key
+                    break
+
+            self._expect(b":")
+            if key in remaining or key in remaining_optional:
+                members[key] = self.read_value()
+                remaining.discard(key)
+                remaining_optional.discard(key)
+            else:
+                self.skip_value()
+            key = None
+
+            if self._peek() == b",":
+                self._pos += 1
+            else:
+                self._expect(b"}")
+                break
+
+        return members
+
+def peek_members(filepath, keys, optional=(), stop_keys=()):
+    """Returns the given top-level members of a JSON file, without parsing
+    the values of the other members (see `JsonScanner.read_members`)
+    """
+    with open(filepath, "rb") as file:
+        return JsonScanner(file).read_members(keys, optional, stop_keys)
@@ -2,9 +2,108 @@
 
 import abc
 
-from PyQt5.QtCore import QSettings, QTranslator, qVersion, QCoreApplication, QVariant
+from PyQt5.QtCore import QSettings, QTranslator, qVersion, QCoreApplication, QDate, Qt, QVariant
 from qgis.core import QgsFeature, QgsField, QgsFields, QgsVectorLayer
 
+from .geometry import geometry_from_wkb
+from .schema import ModelSchema
+
+# The field types of the type names inferred by the model schema
+FIELD_TYPES = {
+    "bool": QVariant.Bool,
+    "int": QVariant.Int,
+    "int64": QVariant.LongLong,
+    "double": QVariant.Double,
+    "date": QVariant.Date,
+    "string": QVariant.String,
+    None: QVariant.String
+}
+
+def to_string(value):
+    """Returns the value as a string (e.g. a list as its representation)"""
+    if isinstance(value, str):
+        return value
+
+    return str(value)
+
+def to_date(value):
+    """Returns the QDate of an ISO date string"""
+    if isinstance(value, str):
+        return QDate.fromString(value, Qt.ISODate)
+
+    return value
+
+# The conversion of the values of the field types that need one
+FIELD_CONVERTERS = {
+    QVariant.String: to_string,
+    QVariant.Date: to_date
+}
+
+class FieldMap:
+    """A class that maps the names of the fields to their indices, so that
+    the attributes of a feature are filled in a list by index
+
+    The prefixed names of the attributes of city objects and semantic
+    surfaces are also mapped by their original keys.
+    """
+
+    def __init__(self, fields):
+        self.fields = fields
+        self.indices = {field.name(): i for i, field in enumerate(fields)}
+        self.converters = [FIELD_CONVERTERS.get(field.type()) for field in fields]
+        self.attribute_indices = self.get_prefixed_indices("attribute.")
+        self.surface_indices = self.get_prefixed_indices("surface.")
+
+    def get_prefixed_indices(self, prefix):
+        """Returns the indices of the fields with the given prefix, by their
+        names without it
+        """
+        return {name[len(prefix):]: index
+                for name, index in self.indices.items()
+                if name.startswith(prefix)}
+
+    def new_attributes(self):
+        """Returns an empty (null) list of attributes"""
+        return [None] * len(self.converters)
+
+    def set_value(self, attributes, index, value):
+        """Sets the value of the field of the given index, converted to the
+        field's type
+        """
+        converter = self.converters[index]
+        if converter is not None and value is not None:
+            value = converter(value)
+        attributes[index] = value
+
+    def set(self, attributes, name, value):
+        """Sets the value of the field with the given name, if it exists"""
+        index = self.indices.get(name)
+        if index is not None:
+            self.set_value(attributes, index, value)
+
+    def set_all(self, attributes, indices, values):
+        """Sets the values of a dictionary to the fields of their keys in
+        indices (e.g. `attribute_indices`)
+        """
+        for key, value in values.items():
+            index = indices.get(key)
+            if index is not None:
+                self.set_value(attributes, index, value)
+
+    def create_feature(self, attributes):
+        """Returns a new feature with the given attributes"""
+        feature = QgsFeature(self.fields)
+        feature.setAttributes(attributes)
+
+        return feature
+
+def get_schema(citymodel, schema=None):
+    """Returns the given schema, or discovers the schema of the city model"""
+    if schema is None:
+        return ModelSchema.from_citymodel(citymodel)
+
+    return schema
+
 class BaseLayerManager:
     """A base layer manager for the common functionality between current ones"""
 
@@ -13,6 +112,7 @@ class BaseLayerManager:
         self._fields_builder = fields_builder
         self._geom_type = "MultiPolygonZ"
         self._fields = QgsFields()
+        self._field_map = FieldMap(self._fields)
         if srid is None:
             if "crs" in self._citymodel["metadata"]:
                 srid = self._citymodel["metadata"]["crs"]["epsg"]
@@ -23,6 +123,7 @@ class BaseLayerManager:
     def prepare_attributes(self):
         """Prepares the attributes of the vector layer."""
         self._fields = self._fields_builder.get_fields()
+        self._field_map = FieldMap(self._fields)
 
         # Setup attributes on the datasource(s)
         for vl in self.get_all_layers():
@@ -30,34 +131,72 @@ class BaseLayerManager:
             pr.addAttributes(self._fields)
             vl.updateFields()
 
+    def get_fields(self):
+        """Returns the fields of the vector layer(s)"""
+        return self._fields
+
+    def get_field_map(self):
+        """Returns the map of the names of the fields to their indices"""
+        return self._field_map
+
     @abc.abstractmethod
     def get_all_layers(self):
         """Returns all vector layers of the manager"""
         return
 
 class DynamicLayerManager(BaseLayerManager):
-    """A class that create a simple layer for all city objects"""
+    """A class that create a simple layer for all city objects
+
+    Features are buffered per layer and added to the providers in batches
+    of `batch_size`. Call `flush` once all objects have been added.
+    """
 
-    def __init__(self, citymodel, feature_builder, layer_iterator, fields_builder, srid=None):
+    def __init__(self, citymodel, feature_builder, layer_iterator, fields_builder, srid=None, batch_size=1000):
         super(DynamicLayerManager, self).__init__(citymodel,
                                                   fields_builder,
                                                   srid)
 
         self._feature_builder = feature_builder
         self._layer_iterator = layer_iterator
+        self._batch_size = batch_size
         self._vectorlayers = dict()
+        self._providers = dict()
+        self._buffers = dict()
         for name in self._layer_iterator.all_layers():
             vl = QgsVectorLayer(self._geom_type, name, "memory")
             self._vectorlayers[name] = vl
+            self._providers[name] = vl.dataProvider()
+            self._buffers[name] = []
 
     def add_object(self, object_key, cityobject):
         """Adds a cityobject in the respective vector layer"""
-        new_features = self._feature_builder.create_features(self._fields, object_key, cityobject)
+        new_features = self._feature_builder.create_features(self._field_map, object_key, cityobject)
 
+        self.add_features(new_features)
+
+    def add_features(self, new_features):
+        """Adds already created features in the respective vector layers"""
         for feature in new_features:
             layer_name = self._layer_iterator.get_feature_layer(feature)
-            provider = self._vectorlayers[layer_name].dataProvider()
-            provider.addFeature(feature)
+            buffer = self._buffers[layer_name]
+            buffer.append(feature)
+            if len(buffer) >= self._batch_size:
+                self._flush_layer(layer_name)
+
+    def _flush_layer(self, layer_name):
+        """Adds the buffered features of a layer to its provider"""
+        buffer = self._buffers[layer_name]
+        if buffer:
+            self._providers[layer_name].addFeatures(buffer)
+            self._buffers[layer_name] = []
+
+    def flush(self):
+        """Adds all buffered features to the layers and updates their
+        extents
+        """
+        for layer_name, vl in self._vectorlayers.items():
+            self._flush_layer(layer_name)
+            vl.updateExtents()
 
     def get_all_layers(self):
         """Returns all the vector layers from this manager."""
@@ -80,14 +219,18 @@ class BaseNamingIterator:
 class TypeNamingIterator:
     """A class that iterates through the types"""
 
-    def __init__(self, filename, citymodel):
+    def __init__(self, filename, citymodel, schema=None):
         self._filename = filename
         self._citymodel = citymodel
+        self._schema = schema
 
     def all_layers(self):
         """Returns the all layer names"""
-        types = set([obj["type"]
-                     for obj in self._citymodel["CityObjects"].values()])
+        if self._schema is not None:
+            types = self._schema.object_types
+        else:
+            types = set([obj["type"]
+                         for obj in self._citymodel["CityObjects"].values()])
 
         for t in types:
             yield "{} - {}".format(self._filename, t)
@@ -99,18 +242,26 @@ class TypeNamingIterator:
 class LodNamingDecorator:
     """A decorator class to append LoD in a layer's name"""
 
-    def __init__(self, decorated, filename, citymodel, geometry_reader):
+    def __init__(self, decorated, filename, citymodel, geometry_reader, schema=None,
+                 lods=None):
         self._decorated = decorated
         self._filename = filename
         self._citymodel = citymodel
         self._geometry_reader = geometry_reader
 
-        lods = [self._geometry_reader.get_lod(geom)
-                for obj in citymodel["CityObjects"].values()
-                if "geometry" in obj
-                for geom in obj["geometry"]]
-        lods.append(None)
-        self._lods = set(lods)
+        if schema is not None:
+            model_lods = list(schema.lods)
+        else:
+            model_lods = [self._geometry_reader.get_lod(geom)
+                          for obj in citymodel["CityObjects"].values()
+                          if "geometry" in obj
+                          for geom in obj["geometry"]]
+        # Only the layers of the LoDs to load are created
+        if lods is not None:
+            lods = set(str(lod) for lod in lods)
+            model_lods = [lod for lod in model_lods if str(lod) in lods]
+        model_lods.append(None)
+        self._lods = set(model_lods)
 
     def all_layers(self):
         """Returns all layer names with LoD"""
@@ -144,33 +295,33 @@ class NullFieldsBuilder:
         return QgsFields()
 
 class AttributeFieldsDecorator:
-    """A class that create fields based on the attributes of the city model"""
+    """A class that create fields based on the attributes of the city model
 
-    def __init__(self, decorated, citymodel):
+    The type of every field is inferred from the values of the attribute.
+    A `schema` can be given, so that the model is only scanned once.
+    """
+
+    def __init__(self, decorated, citymodel, schema=None):
         self._decorated = decorated
         self._citymodel = citymodel
+        self._schema = schema
 
     def get_attribute_keys(self, objs):
         """Returns the list of (unique) attributes found in all city objects."""
-        atts = []
-
-        for obj in objs.values():
-            if "attributes" in obj:
-                for att_key in obj["attributes"]:
-                    if not att_key in atts:
-                        atts.append(att_key)
+        schema = ModelSchema()
+        schema.add_objects(objs.values())
 
-        return atts
+        return list(schema.attributes)
 
     def get_fields(self):
         """Create and returns fields"""
         fields = self._decorated.get_fields()
 
-        attributes = self.get_attribute_keys(self._citymodel["CityObjects"])
+        self._schema = get_schema(self._citymodel, self._schema)
 
-        for att in attributes:
+        for att, att_type in self._schema.attributes.items():
             fields.append(QgsField("attribute.{}".format(att),
-                                   QVariant.String))
+                                   FIELD_TYPES[att_type]))
 
         return fields
 
@@ -189,73 +340,82 @@ class LodFieldsDecorator:
         return fields
 
 class SemanticSurfaceFieldsDecorator:
-    """A class that creates an LoD field"""
+    """A class that creates fields for the attributes of semantic surfaces"""
 
-    def __init__(self, decorated, citymodel):
+    def __init__(self, decorated, citymodel, schema=None):
         self._decorated = decorated
         self._citymodel = citymodel
+        self._schema = schema
 
     def get_semantic_attributes(self, objs):
         """Returns the list of (unique) attributes found in all city objects."""
-        atts = []
-
-        for obj in objs.values():
-            if "geometry" in obj:
-                for geom in obj["geometry"]:
-                    if "semantics" in geom:
-                        for surface in geom["semantics"]["surfaces"]:
-                            for att_key in surface:
-                                if not att_key in atts:
-                                    atts.append(att_key)
+        schema = ModelSchema()
+        schema.add_objects(objs.values())
 
-        return atts
+        return list(schema.semantic_attributes)
 
     def get_fields(self):
         """Create and returns fields"""
         fields = self._decorated.get_fields()
 
-        attributes = self.get_semantic_attributes(self._citymodel["CityObjects"])
+        self._schema = get_schema(self._citymodel, self._schema)
 
-        for att in attributes:
+        for att, att_type in self._schema.semantic_attributes.items():
             fields.append(QgsField("surface.{}".format(att),
-                                   QVariant.String))
+                                   FIELD_TYPES[att_type]))
 
         return fields
 
 class SimpleFeatureBuilder:
-    """A class that create features according to their attributes"""
+    """A class that create features according to their attributes
+
+    With `lods`, only the geometries of these LoDs (as strings) are read,
+    and objects that only have geometries of other LoDs are skipped.
+    """
 
-    def __init__(self, geometry_reader):
+    def __init__(self, geometry_reader, lods=None):
         self._geometry_reader = geometry_reader
+        self._lods = None if lods is None else set(str(lod) for lod in lods)
+
+    def filter_geometries(self, geometries):
+        """Returns the geometries of the LoDs to load"""
+        if self._lods is None:
+            return geometries
+
+        return [geom for geom in geometries
+                if str(self._geometry_reader.get_lod(geom)) in self._lods]
 
-    def create_features(self, fields, object_key, cityobject, read_geometry=True):
+    def create_features(self, field_map, object_key, cityobject, read_geometry=True):
         """Creates a feature based on the city object's semantics"""
-        new_feature = QgsFeature(fields)
-        new_feature["uid"] = object_key
-        new_feature["type"] = cityobject["type"]
+        if "geometry" in cityobject:
+            return_geom = self.filter_geometries(cityobject["geometry"])
+            if len(return_geom) == 0 and len(cityobject["geometry"]) > 0:
+                return {}
+        else:
+            return_geom = []
+
+        attributes = field_map.new_attributes()
+        field_map.set(attributes, "uid", object_key)
+        field_map.set(attributes, "type", cityobject["type"])
 
         if "parents" in cityobject:
             if len(cityobject["parents"]) == 1:
-                new_feature["parents"] = cityobject["parents"][0]
+                field_map.set(attributes, "parents", cityobject["parents"][0])
             else:
-                new_feature["parents"] = str(cityobject["parents"])
+                field_map.set(attributes, "parents", str(cityobject["parents"]))
 
         if "children" in cityobject:
-            new_feature["children"] = str(cityobject["children"])
+            field_map.set(attributes, "children", str(cityobject["children"]))
 
         # Load the attributes
         if "attributes" in cityobject:
-            for att_key, att_value in cityobject["attributes"].items():
-                new_feature["attribute.{}".format(att_key)] = att_value
+            field_map.set_all(attributes, field_map.attribute_indices, cityobject["attributes"])
 
-        if "geometry" in cityobject:
-            return_geom = cityobject["geometry"]
-            
-            if read_geometry:
-                geom = self._geometry_reader.read_geometry(cityobject["geometry"])
-                new_feature.setGeometry(geom)
-        else:
-            return_geom = []
+        new_feature = field_map.create_feature(attributes)
+
+        if "geometry" in cityobject and read_geometry:
+            geom = self._geometry_reader.read_geometry(return_geom)
+            new_feature.setGeometry(geom)
 
         return {new_feature: return_geom}
 
@@ -266,9 +426,9 @@ class LodFeatureDecorator:
         self._decorated = decorated
         self._geometry_reader = geometry_reader
 
-    def create_features(self, fields, object_key, cityobject, read_geometry=True):
+    def create_features(self, field_map, object_key, cityobject, read_geometry=True):
         """Creates features per LoD in the geometry"""
-        features = self._decorated.create_features(fields,
+        features = self._decorated.create_features(field_map,
                                                    object_key,
                                                    cityobject,
                                                    False)
@@ -281,10 +441,10 @@ class LodFeatureDecorator:
                 for geom in feature_geom:
                     lod_geom_dict.setdefault(self._geometry_reader.get_lod(geom), []).append(geom)
 
+                attributes = feature.attributes()
                 for lod, geom in lod_geom_dict.items():
-                    new_feature = QgsFeature(feature)
-
-                    new_feature["lod"] = lod
+                    field_map.set(attributes, "lod", lod)
+                    new_feature = field_map.create_feature(attributes)
                     if read_geometry:
                         qgs_geometry = self._geometry_reader.read_geometry(geom)
                         new_feature.setGeometry(qgs_geometry)
@@ -296,11 +456,17 @@ class LodFeatureDecorator:
         return return_features
 
 class SemanticSurfaceFeatureDecorator:
-    """A class that decorates feature with lod information and geometries"""
+    """A class that decorates features with the attributes and geometries
+    of their semantic surfaces
 
-    def __init__(self, decorated, geometry_reader):
+    Every polygon becomes a feature, or, with `group_by_surface`, every
+    semantic surface object (with all of its polygons).
+    """
+
+    def __init__(self, decorated, geometry_reader, group_by_surface=False):
         self._decorated = decorated
         self._geometry_reader = geometry_reader
+        self._group_by_surface = group_by_surface
     
     def semantic_to_string(self, semantic):
         """Returns a string from a semantic surface object"""
@@ -309,32 +475,56 @@ class SemanticSurfaceFeatureDecorator:
         else:
             return semantic["type"]
 
-    def create_features(self, fields, object_key, cityobject, read_geometry=True):
+    def create_features(self, field_map, object_key, cityobject, read_geometry=True):
         """Creates features per semantic surface in each geometry"""
-        features = self._decorated.create_features(fields,
+        features = self._decorated.create_features(field_map,
                                                    object_key,
                                                    cityobject,
                                                    False)
         return_features = {}
 
         for feature, feature_geom in features.items():
-            polygons, semantics = self._geometry_reader.get_polygons(feature_geom)
+            if feature_geom:
+                flat_polygons = self._geometry_reader.read_flat_polygons(feature_geom)
+            else:
+                flat_polygons = None
 
-            if len(polygons) > 1:
-                surf_geom_dict = {}
-                for polygon, semantic in zip(polygons, semantics):
-                    new_feature = QgsFeature(feature)
+            # Objects without polygons are kept as one feature without geometry
+            if flat_polygons is None or len(flat_polygons) == 0:
+                return_features[feature] = feature_geom
+                continue
 
-                    if not semantic is None:
-                        for att in semantic:
-                            new_feature[f"surface.{att}"] = semantic[att]
+            if self._group_by_surface:
+                groups = flat_polygons.group_by_semantics()
+            else:
+                groups = [(semantic, flat_polygons.take([i]))
+                          for i, semantic in enumerate(flat_polygons.semantics)]
 
-                    if read_geometry:
-                        qgs_geometry = self._geometry_reader.polygons_to_geometry([polygon])
-                        new_feature.setGeometry(qgs_geometry)
+            attributes = feature.attributes()
+            for semantic, polygons in groups:
+                surface_attributes = list(attributes)
+                if semantic is not None:
+                    field_map.set_all(surface_attributes, field_map.surface_indices, semantic)
+                new_feature = field_map.create_feature(surface_attributes)
 
-                    return_features[new_feature] = polygon #TODO: This is wrong! There must be a geometry here
-            else:
-                return_features[feature] = None
+                if read_geometry:
+                    new_feature.setGeometry(geometry_from_wkb(polygons.to_wkb()))
+
+                return_features[new_feature] = feature_geom
 
         return return_features
+
+def create_feature_builder(geometry_reader, lod_as='NONE', load_semantic_surfaces=False,
+                           group_semantic_surfaces=False, lods=None):
+    """Returns the feature builder for the given loading options"""
+    feature_builder = SimpleFeatureBuilder(geometry_reader, lods)
+
+    if lod_as in ['ATTRIBUTES', 'LAYERS']:
+        feature_builder = LodFeatureDecorator(feature_builder, geometry_reader)
+
+    if load_semantic_surfaces:
+        feature_builder = SemanticSurfaceFeatureDecorator(feature_builder,
+                                                          geometry_reader,
+                                                          group_semantic_surfaces)
+
+    return feature_builder
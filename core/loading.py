@@ -1,19 +1,20 @@
 """A module that provides the logic for loading CityJSON in QGIS"""
 
-import json
 import os
 import re
 
 from PyQt5.QtWidgets import QMessageBox
 from qgis.core import QgsProject
 
+from . import jsonio
 from .geometry import GeometryReader, VerticesCache
 from .layers import (AttributeFieldsDecorator, BaseFieldsBuilder,
                      BaseNamingIterator, DynamicLayerManager,
-                     LodFeatureDecorator, LodFieldsDecorator,
-                     LodNamingDecorator, SemanticSurfaceFeatureDecorator,
-                     SemanticSurfaceFieldsDecorator, SimpleFeatureBuilder,
-                     TypeNamingIterator)
+                     LodFieldsDecorator, LodNamingDecorator,
+                     SemanticSurfaceFieldsDecorator, TypeNamingIterator,
+                     create_feature_builder)
+from .parallel import ParallelConverter, iter_chunks
+from .schema import ModelSchema
 from .styling import (Copy2dStyling, NullStyling, SemanticSurfacesStyling,
                       is_3d_styling_available,
                       is_rule_based_3d_styling_available)
@@ -27,7 +28,12 @@ class CityJSONLoader:
                  divide_by_object=False,
                  lod_as='NONE',
                  load_semantic_surfaces=False,
-                 style_semantic_surfaces=False):
+                 style_semantic_surfaces=False,
+                 group_semantic_surfaces=False,
+                 lods=None,
+                 batch_size=1000,
+                 workers=1,
+                 chunk_size=1000):
         filename_with_ext = os.path.basename(filepath)
         filename, _ = os.path.splitext(filename_with_ext)
 
@@ -44,23 +50,40 @@ class CityJSONLoader:
         self.geometry_reader = GeometryReader(self.vertices_cache,
                                               geometry_templates)
 
+        self.lod_as = lod_as
+        self.load_semantic_surfaces = load_semantic_surfaces
+        self.group_semantic_surfaces = group_semantic_surfaces
+        self.lods = lods
+        self.workers = workers
+        self.chunk_size = chunk_size
+
+        # The outcome of the conversion, also kept when it is canceled
+        self.loaded_objects = 0
+        self.canceled = False
+
+        # Discover the attributes, types and LoDs of all objects in one pass
+        self.schema = ModelSchema.from_citymodel(citymodel)
+
         self.fields_builder = AttributeFieldsDecorator(BaseFieldsBuilder(),
-                                                       citymodel)
-        self.feature_builder = SimpleFeatureBuilder(self.geometry_reader)
+                                                       citymodel,
+                                                       self.schema)
 
         if lod_as in ['ATTRIBUTES', 'LAYERS']:
             self.fields_builder = LodFieldsDecorator(self.fields_builder)
-            self.feature_builder = LodFeatureDecorator(self.feature_builder,
-                                                       self.geometry_reader)
 
         if load_semantic_surfaces:
             self.fields_builder = SemanticSurfaceFieldsDecorator(self.fields_builder,
-                                                                 citymodel)
-            self.feature_builder = SemanticSurfaceFeatureDecorator(self.feature_builder,
-                                                                   self.geometry_reader)
+                                                                 citymodel,
+                                                                 self.schema)
+
+        self.feature_builder = create_feature_builder(self.geometry_reader,
+                                                      lod_as,
+                                                      load_semantic_surfaces,
+                                                      group_semantic_surfaces,
+                                                      lods)
 
         if divide_by_object:
-            self.naming_iterator = TypeNamingIterator(filename, citymodel)
+            self.naming_iterator = TypeNamingIterator(filename, citymodel, self.schema)
         else:
             self.naming_iterator = BaseNamingIterator(filename)
 
@@ -68,7 +91,9 @@ class CityJSONLoader:
             self.naming_iterator = LodNamingDecorator(self.naming_iterator,
                                                       filename,
                                                       citymodel,
-                                                      self.geometry_reader)
+                                                      self.geometry_reader,
+                                                      self.schema,
+                                                      lods)
 
         if epsg != "None":
             self.srid = epsg
@@ -76,19 +101,13 @@ class CityJSONLoader:
                                                  self.feature_builder,
                                                  self.naming_iterator,
                                                  self.fields_builder,
-                                                 self.srid)
+                                                 self.srid,
+                                                 batch_size)
 
         self.layer_manager.prepare_attributes()
 
-        if is_3d_styling_available():
-            self.styler = Copy2dStyling()
-        else:
-            self.styler = NullStyling()
-
-        if (load_semantic_surfaces
-                and is_rule_based_3d_styling_available()
-                and style_semantic_surfaces):
-            self.styler = SemanticSurfacesStyling()
+        self.styler = create_styler(load_semantic_surfaces,
+                                    style_semantic_surfaces)
 
     def init_vertices(self):
         """Initialises the vertices cache"""
@@ -99,46 +118,246 @@ class CityJSONLoader:
             self.vertices_cache.set_scale(self.citymodel["transform"]["scale"])
             self.vertices_cache.set_translation(self.citymodel["transform"]["translate"])
 
-        verts = self.citymodel["vertices"]
-        for v in verts:
-            self.vertices_cache.add_vertex(v)
+        self.vertices_cache.set_vertices(self.citymodel["vertices"])
 
     def load(self, feedback=None):
         """Loads a specified CityJSON file and returns the number of
         skipped geometries
         """
+        skipped_geometries = self.convert(feedback)
+        self.layer_manager.flush()
+        self.add_layers_to_project()
+
+        return skipped_geometries
+
+    def convert(self, feedback=None):
+        """Converts the city objects to features of the layers, without
+        adding the layers to the project, and returns the number of skipped
+        geometries.
+
+        Objects are converted in chunks of `chunk_size`. The progress is
+        reported, and cancellation checked, once per chunk.
+        """
         city_objects = self.citymodel["CityObjects"]
+        total = len(city_objects)
+
+        if self.workers > 1:
+            converter = ParallelConverter(self.layer_manager.get_fields(),
+                                          self.vertices_cache.as_array(),
+                                          self.citymodel.get("geometry-templates"),
+                                          self.lod_as,
+                                          self.load_semantic_surfaces,
+                                          self.group_semantic_surfaces,
+                                          self.lods,
+                                          self.workers,
+                                          self.chunk_size)
+            chunks = converter.convert(city_objects.items())
+        else:
+            chunks = iter_chunks(city_objects.items(), self.chunk_size)
+
+        for chunk in chunks:
+            if feedback is not None and feedback.isCanceled():
+                self.canceled = True
+                break
 
-        # Iterate through the city objects
-        current = 1
-        step = 100.0 / len(city_objects)
-        for key, obj in city_objects.items():
-            self.layer_manager.add_object(key, obj)
+            if self.workers > 1:
+                features, skipped, count = chunk
+                self.layer_manager.add_features(features)
+                self.geometry_reader.add_skipped_geometries(skipped)
+            else:
+                for key, obj in chunk:
+                    self.layer_manager.add_object(key, obj)
+                count = len(chunk)
 
+            self.loaded_objects += count
             if feedback is not None:
-                feedback.setProgress(int(current * step))
-            current = current + 1
+                feedback.setProgress(100 * self.loaded_objects // total)
+
+        return self.geometry_reader.skipped_geometries()
+
+    def statistics(self):
+        """Returns the counts of loaded objects, skipped geometries and
+        whether the conversion was canceled
+        """
+        return {"loaded_objects": self.loaded_objects,
+                "skipped_geometries": self.geometry_reader.skipped_geometries(),
+                "canceled": self.canceled}
+
+    def add_layers_to_project(self):
+        """Adds the layer(s) of the loader in a group of the project"""
+        add_layers_to_project(self.filename,
+                              self.layer_manager.get_all_layers(),
+                              self.styler)
+
+class CityJSONSeqReader:
+    """Class that reads a CityJSON Text Sequence (CityJSONL) file line by
+    line, so that only one CityJSONFeature is held in memory at a time
+    """
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.size = os.path.getsize(filepath)
+
+        with open(filepath, encoding='utf-8-sig') as file:
+            self.header = jsonio.loads(file.readline())
+
+    def features(self):
+        """Yields every CityJSONFeature of the file together with the
+        number of bytes read so far
+        """
+        with open(self.filepath, 'rb') as file:
+            # The first line is the CityJSON header
+            file.readline()
+            for line in file:
+                line = line.strip()
+                if not line:
+                    continue
+
+                feature = jsonio.loads(line)
+                if feature.get("type") != "CityJSONFeature":
+                    continue
+
+                yield feature, file.tell()
+
+    def get_citymodel(self):
+        """Returns a city model made of the header, where city objects
+        are streamed from the file every time they are iterated
+        """
+        citymodel = dict(self.header)
+        citymodel["CityObjects"] = CityObjectsStream(self)
+        citymodel["vertices"] = []
+
+        return citymodel
 
-        # Add the layer(s) to the project
-        root = QgsProject.instance().layerTreeRoot()
-        group = root.addGroup(self.filename)
-        for vl in self.layer_manager.get_all_layers():
-            QgsProject.instance().addMapLayer(vl, False)
-            group.addLayer(vl)
+class CityObjectsStream:
+    """A read-only view of the city objects of a CityJSONL file that parses
+    them from disk on every iteration
+    """
+
+    def __init__(self, reader):
+        self._reader = reader
+
+    def items(self):
+        """Yields the (id, city object) pairs of all features"""
+        for feature, _ in self._reader.features():
+            yield from feature["CityObjects"].items()
+
+    def values(self):
+        """Yields the city objects of all features"""
+        for _, obj in self.items():
+            yield obj
+
+    def __iter__(self):
+        for key, _ in self.items():
+            yield key
+
+class CityJSONSeqLoader(CityJSONLoader):
+    """Class that loads a CityJSONL file to a QGIS project, one feature
+    at a time
+    """
+
+    def __init__(self, filepath, reader=None, **kwargs):
+        if reader is None:
+            reader = CityJSONSeqReader(filepath)
+        self.reader = reader
+
+        super(CityJSONSeqLoader, self).__init__(filepath,
+                                                reader.get_citymodel(),
+                                                **kwargs)
+
+    def convert(self, feedback=None):
+        """Converts the CityJSONL file in chunks of `chunk_size` features
+        and returns the number of skipped geometries
+        """
+        for chunk in iter_chunks(self.reader.features(), self.chunk_size):
+            if feedback is not None and feedback.isCanceled():
+                self.canceled = True
+                break
+
+            for feature, position in chunk:
+                # Every feature comes with its own list of vertices
+                self.vertices_cache.set_vertices(feature["vertices"])
+
+                for key, obj in feature["CityObjects"].items():
+                    self.layer_manager.add_object(key, obj)
+                self.loaded_objects += len(feature["CityObjects"])
 
-            self.styler.apply(vl)
+            if feedback is not None and self.reader.size > 0:
+                feedback.setProgress(100 * position // self.reader.size)
 
         return self.geometry_reader.skipped_geometries()
 
-def load_cityjson_model(filepath):
-    """Returns the citymodel for the given filepath"""
+def create_styler(load_semantic_surfaces=False, style_semantic_surfaces=False):
+    """Returns the styling for the given loading options"""
+    if (load_semantic_surfaces
+            and is_rule_based_3d_styling_available()
+            and style_semantic_surfaces):
+        return SemanticSurfacesStyling()
+
+    if is_3d_styling_available():
+        return Copy2dStyling()
+
+    return NullStyling()
+
+def add_layers_to_project(group_name, layers, styler):
+    """Adds the given layers in a new group of the project and styles them"""
+    root = QgsProject.instance().layerTreeRoot()
+    group = root.addGroup(group_name)
+    for vl in layers:
+        QgsProject.instance().addMapLayer(vl, False)
+        group.addLayer(vl)
+
+        styler.apply(vl)
+
+def load_cityjson_model(filepath, backend=None):
+    """Returns the citymodel for the given filepath, parsed with the given
+    JSON library (see `jsonio.get_backends`) or the fastest one available
+    """
+    return jsonio.load_file(filepath, backend)
+
+
+# The top-level members needed to describe a file, without its objects
+HEADER_KEYS = ("type", "version", "metadata")
+# The members that many files don't have (e.g. "transform" in v1.0)
+OPTIONAL_HEADER_KEYS = ("transform", "+metadata-extended")
+# The large members, where reading stops once only optional ones remain
+BODY_KEYS = ("CityObjects", "vertices")
+
+def has_mandatory_transform(version):
+    """Returns True if the transform is mandatory in the given version of
+    CityJSON (from v1.1)
+    """
+    try:
+        return tuple(int(part) for part in str(version).split(".")[:2]) >= (1, 1)
+    except ValueError:
+        return False
+
+def peek_cityjson_header(filepath):
+    """Returns the header members of a CityJSON (or CityJSONL) file,
+    without parsing its city objects and vertices, and whether they are
+    complete.
+
+    Reading stops at the city objects or vertices once only optional
+    members remain. It only goes on past them for a transform that is
+    mandatory (and that some writers put at the end); otherwise the
+    header is not complete, as optional members might come after them.
+    """
+    if is_cityjsonseq(filepath):
+        return CityJSONSeqReader(filepath).header, True
+
+    with open(filepath, "rb") as file:
+        scanner = jsonio.JsonScanner(file)
+        header = scanner.read_members(HEADER_KEYS, OPTIONAL_HEADER_KEYS, BODY_KEYS)
 
-    file = open(filepath, encoding='utf-8-sig')
-    citymodel = json.load(file)
-    file.close()
+        if (scanner.stopped_at is not None and "transform" not in header
+                and has_mandatory_transform(header.get("version"))):
+            header.update(scanner.read_members(("transform",)))
 
-    return citymodel
+        return header, scanner.stopped_at is None
 
+def is_cityjsonseq(filepath):
+    """Returns True if the given file is a CityJSON Text Sequence"""
+    return filepath.lower().endswith(".jsonl")
 
 def get_model_epsg(citymodel):
     """Returns the EPSG of the city model, if exists it exists in
@@ -0,0 +1,140 @@
+"""A module that keeps parsed city models in memory, so that a file is only
+parsed once per session unless it changes
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+from .loading import load_cityjson_model
+from .settings import load_settings
+
+# The estimated memory of a parsed model, as a multiple of its file size
+MEMORY_FACTOR = 8
+
+class ModelCacheEntry:
+    """A class that holds a parsed model together with the values derived
+    from it (e.g. indexes), which are dropped with it
+    """
+
+    def __init__(self, signature, citymodel, memory):
+        self.signature = signature
+        self.citymodel = citymodel
+        self.memory = memory
+        self.extras = {}
+
+class ModelCache:
+    """A class that caches parsed models by path and modification time.
+
+    The least recently used models are evicted when their estimated memory
+    exceeds `max_memory` bytes. Models larger than that are not cached.
+    """
+
+    def __init__(self, max_memory=2 * 1024 ** 3, memory_factor=MEMORY_FACTOR,
+                 load_function=load_cityjson_model):
+        self._max_memory = max_memory
+        self._memory_factor = memory_factor
+        self._load_function = load_function
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_signature(self, filepath):
+        """Returns the modification time and size of a file"""
+        stat = os.stat(filepath)
+        return stat.st_mtime_ns, stat.st_size
+
+    def _get_entry(self, filepath):
+        """Returns the up-to-date entry of a file, or None"""
+        key = os.path.abspath(filepath)
+        signature = self.get_signature(filepath)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.signature != signature:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def get(self, filepath):
+        """Returns the parsed model of a file, parsing it if it isn't cached
+        or has changed
+        """
+        entry = self._get_entry(filepath)
+        if entry is not None:
+            return entry.citymodel
+
+        signature = self.get_signature(filepath)
+        citymodel = self._load_function(filepath)
+        self._put(filepath, signature, citymodel)
+
+        return citymodel
+
+    def put(self, filepath, citymodel):
+        """Adds an already parsed model of a file to the cache"""
+        self._put(filepath, self.get_signature(filepath), citymodel)
+
+    def _put(self, filepath, signature, citymodel):
+        """Adds a model with the signature of the file it was parsed from"""
+        memory = signature[1] * self._memory_factor
+        if memory > self._max_memory:
+            return
+
+        key = os.path.abspath(filepath)
+        with self._lock:
+            self._entries[key] = ModelCacheEntry(signature, citymodel, memory)
+            self._entries.move_to_end(key)
+            self._evict()
+
+    def get_extra(self, filepath, citymodel, name, factory):
+        """Returns a value derived from the model of a file (e.g. a spatial
+        index) with `factory(citymodel)`. The value is kept with the model,
+        so it is only computed once while the model is cached.
+        """
+        entry = self._get_entry(filepath)
+        if entry is None or entry.citymodel is not citymodel:
+            return factory(citymodel)
+
+        if name not in entry.extras:
+            entry.extras[name] = factory(citymodel)
+
+        return entry.extras[name]
+
+    def discard(self, filepath):
+        """Removes the model of a file (e.g. after it has been modified)"""
+        with self._lock:
+            self._entries.pop(os.path.abspath(filepath), None)
+
+    def clear(self):
+        """Removes all models"""
+        with self._lock:
+            self._entries.clear()
+
+    def memory(self):
+        """Returns the estimated memory of all cached models"""
+        return sum(entry.memory for entry in self._entries.values())
+
+    def __contains__(self, filepath):
+        return self._get_entry(filepath) is not None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _evict(self):
+        """Removes the least recently used models until they fit in memory"""
+        while self.memory() > self._max_memory:
+            self._entries.popitem(last=False)
+
+_model_cache = None
+
+def get_model_cache():
+    """Returns the model cache shared by the dialog, the Processing
+    algorithm and the on-demand provider
+    """
+    global _model_cache
+    if _model_cache is None:
+        settings = load_settings()
+        _model_cache = ModelCache(settings["model_cache_max_memory"])
+
+    return _model_cache
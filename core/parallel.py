@@ -0,0 +1,159 @@
+"""A module to convert city objects to features in a pool of worker
+processes
+"""
+
+import multiprocessing
+import os
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from qgis.core import NULL, QgsFeature, QgsField, QgsFields
+
+from .geometry import GeometryReader, VerticesCache, geometry_from_wkb
+from .layers import FieldMap, create_feature_builder
+
+# The state of a worker process, set once by `init_worker`
+_worker = {}
+
+def get_python_executable():
+    """Returns the Python interpreter to start the workers with.
+
+    Within QGIS, `sys.executable` points to the QGIS application itself
+    and not to the Python interpreter.
+    """
+    if os.path.basename(sys.executable).lower().startswith("python"):
+        return sys.executable
+
+    if sys.platform == "win32":
+        return os.path.join(sys.exec_prefix, "pythonw.exe")
+
+    return os.path.join(sys.exec_prefix, "bin", "python3")
+
+def fields_to_spec(fields):
+    """Returns a picklable description of the given fields"""
+    return [(field.name(), field.type(), field.length()) for field in fields]
+
+def spec_to_fields(spec):
+    """Returns the fields from a description created by `fields_to_spec`"""
+    fields = QgsFields()
+    for name, field_type, length in spec:
+        fields.append(QgsField(name, field_type, len=length))
+
+    return fields
+
+def init_worker(fields_spec, vertices, geometry_templates, lod_as, load_semantic_surfaces,
+                group_semantic_surfaces, lods):
+    """Prepares the geometry reader and feature builder of a worker"""
+    geometry_reader = GeometryReader(VerticesCache(vertices=vertices),
+                                     geometry_templates)
+
+    _worker["field_map"] = FieldMap(spec_to_fields(fields_spec))
+    _worker["geometry_reader"] = geometry_reader
+    _worker["feature_builder"] = create_feature_builder(geometry_reader,
+                                                        lod_as,
+                                                        load_semantic_surfaces,
+                                                        group_semantic_surfaces,
+                                                        lods)
+
+def convert_chunk(chunk):
+    """Converts a chunk of (id, city object) pairs to a list of (attributes,
+    WKB) tuples and returns it with the count of skipped geometries
+    """
+    field_map = _worker["field_map"]
+    geometry_reader = _worker["geometry_reader"]
+    feature_builder = _worker["feature_builder"]
+
+    skipped_before = geometry_reader.skipped_geometries()
+    results = []
+    for object_key, cityobject in chunk:
+        for feature in feature_builder.create_features(field_map, object_key, cityobject):
+            attributes = [None if value == NULL else value
+                          for value in feature.attributes()]
+            if feature.hasGeometry():
+                wkb = bytes(feature.geometry().asWkb())
+            else:
+                wkb = None
+            results.append((attributes, wkb))
+
+    skipped = geometry_reader.skipped_geometries() - skipped_before
+
+    return results, skipped, len(chunk)
+
+def iter_chunks(items, chunk_size):
+    """Yields lists of `chunk_size` items (the last one may be shorter)"""
+    iterator = iter(items)
+    chunk = list(islice(iterator, chunk_size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, chunk_size))
+
+class ParallelConverter:
+    """A class that converts city objects to features in a pool of worker
+    processes. Only the creation of the final features happens in the
+    calling thread.
+    """
+
+    def __init__(self, fields, vertices, geometry_templates=None,
+                 lod_as='NONE', load_semantic_surfaces=False,
+                 group_semantic_surfaces=False, lods=None, workers=None,
+                 chunk_size=500):
+        self._fields = fields
+        self._initargs = (fields_to_spec(fields),
+                          vertices,
+                          geometry_templates,
+                          lod_as,
+                          load_semantic_surfaces,
+                          group_semantic_surfaces,
+                          lods)
+        self._workers = workers or os.cpu_count() or 1
+        self._chunk_size = chunk_size
+
+    def chunks(self, items):
+        """Yields lists of `chunk_size` items"""
+        return iter_chunks(items, self._chunk_size)
+
+    def to_features(self, results):
+        """Returns the features of the (attributes, WKB) tuples of a chunk"""
+        features = []
+        for attributes, wkb in results:
+            feature = QgsFeature(self._fields)
+            feature.setAttributes(attributes)
+            if wkb is not None:
+                feature.setGeometry(geometry_from_wkb(wkb))
+            features.append(feature)
+
+        return features
+
+    def convert(self, items):
+        """Yields the features, count of skipped geometries and count of
+        city objects for every chunk of the given (id, city object) pairs,
+        in their original order
+        """
+        context = multiprocessing.get_context("spawn")
+        context.set_executable(get_python_executable())
+
+        with ProcessPoolExecutor(max_workers=self._workers,
+                                 mp_context=context,
+                                 initializer=init_worker,
+                                 initargs=self._initargs) as executor:
+            # Keep a limited number of chunks in flight, so that the pending
+            # chunks don't hold a copy of the whole model
+            pending = deque()
+            try:
+                for chunk in self.chunks(items):
+                    pending.append(executor.submit(convert_chunk, chunk))
+
+                    if len(pending) >= 2 * self._workers:
+                        results, skipped, count = pending.popleft().result()
+                        yield self.to_features(results), skipped, count
+
+                while pending:
+                    results, skipped, count = pending.popleft().result()
+                    yield self.to_features(results), skipped, count
+            finally:
+                # Drop the chunks that haven't started if the caller stops
+                # iterating early (e.g. when the loading is canceled)
+                for future in pending:
+                    future.cancel()
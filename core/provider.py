@@ -0,0 +1,326 @@
+"""A module with a vector data provider that creates the features of a
+city model on demand, instead of converting all of them at loading time
+"""
+
+import os
+
+from qgis.core import (QgsAbstractFeatureIterator, QgsAbstractFeatureSource,
+                       QgsCoordinateReferenceSystem, QgsCoordinateTransform,
+                       QgsCsException, QgsDataProvider, QgsFeature,
+                       QgsFeatureIterator, QgsFeatureRequest, QgsRectangle,
+                       QgsVectorDataProvider, QgsVectorLayer, QgsWkbTypes)
+
+from .geometry import GeometryReader, VerticesCache
+from .layers import (AttributeFieldsDecorator, BaseFieldsBuilder, FieldMap,
+                     SimpleFeatureBuilder)
+from .modelcache import get_model_cache
+from .schema import ModelSchema
+from .spatial import CityObjectTable
+
+try:
+    from qgis.core import QgsProviderMetadata, QgsProviderRegistry
+    has_python_providers = True
+except ImportError:
+    has_python_providers = False
+
+PROVIDER_KEY = "cityjson"
+
+def get_provider_uri(filepath, epsg="None"):
+    """Returns the data source URI of a file for the provider"""
+    if epsg == "None":
+        return filepath
+    return "{}|epsg={}".format(filepath, epsg)
+
+def parse_provider_uri(uri):
+    """Returns the file path and the EPSG code (or "None") of a data source
+    URI
+    """
+    filepath, _, options = uri.partition("|")
+    epsg = "None"
+    for option in options.split("|"):
+        key, _, value = option.partition("=")
+        if key == "epsg" and value:
+            epsg = value
+
+    return filepath, epsg
+
+class CityJSONFeatureSource(QgsAbstractFeatureSource):
+    """A class that reads the features of a city model. It only holds
+    read-only references to the model, so it can be used from other
+    threads than the one of the provider.
+    """
+
+    def __init__(self, provider):
+        super(CityJSONFeatureSource, self).__init__()
+        self.citymodel = provider.citymodel
+        self.table = provider.table
+        self.fields = provider.fields()
+        self.field_map = provider.field_map
+        self.crs = provider.crs()
+        self.feature_builder = provider.feature_builder
+
+    def getFeatures(self, request=QgsFeatureRequest()):
+        """Returns an iterator over the features of the request"""
+        return QgsFeatureIterator(CityJSONFeatureIterator(self, request))
+
+    def create_feature(self, row, read_geometry=True):
+        """Creates the feature of the city object in the given row"""
+        object_key = self.table.ids[row]
+        cityobject = self.citymodel["CityObjects"][object_key]
+        features = self.feature_builder.create_features(self.field_map,
+                                                        object_key,
+                                                        cityobject,
+                                                        read_geometry)
+        feature = next(iter(features))
+        feature.setId(row)
+
+        return feature
+
+class CityJSONFeatureIterator(QgsAbstractFeatureIterator):
+    """A class that creates the features of a request one at a time.
+    Requests with an extent only convert the objects whose bounding box
+    intersects it.
+    """
+
+    def __init__(self, source, request):
+        super(CityJSONFeatureIterator, self).__init__(request)
+        self._source = source
+        self._request = request
+
+        self._transform = QgsCoordinateTransform()
+        if request.destinationCrs().isValid() and request.destinationCrs() != source.crs:
+            self._transform = QgsCoordinateTransform(source.crs,
+                                                     request.destinationCrs(),
+                                                     request.transformContext())
+        try:
+            self._filter_rect = self.filterRectToSourceCrs(self._transform)
+        except QgsCsException:
+            self._filter_rect = QgsRectangle()
+            self._rows = []
+            self._index = 0
+            return
+
+        self._rows = self.select_rows()
+        self._index = 0
+
+    def select_rows(self):
+        """Returns the rows of the candidate features of the request"""
+        table = self._source.table
+        if self._request.filterType() == QgsFeatureRequest.FilterFid:
+            fids = [self._request.filterFid()]
+        elif self._request.filterType() == QgsFeatureRequest.FilterFids:
+            fids = sorted(self._request.filterFids())
+        elif not self._filter_rect.isNull():
+            rect = self._filter_rect
+            return table.intersecting_rows([rect.xMinimum(), rect.yMinimum(),
+                                            rect.xMaximum(), rect.yMaximum()]).tolist()
+        else:
+            return range(len(table))
+
+        return [fid for fid in fids if 0 <= fid < len(table)]
+
+    def fetchFeature(self, f):
+        """Creates the next feature of the request in f and returns True, or
+        returns False if there are no more features
+        """
+        read_geometry = not (self._request.flags() & QgsFeatureRequest.NoGeometry)
+        exact = self._request.flags() & QgsFeatureRequest.ExactIntersect
+
+        while self._index < len(self._rows):
+            row = self._rows[self._index]
+            self._index += 1
+
+            feature = self._source.create_feature(row, read_geometry or exact)
+
+            if exact and not self._filter_rect.isNull():
+                if not feature.geometry().intersects(self._filter_rect):
+                    continue
+
+            if self._request.filterType() == QgsFeatureRequest.FilterExpression:
+                context = self._request.expressionContext()
+                context.setFeature(feature)
+                if not self._request.filterExpression().evaluate(context):
+                    continue
+
+            f.setId(feature.id())
+            f.setFields(self._source.fields)
+            f.setAttributes(feature.attributes())
+            if read_geometry:
+                f.setGeometry(feature.geometry())
+                self.geometryToDestinationCrs(f, self._transform)
+            else:
+                f.clearGeometry()
+            f.setValid(True)
+
+            return True
+
+        return False
+
+    def __iter__(self):
+        self.rewind()
+        return self
+
+    def __next__(self):
+        feature = QgsFeature()
+        if not self.nextFeature(feature):
+            raise StopIteration
+        return feature
+
+    def rewind(self):
+        """Restarts the iteration"""
+        self._index = 0
+        return True
+
+    def close(self):
+        """Ends the iteration"""
+        self._index = len(self._rows)
+        return True
+
+class CityJSONProvider(QgsVectorDataProvider):
+    """A read-only vector data provider with one feature per city object.
+
+    The model is only indexed (bounding boxes and attribute schema) when
+    the provider is created; features are converted when requested.
+    """
+
+    @classmethod
+    def providerKey(cls):
+        """Returns the key of the provider"""
+        return PROVIDER_KEY
+
+    @classmethod
+    def description(cls):
+        """Returns the description of the provider"""
+        return "CityJSON (on demand)"
+
+    @classmethod
+    def createProvider(cls, uri, providerOptions, flags=QgsDataProvider.ReadFlags()):
+        """Creates a provider for the given data source URI"""
+        return CityJSONProvider(uri, providerOptions, flags)
+
+    def __init__(self, uri="", providerOptions=QgsDataProvider.ProviderOptions(),
+                 flags=QgsDataProvider.ReadFlags()):
+        super(CityJSONProvider, self).__init__(uri)
+        self._uri = uri
+        self._valid = False
+
+        filepath, epsg = parse_provider_uri(uri)
+        model_cache = get_model_cache()
+        try:
+            self.citymodel = model_cache.get(filepath)
+        except (OSError, ValueError):
+            return
+
+        if epsg == "None" and "crs" in self.citymodel.get("metadata", {}):
+            epsg = self.citymodel["metadata"]["crs"]["epsg"]
+        if epsg != "None":
+            self._crs = QgsCoordinateReferenceSystem("EPSG:{}".format(epsg))
+        else:
+            self._crs = QgsCoordinateReferenceSystem()
+
+        vertices_cache = VerticesCache()
+        if "transform" in self.citymodel:
+            vertices_cache.set_scale(self.citymodel["transform"]["scale"])
+            vertices_cache.set_translation(self.citymodel["transform"]["translate"])
+        vertices_cache.set_vertices(self.citymodel["vertices"])
+
+        geometry_reader = GeometryReader(vertices_cache,
+                                         self.citymodel.get("geometry-templates"))
+        self.feature_builder = SimpleFeatureBuilder(geometry_reader)
+
+        schema = model_cache.get_extra(filepath, self.citymodel, "schema",
+                                       ModelSchema.from_citymodel)
+        self._fields = AttributeFieldsDecorator(BaseFieldsBuilder(),
+                                                self.citymodel,
+                                                schema).get_fields()
+        self.field_map = FieldMap(self._fields)
+
+        self.table = model_cache.get_extra(filepath, self.citymodel, "table",
+                                           CityObjectTable.from_model)
+        self._extent = QgsRectangle()
+        extent = self.table.extent()
+        if extent is not None:
+            self._extent = QgsRectangle(extent[0], extent[1], extent[3], extent[4])
+
+        self._valid = True
+
+    def featureSource(self):
+        """Returns a feature source that reads the features of the model"""
+        return CityJSONFeatureSource(self)
+
+    def getFeatures(self, request=QgsFeatureRequest()):
+        """Returns an iterator over the features of the request"""
+        return QgsFeatureIterator(CityJSONFeatureIterator(CityJSONFeatureSource(self),
+                                                          request))
+
+    def dataSourceUri(self, expandAuthConfig=True):
+        """Returns the data source URI of the provider"""
+        return self._uri
+
+    def name(self):
+        """Returns the key of the provider"""
+        return self.providerKey()
+
+    def storageType(self):
+        """Returns the format of the data source"""
+        return "CityJSON file"
+
+    def wkbType(self):
+        """Returns the geometry type of the features"""
+        return QgsWkbTypes.MultiPolygonZ
+
+    def featureCount(self):
+        """Returns the number of city objects"""
+        return len(self.table)
+
+    def fields(self):
+        """Returns the fields of the features"""
+        return self._fields
+
+    def crs(self):
+        """Returns the CRS of the model"""
+        return self._crs
+
+    def extent(self):
+        """Returns the 2D extent of all city objects"""
+        return self._extent
+
+    def updateExtents(self):
+        """Does nothing, as the model can't change"""
+        return
+
+    def isValid(self):
+        """Returns True if the model could be read"""
+        return self._valid
+
+    def capabilities(self):
+        """Returns the capabilities of the provider"""
+        return QgsVectorDataProvider.SelectAtId
+
+def register_provider():
+    """Registers the provider to QGIS and returns True, unless it's not
+    supported by this version of QGIS
+    """
+    if not has_python_providers:
+        return False
+
+    registry = QgsProviderRegistry.instance()
+    if registry.providerMetadata(PROVIDER_KEY) is None:
+        metadata = QgsProviderMetadata(PROVIDER_KEY,
+                                       CityJSONProvider.description(),
+                                       CityJSONProvider.createProvider)
+        registry.registerProvider(metadata)
+
+    return True
+
+def is_provider_available():
+    """Returns True if the on-demand provider can be used"""
+    return has_python_providers
+
+def create_on_demand_layer(filepath, epsg="None"):
+    """Returns a layer of the given file that converts its features on
+    demand. The file is parsed through the model cache.
+    """
+    filename, _ = os.path.splitext(os.path.basename(filepath))
+
+    return QgsVectorLayer(get_provider_uri(filepath, epsg), filename, PROVIDER_KEY)
@@ -0,0 +1,107 @@
+"""A module to discover the schema (attributes, semantic surface attributes,
+object types and LoDs) of a city model in one pass
+"""
+
+import datetime
+import re
+
+DATE_PATTERN = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+# The largest integer that fits in a 32-bit field
+MAX_INT32 = 2 ** 31 - 1
+
+def get_value_type(value):
+    """Returns the narrowest type name ('bool', 'int', 'int64', 'double',
+    'date' or 'string') for a value, or None for null values
+    """
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return "bool"
+    if isinstance(value, int):
+        return "int" if -MAX_INT32 - 1 <= value <= MAX_INT32 else "int64"
+    if isinstance(value, float):
+        return "double"
+    if isinstance(value, str) and DATE_PATTERN.match(value):
+        try:
+            datetime.date.fromisoformat(value)
+            return "date"
+        except ValueError:
+            return "string"
+
+    return "string"
+
+NUMERIC_TYPES = ("int", "int64", "double")
+
+def merge_types(current, new):
+    """Returns the narrowest type name that can hold values of both types"""
+    if current is None:
+        return new
+    if new is None or current == new:
+        return current
+    if current in NUMERIC_TYPES and new in NUMERIC_TYPES:
+        if "double" in (current, new):
+            return "double"
+        return "int64"
+
+    return "string"
+
+class ModelSchema:
+    """A class that collects the attributes (with their inferred types),
+    semantic surface attributes, object types and LoDs of city objects.
+
+    Keys are kept in the order they are first found. Attributes that only
+    have null values have a None type.
+    """
+
+    def __init__(self, geometry_templates=None):
+        self.attributes = {}
+        self.semantic_attributes = {}
+        self.object_types = {}
+        self.lods = {}
+        self._geometry_templates = geometry_templates
+
+    @classmethod
+    def from_citymodel(cls, citymodel):
+        """Returns the schema of all city objects of a city model"""
+        schema = cls(citymodel.get("geometry-templates"))
+        schema.add_objects(citymodel["CityObjects"].values())
+
+        return schema
+
+    def add_objects(self, objs):
+        """Adds the given city objects to the schema"""
+        for obj in objs:
+            self.add_object(obj)
+
+    def add_object(self, obj):
+        """Adds a city object to the schema"""
+        self.object_types[obj["type"]] = None
+
+        if "attributes" in obj:
+            add_values(self.attributes, obj["attributes"])
+
+        for geom in obj.get("geometry", []):
+            self.lods[self.get_lod(geom)] = None
+
+            if "semantics" in geom:
+                for surface in geom["semantics"]["surfaces"]:
+                    add_values(self.semantic_attributes, surface)
+
+    def get_lod(self, geometry):
+        """Returns the LoD of a geometry (or of its template)"""
+        if geometry["type"] == "GeometryInstance":
+            if self._geometry_templates is None:
+                return None
+            template = self._geometry_templates["templates"][geometry["template"]]
+            return template.get("lod")
+
+        return geometry.get("lod")
+
+def add_values(types, values):
+    """Merges the types of the values of a dictionary to the given types"""
+    for key, value in values.items():
+        value_type = get_value_type(value)
+        current = types.get(key)
+        if key not in types or current != value_type:
+            types[key] = merge_types(current, value_type)
@@ -1,5 +1,8 @@
 """A module to manage the settings of the plugin"""
 
+import os
+
+from qgis.core import QgsApplication
 from qgis.PyQt.QtCore import QSettings
 from qgis.PyQt.QtGui import QColor
 
@@ -31,6 +34,12 @@ semantic_colors = {
     }
 }
 
+def get_default_cache_directory():
+    """Returns the default directory of the conversion cache"""
+    return os.path.join(QgsApplication.qgisSettingsDirPath(),
+                        "cityjson_loader",
+                        "cache")
+
 def get_color_int(color):
     """Returns the int representation of a QColor"""
     if color is None:
@@ -65,8 +74,16 @@ def save_defaults():
 def load_settings():
     """Loads the settings from the app's registry"""
 
+    settings = QSettings()
+    settings.beginGroup("CityJSON Loader")
     result = {
-        "semantic_colors": semantic_colors
+        "semantic_colors": semantic_colors,
+        "cache_enabled": settings.value("cache/enabled", True, type=bool),
+        "cache_directory": settings.value("cache/directory",
+                                          get_default_cache_directory()),
+        "cache_max_size": settings.value("cache/max_size", 2 * 1024 ** 3, type=int),
+        "model_cache_max_memory": settings.value("model_cache/max_memory", 2 * 1024 ** 3, type=int)
     }
+    settings.endGroup()
 
     return result
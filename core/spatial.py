@@ -0,0 +1,204 @@
+"""A module that provides spatial indexes over the city objects of a model"""
+
+import math
+from itertools import chain
+
+import numpy as np
+
+# The number of list levels above the vertex indices, per geometry type
+BOUNDARY_DEPTHS = {
+    "MultiPoint": 0,
+    "MultiLineString": 1,
+    "MultiSurface": 2,
+    "CompositeSurface": 2,
+    "Solid": 3,
+    "MultiSolid": 4,
+    "CompositeSolid": 4,
+    "GeometryInstance": 0
+}
+
+def iter_vertex_indices(geometry):
+    """Returns an iterator over all vertex indices of a geometry's
+    boundaries
+    """
+    boundaries = geometry["boundaries"]
+    depth = BOUNDARY_DEPTHS.get(geometry["type"])
+    if depth is None:
+        return iter(_flatten(boundaries))
+
+    indices = iter(boundaries)
+    for _ in range(depth):
+        indices = chain.from_iterable(indices)
+
+    return indices
+
+def _flatten(boundaries):
+    """Yields the vertex indices of boundaries of unknown depth"""
+    for each in boundaries:
+        if isinstance(each, list):
+            yield from _flatten(each)
+        else:
+            yield each
+
+class CityObjectTable:
+    """An array-backed table with the centroid and 3D bounding box of every
+    city object, computed in one pass over the model.
+
+    Rows follow the order of the city objects. Objects without vertices
+    have NaN centroids and bounding boxes.
+    """
+
+    def __init__(self, ids, centroids, bboxes, vertex_counts):
+        self.ids = list(ids)
+        self.centroids = centroids
+        self.bboxes = bboxes
+        self.vertex_counts = vertex_counts
+        self._rows = {coid: row for row, coid in enumerate(self.ids)}
+
+    @classmethod
+    def from_model(cls, cm):
+        """Creates the table of all city objects of a model"""
+        ids = list(cm["CityObjects"].keys())
+        indices = []
+        counts = np.zeros(len(ids), dtype=np.int64)
+        for row, obj in enumerate(cm["CityObjects"].values()):
+            before = len(indices)
+            for geom in obj.get("geometry", []):
+                indices.extend(iter_vertex_indices(geom))
+            counts[row] = len(indices) - before
+
+        indices = np.array(indices, dtype=np.int64)
+        vertices = np.array(cm["vertices"], dtype=np.float64).reshape(-1, 3)
+        if "transform" in cm:
+            vertices *= np.asarray(cm["transform"]["scale"], dtype=np.float64)
+            vertices += np.asarray(cm["transform"]["translate"], dtype=np.float64)
+
+        centroids = np.full((len(ids), 3), np.nan)
+        bboxes = np.full((len(ids), 6), np.nan)
+
+        # reduceat only works on non-empty segments, which are consecutive
+        has_vertices = counts > 0
+        starts = (np.cumsum(counts) - counts)[has_vertices]
+        if len(starts) > 0:
+            for axis in range(3):
+                coords = vertices[indices, axis]
+                sums = np.add.reduceat(coords, starts)
+                centroids[has_vertices, axis] = sums / counts[has_vertices]
+                bboxes[has_vertices, axis] = np.minimum.reduceat(coords, starts)
+                bboxes[has_vertices, axis + 3] = np.maximum.reduceat(coords, starts)
+
+        return cls(ids, centroids, bboxes, counts)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, coid):
+        return coid in self._rows
+
+    def row(self, coid):
+        """Returns the row of the given object id"""
+        return self._rows[coid]
+
+    def get_centroid(self, coid):
+        """Returns the centroid of the given object, or None if it has no
+        vertices
+        """
+        row = self._rows[coid]
+        if self.vertex_counts[row] == 0:
+            return None
+        return self.centroids[row].tolist()
+
+    def get_bbox(self, coid):
+        """Returns the [minx, miny, minz, maxx, maxy, maxz] of the given
+        object, or None if it has no vertices
+        """
+        row = self._rows[coid]
+        if self.vertex_counts[row] == 0:
+            return None
+        return self.bboxes[row].tolist()
+
+    def extent(self):
+        """Returns the 3D bounding box of all objects, or None if there are
+        no vertices
+        """
+        has_vertices = self.vertex_counts > 0
+        if not has_vertices.any():
+            return None
+        bboxes = self.bboxes[has_vertices]
+        return bboxes[:, :3].min(axis=0).tolist() + bboxes[:, 3:].max(axis=0).tolist()
+
+    def intersecting_rows(self, bbox):
+        """Returns the rows of the objects whose bounding box intersects the
+        given 2D [minx, miny, maxx, maxy]. Objects without vertices are
+        never returned.
+        """
+        with np.errstate(invalid="ignore"):
+            intersects = ((self.bboxes[:, 0] <= bbox[2]) &
+                          (self.bboxes[:, 1] <= bbox[3]) &
+                          (self.bboxes[:, 3] >= bbox[0]) &
+                          (self.bboxes[:, 4] >= bbox[1]))
+
+        return np.flatnonzero(intersects)
+
+    def centroid_index(self):
+        """Returns a spatial index over the centroids of the objects"""
+        has_vertices = self.vertex_counts > 0
+        ids = [coid for coid, valid in zip(self.ids, has_vertices) if valid]
+        return CentroidIndex(ids, self.centroids[has_vertices])
+
+class CentroidIndex:
+    """A grid index over the 2D centroids of city objects. It is meant to be
+    built once per city model and queried for many extents.
+    """
+
+    def __init__(self, ids, centroids, objects_per_cell=4):
+        self._ids = list(ids)
+        self._centroids = np.asarray(centroids, dtype=np.float64).reshape(-1, 3)
+
+        count = len(self._ids)
+        self._size = max(1, int(math.ceil(math.sqrt(count / objects_per_cell))))
+
+        if count > 0:
+            self._origin = self._centroids[:, :2].min(axis=0)
+            extent = self._centroids[:, :2].max(axis=0) - self._origin
+        else:
+            self._origin = np.zeros(2)
+            extent = np.zeros(2)
+        self._cell = np.where(extent > 0, extent / self._size, 1.0)
+
+        # Sort the objects by cell, so that every cell is a slice of _order
+        cells = self._cell_of(self._centroids[:, :2])
+        cell_ids = cells[:, 1] * self._size + cells[:, 0]
+        self._order = np.argsort(cell_ids, kind="stable")
+        self._offsets = np.searchsorted(cell_ids[self._order],
+                                        np.arange(self._size * self._size + 1))
+
+    def _cell_of(self, points):
+        """Returns the (column, row) of the cells of the given 2D points"""
+        cells = np.floor((points - self._origin) / self._cell).astype(np.int64)
+        return np.clip(cells, 0, self._size - 1)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def query(self, bbox):
+        """Returns the ids of the objects whose centroid lies in the given
+        [minx, miny, maxx, maxy] (minimum inclusive, maximum exclusive)
+        """
+        if len(self._ids) == 0:
+            return []
+
+        (col_min, row_min), (col_max, row_max) = self._cell_of(
+            np.array([[bbox[0], bbox[1]], [bbox[2], bbox[3]]], dtype=np.float64))
+
+        candidates = [self._order[self._offsets[row * self._size + col_min]:
+                                  self._offsets[row * self._size + col_max + 1]]
+                      for row in range(row_min, row_max + 1)]
+        candidates = np.sort(np.concatenate(candidates))
+
+        x = self._centroids[candidates, 0]
+        y = self._centroids[candidates, 1]
+        inside = ((x >= bbox[0]) & (y >= bbox[1]) &
+                  (x < bbox[2]) & (y < bbox[3]))
+
+        return [self._ids[i] for i in candidates[inside]]
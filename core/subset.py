@@ -1,129 +1,279 @@
+"""This module contains functions to select and extract subsets of city models"""
 
-import json
-
-def select_co_bbox(j, bbox):
-    #-- select the CO whose
-    pass
-
-def select_co_ids(j, IDs):
-    IDs = list(IDs)
-    re = set()
-    for theid in j["CityObjects"]:
-        if theid in IDs:
-            re.add(theid)
-    for theid in IDs:
-        if theid not in j["CityObjects"]:
-            IDs.remove(theid)
-            print ("WARNING: ID", theid, "not found in input file; ignored.")
-    #-- deal with CityObjectGroup
-    for each in j["CityObjects"]:
-        if each in IDs:
-            if j["CityObjects"][each]["type"] == "CityObjectGroup" and "members" in j["CityObjects"][each]:
-                for member in j["CityObjects"][each]["members"]:
-                    re.add(member)
-    #-- also add the children
-    for id in j["CityObjects"]:
-        if id in IDs:
-            if "children" in j['CityObjects'][id]:
-                for child in j['CityObjects'][id]['children']:
-                    re.add(child)
-            if "parent" in j['CityObjects'][id]:
-                re.add(j['CityObjects'][id]['parent']) 
-                #-- add siblings
-                if "children" in j['CityObjects'][id]['parent']:
-                    for child in j['CityObjects'][id]['parent']:
-                        re.add(child)
-    return re                
-
-
-
-def process_geometry(j, j2):
-    #-- update vertex indices
-    oldnewids = {}
-    newvertices = []    
-    for each in j2["CityObjects"]:
-        for geom in j2['CityObjects'][each]['geometry']:
-            update_array_indices(geom["boundaries"], oldnewids, j["vertices"], newvertices, -1)
-    j2["vertices"] = newvertices
-
-
-def process_templates(j, j2):
-    dOldNewIDs = {}
-    newones = []
-    for each in j2["CityObjects"]:
-        for geom in j2['CityObjects'][each]['geometry']:
-            if geom["type"] == "GeometryInstance": 
-                t = geom["template"] 
-                if t in dOldNewIDs:
-                    geom["template"] = dOldNewIDs[t]
-                else:
-                    geom["template"] = len(newones)
-                    dOldNewIDs[t] = len(newones)
-                    newones.append(j["geometry-templates"]["templates"][t])      
-    if len(newones) > 0:
-        j2["geometry-templates"] = {}
-        j2["geometry-templates"]["vertices-templates"] = j["geometry-templates"]["vertices-templates"]
-        j2["geometry-templates"]["templates"] = newones
-
-
-def process_appearance(j, j2):
-    #-- materials
-    dOldNewIDs = {}
-    newmats = []
-    for each in j2["CityObjects"]:
-        for geom in j2['CityObjects'][each]['geometry']:
-            if "material" in geom:
-                for each in geom["material"]:
-                    if 'value' in geom["material"][each]:
-                        v = geom["material"][each]["value"]
-                        if v in dOldNewIDs:
-                            geom["material"][each]["value"] = dOldNewIDs[v]
-                        else:
-                            geom["material"][each]["value"] = len(newmats)
-                            dOldNewIDs[v] = len(newmats)
-                            newmats.append(j["appearance"]["materials"][v])      
-                    if 'values' in geom["material"][each]:
-                        update_array_indices(geom["material"][each]['values'], dOldNewIDs, j["appearance"]["materials"], newmats, -1)
-    if len(newmats) > 0:
-        j2["appearance"]["materials"] = newmats
-
-    #-- textures references (first int in the arrays)
-    dOldNewIDs = {}
-    newtextures = []
-    for each in j2["CityObjects"]:
-        for geom in j2['CityObjects'][each]['geometry']:
-            if "texture" in geom:
-                for each in geom["texture"]:
-                    if 'values' in geom["texture"][each]:
-                        update_array_indices(geom["texture"][each]['values'], dOldNewIDs, j["appearance"]["textures"], newtextures, 0)
-    if len(newtextures) > 0:
-        j2["appearance"]["textures"] = newtextures
-    #-- textures vertices references (1+ int in the arrays)
-    dOldNewIDs = {}
-    newtextures = []
-    for each in j2["CityObjects"]:
-        for geom in j2['CityObjects'][each]['geometry']:
-            if "texture" in geom:
-                for each in geom["texture"]:
-                    if 'values' in geom["texture"][each]:
-                        update_array_indices(geom["texture"][each]['values'], dOldNewIDs, j["appearance"]["vertices-texture"], newtextures, 1)
-    if len(newtextures) > 0:
-        j2["appearance"]["vertices-texture"] = newtextures
-
-
-def update_array_indices(a, dOldNewIDs, oldarray, newarray, slicearray):
-    #-- slicearray: -1=none ; 0=use-only-first (for textures) ; 1=use-1+ (for textures)
-    #-- a must be an array
-    #-- issue with passing integer is that it's non-mutable, thus can't update
-    #-- (or I don't know how...)
-    for i, each in enumerate(a):
+import numpy as np
+
+def select_co_bbox(j, bbox, index, hierarchy=None):
+    """Returns the ids of the city objects whose centroid is in the bbox,
+    with their hierarchy, from a centroid index of the model. The hierarchy
+    index can be reused for many selections of the same model.
+    """
+    if hierarchy is None:
+        hierarchy = HierarchyIndex.from_model(j)
+
+    return hierarchy.select(index.query(bbox))
+
+def get_geometry_lod(j, geom):
+    """Returns the LoD of a geometry (the one of its template for a
+    GeometryInstance) as a string
+    """
+    if geom["type"] == "GeometryInstance":
+        return str(j["geometry-templates"]["templates"][geom["template"]]["lod"])
+
+    return str(geom.get("lod"))
+
+class HierarchyIndex:
+    """A class that indexes the parents, children and group members of the
+    city objects of a model, so that they are found without scanning it.
+
+    Groups aren't part of the hierarchy: their members are only selected
+    with them, and a member never pulls its groups (nor their other
+    members) in, whether they are listed as `members` (v1.x) or as
+    `children` that refer to the group in their `parents` (v2.0).
+    """
+
+    def __init__(self, ids, parents, children, members):
+        self.ids = ids
+        self.parents = parents
+        self.children = children
+        self.members = members
+
+    @classmethod
+    def from_model(cls, j):
+        """Returns the index of the city objects of a model, built in two
+        passes over them
+        """
+        groups = set(theid for theid, co in j["CityObjects"].items()
+                     if co["type"] == "CityObjectGroup")
+
+        parents = {}
+        children = {}
+        members = {}
+        for theid, co in j["CityObjects"].items():
+            if theid in groups:
+                members[theid] = co.get("members", []) + co.get("children", [])
+                continue
+            if "children" in co:
+                children[theid] = co["children"]
+            if "parents" in co:
+                parents[theid] = [parent for parent in co["parents"] if parent not in groups]
+
+        return cls(set(j["CityObjects"]), parents, children, members)
+
+    def select(self, ids):
+        """Returns the given ids that exist along with the members of the
+        given groups (and of their nested groups) and the whole hierarchy
+        of all of them (parents, children and siblings, transitively). The
+        time is linear in the size of the result.
+        """
+        # The members of the selected groups are selected too
+        seeds = set()
+        pending = [theid for theid in ids if theid in self.ids]
+        while pending:
+            theid = pending.pop()
+            if theid in seeds:
+                continue
+            seeds.add(theid)
+            pending.extend(self.members.get(theid, ()))
+
+        selected = set()
+        pending = list(seeds)
+        while pending:
+            theid = pending.pop()
+            if theid in selected:
+                continue
+            selected.add(theid)
+            pending.extend(self.children.get(theid, ()))
+            pending.extend(self.parents.get(theid, ()))
+
+        # Objects can refer to ids that aren't in the model
+        return selected & self.ids
+
+    def missing(self, ids):
+        """Returns the given ids that aren't in the model"""
+        return [theid for theid in ids if theid not in self.ids]
+
+def select_co_ids(j, IDs, index=None):
+    """Returns the ids of the given city objects with their hierarchy and
+    group members. Ids that aren't in the model are ignored (callers can
+    report them with `HierarchyIndex.missing`). The index can be reused for
+    many selections of the same model.
+    """
+    if index is None:
+        index = HierarchyIndex.from_model(j)
+
+    return index.select(IDs)
+
+class IndexMap:
+    """A class that renumbers the indices used by a subset (e.g. of
+    vertices) to consecutive ones, keeping their original order
+    """
+
+    def __init__(self, indices):
+        old_indices, new_indices = np.unique(np.asarray(indices, dtype=np.int64),
+                                             return_inverse=True)
+        self.old_indices = old_indices.tolist()
+        self.new_indices = iter(new_indices.tolist())
+
+    def __len__(self):
+        return len(self.old_indices)
+
+    def select(self, items):
+        """Returns the items of the indices that are used, in their new order"""
+        return [items[i] for i in self.old_indices]
+
+def collect_indices(nested, indices):
+    """Appends the (non-null) integers of nested lists to indices"""
+    for each in nested:
         if isinstance(each, list):
-            update_array_indices(each, dOldNewIDs, oldarray, newarray, slicearray)
+            collect_indices(each, indices)
         elif each is not None:
-            if ( (slicearray == -1) or (slicearray == 0 and i == 0) or (slicearray == 1 and i > 0) ):
-                if each in dOldNewIDs:
-                    a[i] = dOldNewIDs[each]
-                else:
-                    a[i] = len(newarray)
-                    dOldNewIDs[each] = len(newarray)
-                    newarray.append(oldarray[each])      
+            indices.append(each)
+
+def replace_indices(nested, new_indices):
+    """Returns a copy of nested lists where every (non-null) integer is
+    replaced by the next one of new_indices
+    """
+    return [replace_indices(each, new_indices) if isinstance(each, list)
+            else None if each is None else next(new_indices)
+            for each in nested]
+
+def collect_texture_indices(nested, textures, uv_indices):
+    """Appends the texture (first integer) and the texture vertices (the
+    others) of every ring of texture values
+    """
+    for each in nested:
+        if len(each) > 0 and isinstance(each[0], list):
+            collect_texture_indices(each, textures, uv_indices)
+        elif len(each) > 0 and each[0] is not None:
+            textures.append(each[0])
+            uv_indices.extend(each[1:])
+
+def replace_texture_indices(nested, new_textures, new_uv_indices):
+    """Returns a copy of texture values with the texture and texture
+    vertices of every ring replaced by the next ones of the new indices
+    """
+    new_nested = []
+    for each in nested:
+        if len(each) > 0 and isinstance(each[0], list):
+            new_nested.append(replace_texture_indices(each, new_textures, new_uv_indices))
+        elif len(each) > 0 and each[0] is not None:
+            new_nested.append([next(new_textures)] + [next(new_uv_indices) for _ in each[1:]])
+        else:
+            new_nested.append(list(each))
+
+    return new_nested
+
+def get_subset(j, ids, lods=None):
+    """Returns a city model with the city objects of the given ids, without
+    modifying the original one. With `lods`, only the geometries of these
+    LoDs (as strings) are kept, along with the objects that have any of
+    them or no geometry at all.
+
+    The vertices, templates, materials and textures that the objects refer
+    to are collected in one pass over their geometries, renumbered at once
+    and only then replaced in copies of the geometries.
+    """
+    ids = set(ids)
+    cityobjects = []
+    for theid, co in j["CityObjects"].items():
+        if theid not in ids:
+            continue
+        if lods is not None and "geometry" in co:
+            geometries = [geom for geom in co["geometry"] if get_geometry_lod(j, geom) in lods]
+            if len(geometries) == 0 and len(co["geometry"]) > 0:
+                continue
+            co = dict(co, geometry=geometries)
+        cityobjects.append((theid, co))
+
+    vertices = []
+    templates = []
+    materials = []
+    textures = []
+    uv_indices = []
+    for _, co in cityobjects:
+        for geom in co.get("geometry", []):
+            collect_indices(geom["boundaries"], vertices)
+            if geom["type"] == "GeometryInstance":
+                templates.append(geom["template"])
+            for material in geom.get("material", {}).values():
+                if "value" in material:
+                    materials.append(material["value"])
+                if "values" in material:
+                    collect_indices(material["values"], materials)
+            for texture in geom.get("texture", {}).values():
+                if "values" in texture:
+                    collect_texture_indices(texture["values"], textures, uv_indices)
+
+    vertex_map = IndexMap(vertices)
+    template_map = IndexMap(templates)
+    material_map = IndexMap(materials)
+    texture_map = IndexMap(textures)
+    uv_map = IndexMap(uv_indices)
+
+    # The geometries are visited again in the same order, so the new
+    # indices are consumed in the order they were collected
+    j2 = {"type": j.get("type", "CityJSON"),
+          "version": j["version"],
+          "CityObjects": {}}
+    for theid, co in cityobjects:
+        if "geometry" not in co:
+            j2["CityObjects"][theid] = co
+            continue
+
+        new_geometries = []
+        for geom in co["geometry"]:
+            new_geom = dict(geom)
+            new_geom["boundaries"] = replace_indices(geom["boundaries"], vertex_map.new_indices)
+            if geom["type"] == "GeometryInstance":
+                new_geom["template"] = next(template_map.new_indices)
+            if "material" in geom:
+                new_geom["material"] = {}
+                for theme, material in geom["material"].items():
+                    new_material = dict(material)
+                    if "value" in material:
+                        new_material["value"] = next(material_map.new_indices)
+                    if "values" in material:
+                        new_material["values"] = replace_indices(material["values"],
+                                                                 material_map.new_indices)
+                    new_geom["material"][theme] = new_material
+            if "texture" in geom:
+                new_geom["texture"] = {}
+                for theme, texture in geom["texture"].items():
+                    new_texture = dict(texture)
+                    if "values" in texture:
+                        new_texture["values"] = replace_texture_indices(texture["values"],
+                                                                        texture_map.new_indices,
+                                                                        uv_map.new_indices)
+                    new_geom["texture"][theme] = new_texture
+            new_geometries.append(new_geom)
+
+        new_co = dict(co)
+        new_co["geometry"] = new_geometries
+        j2["CityObjects"][theid] = new_co
+
+    j2["vertices"] = vertex_map.select(j["vertices"])
+
+    if "transform" in j:
+        j2["transform"] = j["transform"]
+
+    if len(template_map) > 0:
+        j2["geometry-templates"] = {
+            "templates": template_map.select(j["geometry-templates"]["templates"]),
+            "vertices-templates": j["geometry-templates"]["vertices-templates"]
+        }
+
+    if "appearance" in j:
+        appearance = j["appearance"]
+        j2["appearance"] = {key: value for key, value in appearance.items()
+                            if key not in ("materials", "textures", "vertices-texture")}
+        if len(material_map) > 0:
+            j2["appearance"]["materials"] = material_map.select(appearance["materials"])
+        if len(texture_map) > 0:
+            j2["appearance"]["textures"] = texture_map.select(appearance["textures"])
+        if len(uv_map) > 0:
+            j2["appearance"]["vertices-texture"] = uv_map.select(appearance["vertices-texture"])
+
+    if "metadata" in j:
+        j2["metadata"] = j["metadata"]
+
+    return j2
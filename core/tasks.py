@@ -0,0 +1,148 @@
+"""A module to load city models in a background task"""
+
+import os
+
+from qgis.core import Qgis, QgsApplication, QgsFeedback, QgsMessageLog, QgsTask
+
+from .cache import get_project_sources
+from .loading import CityJSONLoader, CityJSONSeqLoader, is_cityjsonseq
+from .modelcache import get_model_cache
+
+# The share of the progress (from, to) of every stage of the loading
+STAGES = {
+    "parse": (0, 10),
+    "convert": (10, 85),
+    "insert": (85, 95),
+    "style": (95, 100)
+}
+
+def log_warning(message):
+    """Logs a warning in the message log of the plugin"""
+    QgsMessageLog.logMessage(message, "CityJSON Loader", Qgis.Warning)
+
+class StageFeedback(QgsFeedback):
+    """A feedback that maps the progress of a stage to the progress of the
+    whole task and is canceled together with the task
+    """
+
+    def __init__(self, task, stage):
+        super(StageFeedback, self).__init__()
+        self._task = task
+        self._start, self._end = STAGES[stage]
+
+    def setProgress(self, progress):
+        """Sets the progress of the stage (0 to 100)"""
+        super(StageFeedback, self).setProgress(progress)
+        self._task.setProgress(self._start + progress * (self._end - self._start) / 100.0)
+
+    def isCanceled(self):
+        """Returns True if the task was canceled"""
+        return self._task.isCanceled()
+
+class CityJSONLoadingTask(QgsTask):
+    """A task that parses and converts a CityJSON file in the background.
+
+    The layers are added to the project (and styled) in `finished`, which
+    runs in the main thread. `on_finished` is called afterwards with the
+    task, unless it was canceled.
+    """
+
+    def __init__(self, filepath, options, style_semantic_surfaces=False,
+                 cache=None, on_finished=None):
+        filename, _ = os.path.splitext(os.path.basename(filepath))
+        super(CityJSONLoadingTask, self).__init__("Loading {}".format(filename),
+                                                  QgsTask.CanCancel)
+        self.filepath = filepath
+        self.options = options
+        self.style_semantic_surfaces = style_semantic_surfaces
+        self.cache = cache
+        self.on_finished = on_finished
+
+        self.loader = None
+        self.skipped_geometries = 0
+        self.exception = None
+
+    def set_stage(self, stage):
+        """Sets the progress to the start of a stage"""
+        self.setProgress(STAGES[stage][0])
+
+    def run(self):
+        """Parses and converts the file, in the task's thread"""
+        try:
+            self.set_stage("parse")
+            if is_cityjsonseq(self.filepath):
+                loader = CityJSONSeqLoader(self.filepath,
+                                           style_semantic_surfaces=self.style_semantic_surfaces,
+                                           **self.options)
+            else:
+                citymodel = get_model_cache().get(self.filepath)
+                if self.isCanceled():
+                    return False
+                loader = CityJSONLoader(self.filepath,
+                                        citymodel,
+                                        style_semantic_surfaces=self.style_semantic_surfaces,
+                                        **self.options)
+
+            self.set_stage("convert")
+            self.skipped_geometries = loader.convert(StageFeedback(self, "convert"))
+            if self.isCanceled():
+                return False
+
+            self.set_stage("insert")
+            loader.layer_manager.flush()
+            if self.cache is not None:
+                self.store_in_cache(loader)
+
+            # The layers can only be added to the project from the main thread
+            main_thread = QgsApplication.instance().thread()
+            for layer in loader.layer_manager.get_all_layers():
+                layer.moveToThread(main_thread)
+
+            self.loader = loader
+        except Exception as exp:
+            self.exception = exp
+            return False
+
+        return True
+
+    def store_in_cache(self, loader):
+        """Stores the converted layers in the cache. The layers were
+        converted anyway, so failures are only logged.
+        """
+        try:
+            stored = self.cache.store(self.filepath,
+                                      self.options,
+                                      loader.layer_manager.get_all_layers(),
+                                      self.skipped_geometries)
+        except Exception as exp:
+            log_warning("Could not cache the layers of {}: {}".format(self.filepath, exp))
+            return
+
+        if not stored:
+            log_warning("Could not cache the layers of {}.".format(self.filepath))
+
+    def evict_from_cache(self):
+        """Removes old entries of the cache, except the ones that layers of
+        the project are read from. Runs in the main thread, which owns the
+        project.
+        """
+        try:
+            failed = self.cache.evict(get_project_sources())
+        except Exception as exp:
+            log_warning("Could not clean the cache: {}".format(exp))
+            return
+
+        for path in failed:
+            log_warning("Could not remove {} from the cache.".format(path))
+
+    def finished(self, result):
+        """Adds the layers to the project, in the main thread"""
+        if result:
+            self.set_stage("style")
+            self.loader.add_layers_to_project()
+            if self.cache is not None:
+                self.evict_from_cache()
+            self.setProgress(100)
+
+        if self.on_finished is not None and not self.isCanceled():
+            self.on_finished(self)
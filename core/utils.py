@@ -1,7 +1,6 @@
 """This module contains functions that originate from cjio"""
 
-import copy
-
+from .spatial import CityObjectTable
 from .subset import *
 
 def createCityJSON():
@@ -45,10 +44,14 @@ def get_centroid(cm, coid):
     else:
         return None
 
-def get_subset_cotype(cm, cotype, invert=False):
-    # print ('get_subset_cotype')
+def get_centroid_index(cm):
+    """Returns a spatial index over the centroids of all city objects"""
+    return CityObjectTable.from_model(cm).centroid_index()
+
+def get_cotypes(cotype):
+    """Returns the given types along with the types of their parts"""
     if isinstance(cotype, list):
-        lsCOtypes = cotype
+        lsCOtypes = list(cotype)
     else:
         lsCOtypes = [cotype]
 
@@ -63,73 +66,36 @@ def get_subset_cotype(cm, cotype, invert=False):
         if t == 'Tunnel':
             lsCOtypes.append('TunnelInstallation')
             lsCOtypes.append('TunnelPart')
-    #-- new sliced CityJSON object
-    cm2 = createCityJSON()
-    cm2["version"] = cm["version"]
-    if "transform" in cm:
-        cm2["transform"] = cm["transform"]
-    #-- copy selected CO to the j2
+
+    return lsCOtypes
+
+def get_subset_cotype(cm, cotype, invert=False):
+    # print ('get_subset_cotype')
+    lsCOtypes = get_cotypes(cotype)
+    #-- select the CO of the types (the source model is not modified)
+    selected = []
     for theid in cm["CityObjects"]:
         if invert is False:
             if cm["CityObjects"][theid]["type"] in lsCOtypes:
-                cm2["CityObjects"][theid] = cm["CityObjects"][theid]
+                selected.append(theid)
         else:
             if cm["CityObjects"][theid]["type"] not in lsCOtypes:
-                cm2["CityObjects"][theid] = cm["CityObjects"][theid]
-    #-- geometry
-    process_geometry(cm, cm2)
-    #-- templates
-    process_templates(cm, cm2)
-    #-- appearance
-    if ("appearance" in cm):
-        cm2["appearance"] = {}
-        process_appearance(cm, cm2)
-    #-- metadata
-    if ("metadata" in cm):
-        cm2["metadata"] = cm["metadata"]
+                selected.append(theid)
 
-    return cm2
+    return get_subset(cm, selected)
 
-def get_subset_bbox(cm, bbox, invert=False):
+def get_subset_bbox(cm, bbox, invert=False, index=None, hierarchy=None):
     # print ('get_subset_bbox')
-    #-- new sliced CityJSON object
-    cm2 = createCityJSON()
-    cm2["version"] = cm["version"]
-    if "transform" in cm:
-        cm2["transform"] = cm["transform"]
-    re = set()            
-    for coid in cm["CityObjects"]:
-        centroid = get_centroid(cm, coid)
-        if ((centroid is not None) and
-            (centroid[0] >= bbox[0]) and
-            (centroid[1] >= bbox[1]) and
-            (centroid[0] <  bbox[2]) and
-            (centroid[1] <  bbox[3]) ):
-            re.add(coid)
-    re2 = copy.deepcopy(re)
+    #-- the indexes can be reused for many extents of the same model
+    if index is None:
+        index = get_centroid_index(cm)
     if invert == True:
-        allkeys = set(cm["CityObjects"].keys())
-        re = allkeys ^ re
-    #-- also add the parent-children
-    for theid in re2:
-        if "children" in cm['CityObjects'][theid]:
-            for child in cm['CityObjects'][theid]['children']:
-                re.add(child)
-        if "parent" in cm['CityObjects'][theid]:
-            re.add(cm['CityObjects'][theid]['parent'])
-
-    for each in re:
-        cm2["CityObjects"][each] = cm["CityObjects"][each]
-    #-- geometry
-    process_geometry(cm, cm2)
-    #-- templates
-    process_templates(cm, cm2)
-    #-- appearance
-    if ("appearance" in cm):
-        cm2["appearance"] = {}
-        process_appearance(cm, cm2)
-    #-- metadata
-    if ("metadata" in cm):
-        cm2["metadata"] = cm["metadata"]
+        if hierarchy is None:
+            hierarchy = HierarchyIndex.from_model(cm)
+        #-- the objects outside the bbox, with their parent-children
+        re = hierarchy.select(set(cm["CityObjects"].keys()) - set(index.query(bbox)))
+    else:
+        re = select_co_bbox(cm, bbox, index, hierarchy)
 
-    return cm2
\ No newline at end of file
+    #-- the source model is not modified
+    return get_subset(cm, re)
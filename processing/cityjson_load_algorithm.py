@@ -15,10 +15,16 @@ from PyQt5.QtCore import QCoreApplication
 from qgis.core import (QgsFeatureSink, QgsProcessing, QgsProcessingAlgorithm,
                        QgsProcessingException, QgsProcessingParameterBoolean,
                        QgsProcessingParameterCrs, QgsProcessingParameterEnum,
-                       QgsProcessingParameterFile, QgsProcessingParameterExtent)
+                       QgsProcessingParameterFile, QgsProcessingParameterExtent,
+                       QgsProcessingParameterNumber, QgsProcessingParameterString)
 
-from ..core.loading import CityJSONLoader, get_model_epsg, load_cityjson_model
-from ..core.utils import get_subset_bbox, get_subset_cotype
+from ..core.filters import (AttributeFilter, FilterPipeline, parse_ids, parse_lods,
+                            read_ids_file)
+from ..core.jsonio import get_json_backend
+from ..core.loading import CityJSONLoader, get_model_epsg
+from ..core.modelcache import get_model_cache
+from ..core.subset import HierarchyIndex, select_co_bbox
+from ..core.utils import get_centroid_index, get_cotypes
 
 class CityJsonLoadAlrogithm(QgsProcessingAlgorithm):
     """
@@ -41,9 +47,15 @@ class CityJsonLoadAlrogithm(QgsProcessingAlgorithm):
     LOD_AS = 'LOD_AS'
     LOAD_SEMANTIC_SURFACES = 'LOAD_SEMANTIC_SURFACES'
     STYLE_BY_SEMANTIC_SURFACES = 'STYLE_BY_SEMANTIC_SURFACES'
+    GROUP_SEMANTIC_SURFACES = 'GROUP_SEMANTIC_SURFACES'
     SRID = 'SRID'
     BBOX = 'BBOX'
     OBJECT_TYPE = 'OBJECT_TYPE'
+    IDS = 'IDS'
+    IDS_FILE = 'IDS_FILE'
+    ATTRIBUTE_FILTER = 'ATTRIBUTE_FILTER'
+    LODS = 'LODS'
+    WORKERS = 'WORKERS'
 
     LODLOADINGTYPES = ['NONE', 'ATTRIBUTES', 'LAYERS']
     OBJECTTYPES = ['Building', 'Bridge', 'Road', 'TransportSquare', 'LandUse', 'Railway', 'TINRelief', 'WaterBody', 'PlantCover', 'SolitaryVegetationObject', 'CityFurniture', 'GenericCityObject', 'Tunnel']
@@ -103,6 +115,8 @@ class CityJsonLoadAlrogithm(QgsProcessingAlgorithm):
         return self.tr("Imports a CityJSON file to QGIS")
 
     def flags(self):
+        # Layers are added to the project at the end of the algorithm, which
+        # must happen in the main thread. Use WORKERS to convert in parallel.
         return super().flags() | QgsProcessingAlgorithm.FlagNoThreading
 
     def initAlgorithm(self, config=None):
@@ -136,6 +150,14 @@ class CityJsonLoadAlrogithm(QgsProcessingAlgorithm):
             )
         )
 
+        self.addParameter(
+            QgsProcessingParameterString(
+                self.LODS,
+                self.tr('Load only these LoDs (e.g. 2.2, separated by commas)'),
+                optional=True
+            )
+        )
+
         self.addParameter(
             QgsProcessingParameterBoolean(
                 self.LOAD_SEMANTIC_SURFACES,
@@ -144,6 +166,14 @@ class CityJsonLoadAlrogithm(QgsProcessingAlgorithm):
             )
         )
 
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                self.GROUP_SEMANTIC_SURFACES,
+                self.tr('Group semantic surfaces (one feature per surface instead of per polygon)'),
+                defaultValue=False
+            )
+        )
+
         self.addParameter(
             QgsProcessingParameterBoolean(
                 self.STYLE_BY_SEMANTIC_SURFACES,
@@ -178,6 +208,41 @@ class CityJsonLoadAlrogithm(QgsProcessingAlgorithm):
             )
         )
 
+        self.addParameter(
+            QgsProcessingParameterString(
+                self.IDS,
+                self.tr('Filter by ids (separated by commas)'),
+                optional=True
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterFile(
+                self.IDS_FILE,
+                self.tr('Filter by ids listed in a file'),
+                extension='txt',
+                optional=True
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterString(
+                self.ATTRIBUTE_FILTER,
+                self.tr("Filter by attributes (e.g. measuredHeight > 30 and roofType = 'flat')"),
+                optional=True
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.WORKERS,
+                self.tr('Number of worker processes for conversion'),
+                QgsProcessingParameterNumber.Integer,
+                defaultValue=1,
+                minValue=1
+            )
+        )
+
     def processAlgorithm(self, parameters, context, feedback):
         """
         Here is where the processing itself takes place.
@@ -206,12 +271,20 @@ class CityJsonLoadAlrogithm(QgsProcessingAlgorithm):
         )
         lod_as = self.LODLOADINGTYPES[lod_as]
 
+        lods = parse_lods(self.parameterAsString(parameters, self.LODS, context))
+
         load_semantic_surfaces = self.parameterAsBoolean(
             parameters,
             self.LOAD_SEMANTIC_SURFACES,
             context
         )
 
+        group_semantic_surfaces = self.parameterAsBoolean(
+            parameters,
+            self.GROUP_SEMANTIC_SURFACES,
+            context
+        )
+
         style_semantic_surfaces = self.parameterAsBoolean(
             parameters,
             self.STYLE_BY_SEMANTIC_SURFACES,
@@ -224,8 +297,25 @@ class CityJsonLoadAlrogithm(QgsProcessingAlgorithm):
             context
         )
 
+        workers = self.parameterAsInt(
+            parameters,
+            self.WORKERS,
+            context
+        )
+
+        # Check the attribute filter before the model is parsed
+        attribute_filter = None
+        expression = self.parameterAsString(parameters, self.ATTRIBUTE_FILTER, context)
+        if expression.strip():
+            try:
+                attribute_filter = AttributeFilter(expression)
+            except ValueError as error:
+                raise QgsProcessingException(str(error))
+
         feedback.setProgressText("Loading city model...")
-        cm = load_cityjson_model(filepath)
+        feedback.pushInfo("Parsing with {}.".format(get_json_backend()))
+        model_cache = get_model_cache()
+        cm = model_cache.get(filepath)
 
         feedback.pushInfo("Loaded {} objects.".format(len(cm["CityObjects"])))
 
@@ -253,20 +343,47 @@ class CityJsonLoadAlrogithm(QgsProcessingAlgorithm):
                 crs = crs
             )
 
-        if not extent.isNull():
-            feedback.setProgressText("Filtering objects by extent...")
-            cm = self.subset_bbox(cm, extent)
-            feedback.pushInfo("Found {} objects.".format(len(cm["CityObjects"])))
-        
         object_types = self.parameterAsEnums(
             parameters,
             self.OBJECT_TYPE,
             context
         )
 
+        ids = parse_ids(self.parameterAsString(parameters, self.IDS, context))
+        ids_file = self.parameterAsFile(parameters, self.IDS_FILE, context)
+        if ids_file:
+            ids.extend(read_ids_file(ids_file))
+
+        # All filters are applied in one scan of the model and one subset.
+        # The indexes are kept with the cached model for the next runs.
+        pipeline = FilterPipeline()
+
+        if not extent.isNull():
+            index = model_cache.get_extra(filepath, cm, "centroid_index", get_centroid_index)
+            hierarchy = model_cache.get_extra(filepath, cm, "hierarchy", HierarchyIndex.from_model)
+            pipeline.restrict_ids(select_co_bbox(cm, self.extent_to_bbox(extent), index, hierarchy))
+
         if len(object_types) > 0:
-            feedback.setProgressText("Filtering objects by type...")
-            cm = self.subset_cotype(cm, [self.OBJECTTYPES[t] for t in object_types])
+            pipeline.set_types(get_cotypes([self.OBJECTTYPES[t] for t in object_types]))
+
+        if len(ids) > 0:
+            hierarchy = model_cache.get_extra(filepath, cm, "hierarchy", HierarchyIndex.from_model)
+            missing = hierarchy.missing(ids)
+            if len(missing) > 0:
+                feedback.reportError("{} ids not found: {}.".format(len(missing),
+                                                                    ", ".join(missing[:10])))
+            pipeline.restrict_ids(hierarchy.select(ids))
+
+        if attribute_filter is not None:
+            pipeline.set_attribute_filter(attribute_filter)
+
+        # Drops the other LoDs with the vertices that only they use
+        if lods is not None:
+            pipeline.set_lods(lods)
+
+        if not pipeline.is_empty():
+            feedback.setProgressText("Filtering objects...")
+            cm = pipeline.apply(cm)
             feedback.pushInfo("Found {} objects.".format(len(cm["CityObjects"])))
 
         if len(cm["CityObjects"]) == 0:
@@ -280,29 +397,36 @@ class CityJsonLoadAlrogithm(QgsProcessingAlgorithm):
                                 divide_by_object=divide_by_type,
                                 lod_as=lod_as,
                                 load_semantic_surfaces=load_semantic_surfaces,
-                                style_semantic_surfaces=style_semantic_surfaces)
-        loader.load(feedback=feedback)
-
-        return {'STATUS': 'SUCCESS'}
-
-    def subset_bbox(self, cm, rectangle):
+                                style_semantic_surfaces=style_semantic_surfaces,
+                                group_semantic_surfaces=group_semantic_surfaces,
+                                lods=lods,
+                                workers=workers)
+        loader.convert(feedback=feedback)
+        statistics = loader.statistics()
+
+        if statistics["canceled"]:
+            feedback.pushInfo("Canceled after {} of {} objects.".format(statistics["loaded_objects"],
+                                                                        len(cm["CityObjects"])))
+            return {'STATUS': 'CANCELED',
+                    'LOADED_OBJECTS': statistics["loaded_objects"],
+                    'SKIPPED_GEOMETRIES': statistics["skipped_geometries"]}
+
+        feedback.setProgressText("Adding layers to the project...")
+        loader.layer_manager.flush()
+        loader.add_layers_to_project()
+
+        return {'STATUS': 'SUCCESS',
+                'LOADED_OBJECTS': statistics["loaded_objects"],
+                'SKIPPED_GEOMETRIES': statistics["skipped_geometries"]}
+
+    def extent_to_bbox(self, rectangle):
         """
-        Returns a subset of the original city model based on the defined
-        extent.
+        Returns the 2D bounding box of an extent.
         """
 
-        bbox = [
+        return [
             rectangle.xMinimum(),
             rectangle.yMinimum(),
             rectangle.xMaximum(),
             rectangle.yMaximum()
         ]
-
-        sub_cm = get_subset_bbox(cm, bbox)
-
-        return sub_cm
-
-    def subset_cotype(self, cm, cotype):
-        sub_cm = get_subset_cotype(cm, cotype)
-
-        return sub_cm
\ No newline at end of file
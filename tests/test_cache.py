@@ -0,0 +1,84 @@
+"""A list of tests to check the conversion cache"""
+
+import os
+
+import pytest
+
+from core.cache import CACHE_VERSION, ConversionCache, get_file_signature, normalize_path
+
+class TestConversionCache:
+    """A class to test the ConversionCache class"""
+
+    def test_key_depends_on_options(self, tmp_path):
+        """Do different loading options give different keys?"""
+        filepath = tmp_path / "model.city.json"
+        filepath.write_text("{}")
+        cache = ConversionCache(str(tmp_path / "cache"))
+
+        key = cache.get_key(str(filepath), {"lod_as": "NONE"})
+
+        assert key == cache.get_key(str(filepath), {"lod_as": "NONE"})
+        assert key != cache.get_key(str(filepath), {"lod_as": "LAYERS"})
+
+    def test_key_depends_on_version(self, tmp_path):
+        """Are the layers of another cache version never reused?"""
+        filepath = tmp_path / "model.city.json"
+        filepath.write_text("{}")
+        old_cache = ConversionCache(str(tmp_path / "cache"), version=CACHE_VERSION - 1)
+        cache = ConversionCache(str(tmp_path / "cache"))
+
+        key = old_cache.get_key(str(filepath), {})
+        (tmp_path / "cache").mkdir()
+        (tmp_path / "cache" / "{}.gpkg".format(key)).write_bytes(b"")
+        (tmp_path / "cache" / "{}.json".format(key)).write_text('{"layers": [], "skipped_geometries": 0}')
+
+        assert cache.get_key(str(filepath), {}) != key
+        assert cache.load(str(filepath), {}) is None
+
+    def test_signature_depends_on_content(self, tmp_path):
+        """Does the signature change when the file changes?"""
+        filepath = tmp_path / "model.city.json"
+        filepath.write_text("{}")
+        signature = get_file_signature(str(filepath))
+
+        filepath.write_text("{\"type\": \"CityJSON\"}")
+
+        assert get_file_signature(str(filepath)) != signature
+
+    def test_missing_entry(self, tmp_path):
+        """Is None returned for files that are not cached?"""
+        filepath = tmp_path / "model.city.json"
+        filepath.write_text("{}")
+        cache = ConversionCache(str(tmp_path / "cache"))
+
+        assert cache.load(str(filepath), {}) is None
+
+    def test_evict_least_recently_used(self, tmp_path):
+        """Are the oldest entries removed when over the maximum size?"""
+        cache = ConversionCache(str(tmp_path), max_size=250)
+        for i, name in enumerate(["old", "middle", "new"]):
+            path = tmp_path / "{}.gpkg".format(name)
+            path.write_bytes(b"x" * 100)
+            (tmp_path / "{}.json".format(name)).write_text("{}")
+            os.utime(path, (i, i))
+
+        cache.evict()
+
+        assert sorted(os.listdir(tmp_path)) == ["middle.gpkg", "middle.json",
+                                                "new.gpkg", "new.json"]
+
+    def test_evict_keeps_files_in_use(self, tmp_path):
+        """Are the entries whose files are in use kept when over the maximum
+        size?
+        """
+        cache = ConversionCache(str(tmp_path), max_size=150)
+        for i, name in enumerate(["old", "new"]):
+            path = tmp_path / "{}.gpkg".format(name)
+            path.write_bytes(b"x" * 100)
+            (tmp_path / "{}.json".format(name)).write_text("{}")
+            os.utime(path, (i, i))
+
+        failed = cache.evict({normalize_path(str(tmp_path / "old.gpkg"))})
+
+        assert failed == []
+        assert sorted(os.listdir(tmp_path)) == ["old.gpkg", "old.json"]
@@ -0,0 +1,109 @@
+import pytest
+
+from core.filters import AttributeFilter, FilterPipeline, parse_ids, parse_lods, read_ids_file, select_by_attributes
+
+cityobjects = {
+    "id-1": {"type": "Building", "attributes": {"measuredHeight": 35.5, "roofType": "flat", "storeys": 10}},
+    "id-2": {"type": "Building", "attributes": {"measuredHeight": 12.0, "roofType": "gabled", "storeys": "3"}},
+    "id-3": {"type": "Building", "attributes": {"roof type": "flat", "monument": True}},
+    "id-4": {"type": "Road"}
+}
+
+class TestAttributeFilter:
+    """A class to test the AttributeFilter class"""
+
+    @pytest.mark.parametrize("expression, expected", [
+        ("measuredHeight > 30", ["id-1"]),
+        ("measuredHeight <= 12", ["id-2"]),
+        ("roofType = 'flat'", ["id-1"]),
+        ("roofType != 'flat'", ["id-2"]),
+        ("storeys >= 3", ["id-1", "id-2"]),
+        ("\"roof type\" = flat", ["id-3"]),
+        ("monument = true", ["id-3"]),
+        ("measuredHeight > 30 or roofType = 'gabled'", ["id-1", "id-2"]),
+        ("measuredHeight > 10 AND NOT (roofType = 'flat')", ["id-2"]),
+    ])
+    def test_selection(self, expression, expected):
+        """Are the objects matching the filter selected?"""
+        attribute_filter = AttributeFilter(expression)
+
+        assert select_by_attributes(cityobjects, attribute_filter) == expected
+
+    def test_missing_attributes(self):
+        """Do objects without the attribute never match?"""
+        attribute_filter = AttributeFilter("measuredHeight != 1")
+
+        assert not attribute_filter.matches(cityobjects["id-4"])
+
+    @pytest.mark.parametrize("expression", ["", "measuredHeight >", "> 30",
+                                            "(storeys = 1", "storeys = 1 2", "storeys ~ 1"])
+    def test_invalid(self, expression):
+        """Are invalid filters rejected?"""
+        with pytest.raises(ValueError):
+            AttributeFilter(expression)
+
+citymodel = {
+    "type": "CityJSON",
+    "version": "1.1",
+    "CityObjects": {
+        "id-1": {"type": "Building", "attributes": {"measuredHeight": 35.5},
+                 "geometry": [{"type": "MultiSurface", "lod": "1.2", "boundaries": [[[0, 1, 2]]]},
+                              {"type": "MultiSurface", "lod": "2.2", "boundaries": [[[3, 4, 5]]]}]},
+        "id-2": {"type": "Building", "attributes": {"measuredHeight": 12.0},
+                 "geometry": [{"type": "MultiSurface", "lod": "2.2", "boundaries": [[[0, 3, 4]]]}]},
+        "id-3": {"type": "Road",
+                 "geometry": [{"type": "MultiSurface", "lod": "1.2", "boundaries": [[[0, 1, 2]]]}]},
+        "id-4": {"type": "Building"}
+    },
+    "vertices": [[0, 0, 0], [1, 0, 0], [0, 1, 0], [5, 5, 0], [6, 5, 0], [5, 6, 0]]
+}
+
+class TestFilterPipeline:
+    """A class to test the FilterPipeline class"""
+
+    def test_no_filters(self):
+        """Is the model itself returned without filters?"""
+        assert FilterPipeline().apply(citymodel) is citymodel
+
+    def test_combined_filters(self):
+        """Are only the objects that match all filters selected?"""
+        pipeline = FilterPipeline()
+        pipeline.restrict_ids(["id-1", "id-2", "id-3"])
+        pipeline.restrict_ids(["id-1", "id-2", "id-4"])
+        pipeline.set_types(["Building"])
+        pipeline.set_attribute_filter(AttributeFilter("measuredHeight > 30"))
+
+        assert pipeline.select(citymodel) == ["id-1"]
+
+    def test_lods(self):
+        """Are only the geometries of the LoDs kept, with their objects?"""
+        pipeline = FilterPipeline()
+        pipeline.set_lods(["2.2"])
+
+        subset = pipeline.apply(citymodel)
+
+        assert list(subset["CityObjects"]) == ["id-1", "id-2", "id-4"]
+        assert len(subset["CityObjects"]["id-1"]["geometry"]) == 1
+        assert subset["CityObjects"]["id-1"]["geometry"][0]["boundaries"] == [[[1, 2, 3]]]
+        assert subset["vertices"] == [[0, 0, 0], [5, 5, 0], [6, 5, 0], [5, 6, 0]]
+        assert len(citymodel["CityObjects"]["id-1"]["geometry"]) == 2
+
+class TestIds:
+    """A class to test the parsing of lists of ids"""
+
+    def test_parse_ids(self):
+        """Are ids separated by commas, semicolons and whitespace?"""
+        assert parse_ids(" id-1, id-2;id-3\nid-4 ") == ["id-1", "id-2", "id-3", "id-4"]
+        assert parse_ids("") == []
+
+    def test_parse_lods(self):
+        """Are the LoDs listed, or None if there are none?"""
+        assert parse_lods("2.2, 1.3") == ["2.2", "1.3"]
+        assert parse_lods(" ") is None
+
+    def test_read_ids_file(self, tmp_path):
+        """Are the ids of a file read, one per line?"""
+        filepath = tmp_path / "ids.txt"
+        filepath.write_text("id-1\r\nid-2\n\nid-3\n", encoding="utf-8")
+
+        assert read_ids_file(str(filepath)) == ["id-1", "id-2", "id-3"]
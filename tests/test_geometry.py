@@ -1,8 +1,25 @@
 import pytest
+from qgis.core import QgsGeometry, QgsLineString, QgsMultiPolygon, QgsPoint, QgsPolygon
 
-from core.geometry import GeometryReader, VerticesCache, read_boundaries
+from core.geometry import (GeometryReader, VerticesCache, flatten_boundaries, get_ranges,
+                           polygons_to_wkb, read_boundaries)
 from tests.sample_geometries import *
 
+def reference_geometry(polygons):
+    """Returns the geometry of the polygons built through QgsMultiPolygon"""
+    geoms = QgsMultiPolygon()
+    for polygon in polygons:
+        g = QgsPolygon()
+        for i, ring in enumerate(polygon):
+            r = QgsLineString([QgsPoint(x, y, z) for x, y, z in ring.tolist()])
+            if i == 0:
+                g.setExteriorRing(r)
+            else:
+                g.addInteriorRing(r)
+        geoms.addGeometry(g)
+
+    return QgsGeometry(geoms)
+
 class TestReadBoundaries:
     """A class to test the read_boundaries function"""
 
@@ -24,6 +41,111 @@ class TestReadBoundaries:
         assert [surface["type"] if surface is not None else None for surface in semantic_surfaces] \
                 == ["WallSurface", "WallSurface", None, "RoofSurface", "Door"]
 
+class TestFlattenBoundaries:
+    """A class to test the flatten_boundaries function"""
+
+    def test_multisurface(self):
+        """Are the rings and semantic values of a multisurface flattened?"""
+        boundaries = example_multisurface_with_semantics[0]["boundaries"]
+        values = example_multisurface_with_semantics[0]["semantics"]["values"]
+
+        flat = flatten_boundaries(boundaries, values)
+
+        assert len(flat) == 5
+        assert flat.indices[:8].tolist() == [0, 3, 2, 1, 4, 5, 6, 7]
+        assert flat.ring_offsets.tolist() == [0, 4, 8, 12, 16, 20]
+        assert flat.polygon_offsets.tolist() == [0, 1, 2, 3, 4, 5]
+        assert flat.shell_offsets.tolist() == [0, 5]
+        assert flat.semantic_values == [0, 0, None, 1, 2]
+
+    def test_composite_solid_with_semantics(self):
+        """Are shells and null semantic values of solids flattened?"""
+        boundaries = example_solid_with_semantics[0]["boundaries"]
+        values = example_solid_with_semantics[0]["semantics"]["values"]
+
+        flat = flatten_boundaries(boundaries, values)
+
+        assert len(flat) == 8
+        assert flat.shell_offsets.tolist() == [0, 4, 8]
+        assert flat.ring_offsets[:3].tolist() == [0, 5, 9]
+        assert flat.semantic_values == [0, 1, 1, None, None, None, None, None]
+
+    def test_interior_rings(self):
+        """Are interior rings part of the same polygon?"""
+        flat = flatten_boundaries([[[0, 1, 2, 3], [4, 5, 6]], [[7, 8, 9]]])
+
+        assert flat.polygon_offsets.tolist() == [0, 2, 3]
+        assert flat.semantic_values == [None, None]
+
+class TestVerticesCache:
+    """A class to test the VerticesCache class"""
+
+    def test_dequantization(self):
+        """Are the scale and translation applied to all vertices?"""
+        vertices = VerticesCache(scale=(0.5, 0.5, 0.1),
+                                 translate=(100, 200, 10),
+                                 vertices=[[0, 0, 0], [2, 4, 10]])
+
+        assert len(vertices) == 2
+        assert vertices.get_coords([1]).tolist() == [[101.0, 202.0, 11.0]]
+
+        vertex = vertices.get_vertex(0)
+        assert (vertex.x(), vertex.y(), vertex.z()) == (100.0, 200.0, 10.0)
+
+    def test_add_vertex_after_set_vertices(self):
+        """Are vertices added one by one appended after the array?"""
+        vertices = VerticesCache(vertices=[[0, 0, 0]])
+        vertices.add_vertex([1, 2, 3])
+
+        assert len(vertices) == 2
+        assert vertices.get_coords([0, 1]).tolist() == [[0, 0, 0], [1, 2, 3]]
+
+class TestFlatPolygons:
+    """A class to test the selection and grouping of FlatPolygons"""
+
+    def read_polygons(self, geometry):
+        """Returns the FlatPolygons of a geometry with numbered vertices"""
+        vertices = [[float(i), 0.0, 0.0] for i in range(50)]
+        return GeometryReader(VerticesCache(vertices=vertices)).read_flat_polygons(geometry)
+
+    def test_get_ranges(self):
+        """Are the ranges concatenated?"""
+        assert get_ranges([5, 0, 2], [2, 0, 3]).tolist() == [5, 6, 2, 3, 4]
+
+    def test_take(self):
+        """Are the rings of the selected polygons kept, in order?"""
+        geometry = [{"type": "MultiSurface",
+                     "boundaries": [[[0, 1, 2, 3], [4, 5, 6]], [[7, 8, 9]], [[10, 11, 12]]]}]
+        flat_polygons = self.read_polygons(geometry)
+
+        selected = flat_polygons.take([2, 0])
+
+        assert len(selected) == 2
+        assert [[ring[:, 0].tolist() for ring in polygon] for polygon in selected.to_list()] \
+                == [[[10, 11, 12]], [[0, 1, 2, 3], [4, 5, 6]]]
+
+    def test_unsupported_types(self):
+        """Are points and lines skipped instead of read as polygons?"""
+        vertices = [[float(i), 0.0, 0.0] for i in range(3)]
+        geometry_reader = GeometryReader(VerticesCache(vertices=vertices))
+        geometry = [{"type": "MultiLineString", "boundaries": [[0, 1], [1, 2]]},
+                    {"type": "MultiSurface", "boundaries": [[[0, 1, 2]]]}]
+
+        flat_polygons = geometry_reader.read_flat_polygons(geometry)
+
+        assert len(flat_polygons) == 1
+        assert geometry_reader.skipped_geometries() == 1
+
+    def test_group_by_semantics(self):
+        """Are the polygons of the same semantic surface grouped?"""
+        flat_polygons = self.read_polygons(example_multisurface_with_semantics)
+
+        groups = flat_polygons.group_by_semantics()
+
+        assert [None if semantic is None else semantic["type"] for semantic, _ in groups] \
+                == ["WallSurface", None, "RoofSurface", "Door"]
+        assert [len(polygons) for _, polygons in groups] == [2, 1, 1, 1]
+
 class TestGeometryReader:
     """A class that tests the geometry reader."""
 
@@ -108,3 +230,100 @@ class TestGeometryReader:
         new_polygons = geometry_reader.indexes_to_points(polygons, vertices)
         
         assert len(new_polygons) == 1
+
+class TestWkbEncoding:
+    """A class to test the WKB encoding of polygons"""
+
+    def create_reader(self, geometry_templates=None):
+        """Returns a geometry reader with enough vertices for the examples"""
+        vertices = [[i * 0.5, i * 0.25, i * 2.0] for i in range(900)]
+        return GeometryReader(VerticesCache(vertices=vertices), geometry_templates)
+
+    @pytest.mark.parametrize("geometry", [example_multisurface_with_semantics,
+                                          example_solid_with_semantics,
+                                          example_composite_solid])
+    def test_identical_to_multipolygon(self, geometry):
+        """Is the WKB identical to the one of a QgsMultiPolygon?"""
+        geometry_reader = self.create_reader()
+        polygons, _ = geometry_reader.get_polygons(geometry)
+
+        geom = geometry_reader.polygons_to_geometry(polygons)
+
+        assert bytes(geom.asWkb()) == bytes(reference_geometry(polygons).asWkb())
+
+    def test_identical_with_interior_rings(self):
+        """Is the WKB identical for polygons with holes?"""
+        geometry_reader = self.create_reader()
+        geometry = [{"type": "MultiSurface",
+                     "boundaries": [[[0, 1, 2, 3], [4, 5, 6]], [[7, 8, 9]]]}]
+        polygons, _ = geometry_reader.get_polygons(geometry)
+
+        geom = geometry_reader.polygons_to_geometry(polygons)
+
+        assert bytes(geom.asWkb()) == bytes(reference_geometry(polygons).asWkb())
+
+    def test_closed_rings(self):
+        """Are open rings closed, so that a triangle has four points?"""
+        geometry_reader = self.create_reader()
+        geometry = [{"type": "MultiSurface", "boundaries": [[[0, 1, 2]]]}]
+
+        geom = geometry_reader.read_geometry(geometry)
+
+        ring = geom.constGet().geometryN(0).exteriorRing()
+        assert ring.numPoints() == 4
+        assert ring.isClosed()
+
+    def test_empty_geometry(self):
+        """Is the WKB of no polygons identical to an empty QgsMultiPolygon?"""
+        assert polygons_to_wkb([]) == bytes(QgsGeometry(QgsMultiPolygon()).asWkb())
+
+class TestGeometryTemplates:
+    """A class to test the placement of geometry instances"""
+
+    def create_reader(self):
+        """Returns a geometry reader with the example templates"""
+        vertices = [[i * 0.5, i * 0.25, i * 2.0] for i in range(900)]
+        return GeometryReader(VerticesCache(vertices=vertices), example_geometry_template)
+
+    def test_transformation_matrix(self):
+        """Is the instance scaled by its matrix and moved to its reference
+        point?
+        """
+        geometry_reader = self.create_reader()
+
+        polygons, _ = geometry_reader.get_polygons(example_geometry_instance)
+
+        template_vertices = example_geometry_template["vertices-templates"]
+        expected = [[2.0 * c + r for c, r in zip(template_vertices[i], [186.0, 93.0, 744.0])]
+                    for i in [0, 3, 2, 1]]
+        assert polygons[0][0].tolist() == pytest.approx(expected)
+
+    def test_wkb_identical_to_polygons(self):
+        """Is the WKB of a placed template identical to the one of its
+        polygons?
+        """
+        geometry_reader = self.create_reader()
+        polygons, _ = geometry_reader.get_polygons(example_geometry_instance)
+
+        geom = geometry_reader.read_geometry(example_geometry_instance)
+
+        assert bytes(geom.asWkb()) == bytes(reference_geometry(polygons).asWkb())
+
+    def test_template_read_once(self):
+        """Is every template only converted once for all its instances?"""
+        geometry_reader = self.create_reader()
+
+        first = geometry_reader.get_template(0)
+        geometry_reader.read_geometry(example_geometry_instance)
+
+        assert geometry_reader.get_template(0) is first
+
+    def test_missing_template(self):
+        """Is an instance of a missing template skipped?"""
+        geometry_reader = self.create_reader()
+        geometry = [dict(example_geometry_instance[0], template=5)]
+
+        geom = geometry_reader.read_geometry(geometry)
+
+        assert geom.isEmpty()
+        assert geometry_reader.skipped_geometries() == 1
@@ -0,0 +1,121 @@
+"""A list of tests to check the parsing of JSON files"""
+
+import io
+import json
+
+import pytest
+
+from core.jsonio import (JsonScanner, get_backends, get_json_backend,
+                         load_file, loads, peek_members)
+
+citymodel = {"type": "CityJSON", "version": "1.1", "CityObjects": {"id-1": {"type": "Building"}},
+             "vertices": [[0, 0, 0]], "metadata": {"title": "Délft"}}
+
+class TestJsonIO:
+    """A class to test the jsonio module"""
+
+    def test_fallback_backend(self):
+        """Is the standard library always available as the last backend?"""
+        assert get_backends()[-1] == "json"
+        assert get_json_backend() == get_backends()[0]
+
+    @pytest.mark.parametrize("backend", get_backends())
+    def test_load_file(self, tmp_path, backend):
+        """Does every backend parse the same model from the file?"""
+        filepath = tmp_path / "model.city.json"
+        filepath.write_text(json.dumps(citymodel, ensure_ascii=False), encoding="utf-8")
+
+        assert load_file(str(filepath), backend) == citymodel
+
+    @pytest.mark.parametrize("backend", get_backends())
+    def test_load_file_with_bom(self, tmp_path, backend):
+        """Is a UTF-8 byte order mark skipped?"""
+        filepath = tmp_path / "model.city.json"
+        filepath.write_text(json.dumps(citymodel, ensure_ascii=False), encoding="utf-8-sig")
+
+        assert load_file(str(filepath), backend) == citymodel
+
+    def test_empty_file(self, tmp_path):
+        """Does an empty file raise a ValueError?"""
+        filepath = tmp_path / "empty.json"
+        filepath.write_bytes(b"")
+
+        with pytest.raises(ValueError):
+            load_file(str(filepath))
+
+    def test_unknown_backend(self):
+        """Is an unknown backend rejected?"""
+        with pytest.raises(ValueError):
+            loads(b"{}", "yaml")
+
+class TestJsonScanner:
+    """A class to test the JsonScanner class"""
+
+    tricky_model = {"CityObjects": {"id-1": {"type": "Building",
+                                             "attributes": {"name": "a \\\"]}{[ \\", "ids": [1, [2, {}]]}}},
+                    "vertices": [[0, 0, 0], [1, 2, 3]],
+                    "version": "1.1",
+                    "metadata": {"title": "[{ \\\" }]"},
+                    "transform": {"scale": [0.1, 0.1, 0.1], "translate": [0, 0, 0]}}
+
+    @pytest.mark.parametrize("block_size", [1, 2, 3, 7, 1024])
+    def test_read_members(self, block_size):
+        """Are members after skipped values read, whatever the block size?"""
+        data = json.dumps(self.tricky_model).encode("utf-8")
+
+        members = JsonScanner(io.BytesIO(data), block_size).read_members(["version", "metadata"])
+
+        assert members == {"version": "1.1", "metadata": self.tricky_model["metadata"]}
+
+    def test_stops_when_found(self):
+        """Is the rest of the file ignored once all members are found?"""
+        data = b'{"version": "1.1", "CityObjects": {"id-1": [[[ truncated'
+
+        members = JsonScanner(io.BytesIO(data), 4).read_members(["version"])
+
+        assert members == {"version": "1.1"}
+
+    def test_stops_at_body_without_optional_members(self):
+        """Is the rest of the file ignored once only optional members remain,
+        e.g. in a file without "+metadata-extended"?
+        """
+        data = (b'{"type": "CityJSON", "version": "1.1", "metadata": {"title": "a"}, '
+                b'"transform": {"scale": [1, 1, 1], "translate": [0, 0, 0]}, '
+                b'"CityObjects": {"id-1": [[[ truncated')
+
+        members = JsonScanner(io.BytesIO(data), 4).read_members(
+            ["type", "version", "metadata"], ["transform", "+metadata-extended"],
+            ["CityObjects", "vertices"])
+
+        assert members == {"type": "CityJSON", "version": "1.1", "metadata": {"title": "a"},
+                           "transform": {"scale": [1, 1, 1], "translate": [0, 0, 0]}}
+
+    def test_reads_past_body_for_required_members(self):
+        """Are required members after the large ones still read?"""
+        data = json.dumps(self.tricky_model).encode("utf-8")
+
+        members = JsonScanner(io.BytesIO(data), 7).read_members(
+            ["version"], ["+metadata-extended"], ["CityObjects", "vertices"])
+
+        assert members == {"version": "1.1"}
+
+    def test_resume_after_stop_key(self):
+        """Are members after a stop key read when reading resumes?"""
+        data = json.dumps(self.tricky_model).encode("utf-8")
+        scanner = JsonScanner(io.BytesIO(data), 3)
+
+        members = scanner.read_members([], ["transform"], ["CityObjects"])
+        assert (members, scanner.stopped_at) == ({}, "CityObjects")
+
+        members = scanner.read_members(["transform"])
+        assert members == {"transform": self.tricky_model["transform"]}
+        assert scanner.stopped_at is None
+
+    def test_missing_members(self, tmp_path):
+        """Are missing members left out?"""
+        filepath = tmp_path / "model.city.json"
+        filepath.write_text(json.dumps(self.tricky_model), encoding="utf-8-sig")
+
+        members = peek_members(str(filepath), ["version", "+metadata-extended"])
+
+        assert members == {"version": "1.1"}
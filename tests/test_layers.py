@@ -1,6 +1,10 @@
 import pytest
+from PyQt5.QtCore import QDate, QVariant
+from qgis.core import NULL
 
-from core.layers import TypeNamingIterator, BaseFieldsBuilder, NullFieldsBuilder, AttributeFieldsDecorator, LodFieldsDecorator, SemanticSurfaceFieldsDecorator
+from core.geometry import GeometryReader, VerticesCache
+from core.layers import TypeNamingIterator, BaseFieldsBuilder, NullFieldsBuilder, AttributeFieldsDecorator, LodFieldsDecorator, SemanticSurfaceFieldsDecorator, BaseNamingIterator, DynamicLayerManager, FieldMap, LodNamingDecorator, SimpleFeatureBuilder, create_feature_builder
+from tests.sample_geometries import example_multisurface_with_semantics
 
 two_cubes_citymodel = {"CityObjects":{"id-1":{"geometry":[{"boundaries":[[[0,1,2,3]],[[7,4,0,3]],[[4,5,1,0]],[[5,6,2,1]],[[3,2,6,7]],[[6,5,4,7]]],"lod":1,"type":"MultiSurface"}],"type":"GenericCityObject"}},"type":"CityJSON","version":"0.9","vertices":[[1.0,0.0,1.0],[0.0,1.0,1.0],[-1.0,0.0,1.0],[0.0,-1.0,1.0],[1.0,0.0,0.0],[0.0,1.0,0.0],[-1.0,0.0,0.0],[0.0,-1.0,0.0]],"metadata":{"geographicalExtent":[-1.0,-1.0,0.0,1.0,1.0,1.0]}}
 citymodel_with_attributes = {"type":"CityJSON","version":"0.9","CityObjects":{"id-1":{"type":"Building","attributes":{"attribute1":1,"attribute2":2}},"id-2":{"type":"Building","attributes":{"attribute1":1,"attribute3":2}}}}
@@ -44,6 +48,18 @@ class TestFieldBuilders:
         assert "attribute.attribute2" in field_names
         assert "attribute.attribute3" in field_names
     
+    def test_typed_attributes_fields(self):
+        """Are the field types inferred from the attribute values?"""
+        citymodel = {"CityObjects": {"id-1": {"type": "Building",
+                                              "attributes": {"height": 10.5, "storeys": 2, "name": "a"}}}}
+        builder = AttributeFieldsDecorator(NullFieldsBuilder(), citymodel)
+
+        fields = builder.get_fields()
+
+        assert fields[0].type() == QVariant.Double
+        assert fields[1].type() == QVariant.Int
+        assert fields[2].type() == QVariant.String
+
     def test_lod_fields_builder(self):
         """Tests that LodFieldsBuilder create the lod field"""
         builder = NullFieldsBuilder()
@@ -63,3 +79,137 @@ class TestFieldBuilders:
 
         assert len(fields) == 1
         assert fields[0].name() == "semantic_surface"
+
+class TestFieldMap:
+    """A class to test the FieldMap class"""
+
+    def create_field_map(self):
+        """Returns the field map of the base fields and some typed attributes"""
+        citymodel = {"CityObjects": {"id-1": {"type": "Building",
+                                              "attributes": {"storeys": 2,
+                                                             "built": "2001-05-12",
+                                                             "names": ["a", "b"]}}}}
+        fields = AttributeFieldsDecorator(BaseFieldsBuilder(), citymodel).get_fields()
+
+        return FieldMap(fields), citymodel
+
+    def test_indices(self):
+        """Are the attributes mapped by their keys without prefix?"""
+        field_map, _ = self.create_field_map()
+
+        assert field_map.indices["uid"] == 0
+        assert field_map.attribute_indices == {"storeys": 4, "built": 5, "names": 6}
+        assert field_map.surface_indices == {}
+
+    def test_converted_attributes(self):
+        """Are the attributes of a feature set by index and converted to
+        the types of their fields?
+        """
+        field_map, citymodel = self.create_field_map()
+        feature_builder = SimpleFeatureBuilder(GeometryReader(VerticesCache()))
+
+        features = feature_builder.create_features(field_map, "id-1", citymodel["CityObjects"]["id-1"])
+        feature = next(iter(features))
+
+        assert feature["uid"] == "id-1"
+        assert feature["attribute.storeys"] == 2
+        assert feature["attribute.built"] == QDate(2001, 5, 12)
+        assert feature["attribute.names"] == "['a', 'b']"
+
+lods_citymodel = {"CityObjects": {
+    "id-1": {"type": "Building",
+             "geometry": [{"type": "MultiSurface", "lod": "1.2", "boundaries": [[[0, 1, 2]]]},
+                          {"type": "MultiSurface", "lod": "2.2", "boundaries": [[[0, 1, 2]], [[2, 1, 0]]]}]},
+    "id-2": {"type": "Building",
+             "geometry": [{"type": "MultiSurface", "lod": "1.2", "boundaries": [[[0, 1, 2]]]}]}}}
+
+class TestLodFilter:
+    """A class to test loading only some LoDs"""
+
+    def create_reader(self):
+        """Returns a geometry reader with the vertices of the model"""
+        return GeometryReader(VerticesCache(vertices=[[0, 0, 0], [1, 0, 0], [0, 1, 0]]))
+
+    def test_filtered_geometries(self):
+        """Are only the geometries of the LoDs read, and objects without
+        them skipped?
+        """
+        feature_builder = SimpleFeatureBuilder(self.create_reader(), lods=["2.2"])
+        field_map = FieldMap(BaseFieldsBuilder().get_fields())
+
+        features = feature_builder.create_features(field_map, "id-1", lods_citymodel["CityObjects"]["id-1"])
+        feature, geometries = next(iter(features.items()))
+
+        assert [geom["lod"] for geom in geometries] == ["2.2"]
+        assert feature.geometry().constGet().numGeometries() == 2
+        assert feature_builder.create_features(field_map, "id-2", lods_citymodel["CityObjects"]["id-2"]) == {}
+
+    def test_filtered_layers(self):
+        """Are the layers of the other LoDs left out?"""
+        naming_iterator = LodNamingDecorator(BaseNamingIterator("lods"), "lods", lods_citymodel,
+                                             self.create_reader(), lods=["2.2"])
+
+        assert sorted(naming_iterator.all_layers()) == ["lods [LoD2.2]", "lods [LoDNone]"]
+
+class TestSemanticSurfaceFeatures:
+    """A class to test the features created per semantic surface"""
+
+    def create_features(self, geometry, group_semantic_surfaces=False):
+        """Returns the features of an object with the given geometry"""
+        citymodel = {"CityObjects": {"id-1": {"type": "Building", "geometry": geometry}}}
+        vertices = VerticesCache(vertices=[[float(i), 0.0, 0.0] for i in range(50)])
+        feature_builder = create_feature_builder(GeometryReader(vertices),
+                                                 load_semantic_surfaces=True,
+                                                 group_semantic_surfaces=group_semantic_surfaces)
+        fields = SemanticSurfaceFieldsDecorator(BaseFieldsBuilder(), citymodel).get_fields()
+
+        return list(feature_builder.create_features(FieldMap(fields), "id-1", citymodel["CityObjects"]["id-1"]))
+
+    def test_feature_per_polygon(self):
+        """Is there a feature with the surface's attributes per polygon?"""
+        features = self.create_features(example_multisurface_with_semantics)
+
+        assert len(features) == 5
+        assert [f["surface.type"] for f in features] \
+                == ["WallSurface", "WallSurface", NULL, "RoofSurface", "Door"]
+        assert all(f["uid"] == "id-1" for f in features)
+
+    def test_feature_per_surface(self):
+        """Is there a feature with all polygons per semantic surface?"""
+        features = self.create_features(example_multisurface_with_semantics, True)
+
+        assert len(features) == 4
+        assert features[0]["surface.slope"] == 33.4
+        assert features[0].geometry().constGet().numGeometries() == 2
+
+    def test_single_polygon(self):
+        """Does a geometry with a single polygon keep its geometry?"""
+        geometry = [{"type": "MultiSurface", "boundaries": [[[0, 1, 2]]]}]
+
+        features = self.create_features(geometry)
+
+        assert len(features) == 1
+        assert features[0].hasGeometry()
+
+class TestDynamicLayerManager:
+    """A class to test the DynamicLayerManager class"""
+
+    def test_batched_features(self):
+        """Are features added in batches and all of them after a flush?"""
+        feature_builder = SimpleFeatureBuilder(GeometryReader(VerticesCache()))
+        manager = DynamicLayerManager(citymodel_with_attributes,
+                                      feature_builder,
+                                      BaseNamingIterator("attributes"),
+                                      BaseFieldsBuilder(),
+                                      srid=7415,
+                                      batch_size=2)
+        manager.prepare_attributes()
+
+        for i in range(3):
+            manager.add_object("id-{}".format(i), {"type": "Building"})
+
+        layer = manager.get_all_layers()[0]
+        assert layer.featureCount() == 2
+
+        manager.flush()
+        assert layer.featureCount() == 3
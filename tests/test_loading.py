@@ -0,0 +1,137 @@
+"""A list of tests to check the loading of CityJSON files"""
+
+import json
+
+import pytest
+
+from core.loading import CityJSONLoader, CityJSONSeqReader, is_cityjsonseq, peek_cityjson_header
+
+seq_header = {"type": "CityJSON", "version": "1.1",
+              "transform": {"scale": [0.01, 0.01, 0.01], "translate": [0, 0, 0]},
+              "CityObjects": {}, "vertices": []}
+seq_features = [
+    {"type": "CityJSONFeature", "id": "id-1",
+     "CityObjects": {"id-1": {"type": "Building", "children": ["id-2"]},
+                     "id-2": {"type": "BuildingPart", "parents": ["id-1"]}},
+     "vertices": [[0, 0, 0], [100, 0, 0], [100, 100, 0]]},
+    {"type": "CityJSONFeature", "id": "id-3",
+     "CityObjects": {"id-3": {"type": "Road"}},
+     "vertices": [[0, 0, 0]]}
+]
+
+@pytest.fixture
+def seq_file(tmp_path):
+    """Writes a small CityJSONL file and returns its path"""
+    filepath = tmp_path / "sample.city.jsonl"
+    lines = [json.dumps(seq_header)] + [json.dumps(f) for f in seq_features]
+    filepath.write_text("\n".join(lines) + "\n")
+
+    return str(filepath)
+
+class TestCityJSONSeqReader:
+    """A class to test the CityJSONSeqReader class"""
+
+    def test_is_cityjsonseq(self):
+        """Are CityJSONL files identified by their extension?"""
+        assert is_cityjsonseq("/data/tile.city.jsonl")
+        assert not is_cityjsonseq("/data/tile.city.json")
+
+    def test_header(self, seq_file):
+        """Is the header read from the first line?"""
+        reader = CityJSONSeqReader(seq_file)
+
+        assert reader.header["version"] == "1.1"
+        assert reader.header["transform"]["scale"] == [0.01, 0.01, 0.01]
+
+    def test_features(self, seq_file):
+        """Are all features read with increasing positions?"""
+        reader = CityJSONSeqReader(seq_file)
+
+        features = list(reader.features())
+
+        assert [f["id"] for f, _ in features] == ["id-1", "id-3"]
+        assert features[0][1] < features[1][1] <= reader.size
+
+    def test_streamed_city_objects(self, seq_file):
+        """Are the city objects of all features streamed by the model?"""
+        citymodel = CityJSONSeqReader(seq_file).get_citymodel()
+
+        assert list(citymodel["CityObjects"]) == ["id-1", "id-2", "id-3"]
+        assert [obj["type"] for obj in citymodel["CityObjects"].values()] \
+                == ["Building", "BuildingPart", "Road"]
+        assert citymodel["vertices"] == []
+
+class CancelAfterFirstChunk:
+    """A feedback that is canceled once the first progress is reported"""
+
+    def __init__(self):
+        self.progress = []
+
+    def setProgress(self, progress):
+        self.progress.append(progress)
+
+    def isCanceled(self):
+        return len(self.progress) > 0
+
+class TestCityJSONLoader:
+    """A class to test the conversion of the CityJSONLoader class"""
+
+    citymodel = {"type": "CityJSON", "version": "1.0", "metadata": {},
+                 "CityObjects": {"id-{}".format(i): {"type": "Building"} for i in range(5)},
+                 "vertices": []}
+
+    def test_progress_per_chunk(self):
+        """Is the progress reported once per chunk?"""
+        loader = CityJSONLoader("model.json", self.citymodel, chunk_size=2)
+        feedback = CancelAfterFirstChunk()
+        feedback.isCanceled = lambda: False
+
+        loader.convert(feedback)
+
+        assert feedback.progress == [40, 80, 100]
+        assert loader.statistics()["loaded_objects"] == 5
+
+    def test_cancel_between_chunks(self):
+        """Does the conversion stop at the next chunk when canceled?"""
+        loader = CityJSONLoader("model.json", self.citymodel, chunk_size=2)
+
+        loader.convert(CancelAfterFirstChunk())
+
+        assert loader.statistics() == {"loaded_objects": 2,
+                                       "skipped_geometries": 0,
+                                       "canceled": True}
+
+class TestPeekHeader:
+    """A class to test the reading of the header of CityJSON files"""
+
+    def write_model(self, tmp_path, members):
+        """Writes the (key, value) members in their order and returns the path"""
+        filepath = tmp_path / "model.city.json"
+        filepath.write_text(json.dumps(dict(members)), encoding="utf-8")
+
+        return str(filepath)
+
+    def test_transform_after_objects(self, tmp_path):
+        """Is a mandatory transform read after the city objects?"""
+        filepath = self.write_model(tmp_path, [("type", "CityJSON"), ("version", "1.1"),
+                                               ("metadata", {}), ("CityObjects", {}),
+                                               ("vertices", []),
+                                               ("transform", seq_header["transform"])])
+
+        header, complete = peek_cityjson_header(filepath)
+
+        assert header["transform"] == seq_header["transform"]
+        assert complete
+
+    def test_unknown_transform(self, tmp_path):
+        """Is the header of a v1.0 file without a transform before the
+        objects incomplete, rather than uncompressed?
+        """
+        filepath = self.write_model(tmp_path, [("type", "CityJSON"), ("version", "1.0"),
+                                               ("metadata", {}), ("CityObjects", {}),
+                                               ("vertices", [])])
+
+        header, complete = peek_cityjson_header(filepath)
+
+        assert "transform" not in header
+        assert not complete
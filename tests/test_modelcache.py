@@ -0,0 +1,91 @@
+"""A list of tests to check the cache of parsed models"""
+
+import os
+
+import pytest
+
+from core.modelcache import ModelCache
+
+class CountingLoader:
+    """A load function that counts how many times files are parsed"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, filepath):
+        self.calls += 1
+        return {"path": filepath, "call": self.calls}
+
+@pytest.fixture
+def model_file(tmp_path):
+    """Writes a small file and returns its path"""
+    filepath = tmp_path / "model.city.json"
+    filepath.write_text("{}")
+
+    return str(filepath)
+
+class TestModelCache:
+    """A class to test the ModelCache class"""
+
+    def test_parsed_once(self, model_file):
+        """Is a file parsed only once while it doesn't change?"""
+        loader = CountingLoader()
+        cache = ModelCache(load_function=loader)
+
+        first = cache.get(model_file)
+        second = cache.get(model_file)
+
+        assert first is second
+        assert loader.calls == 1
+
+    def test_changed_file(self, model_file):
+        """Is a file parsed again after it is modified?"""
+        loader = CountingLoader()
+        cache = ModelCache(load_function=loader)
+
+        cache.get(model_file)
+        stat = os.stat(model_file)
+        os.utime(model_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        cache.get(model_file)
+
+        assert loader.calls == 2
+
+    def test_eviction(self, tmp_path):
+        """Is the least recently used model evicted over the budget?"""
+        paths = []
+        for name in ["a", "b", "c"]:
+            filepath = tmp_path / "{}.json".format(name)
+            filepath.write_text(" " * 100)
+            paths.append(str(filepath))
+        cache = ModelCache(max_memory=250, memory_factor=1, load_function=CountingLoader())
+
+        cache.get(paths[0])
+        cache.get(paths[1])
+        cache.get(paths[0])
+        cache.get(paths[2])
+
+        assert paths[0] in cache
+        assert paths[1] not in cache
+        assert paths[2] in cache
+
+    def test_too_large(self, model_file):
+        """Are models larger than the budget not cached?"""
+        cache = ModelCache(max_memory=1, load_function=CountingLoader())
+
+        cache.get(model_file)
+
+        assert len(cache) == 0
+
+    def test_extras(self, model_file):
+        """Are derived values computed once per cached model?"""
+        cache = ModelCache(load_function=CountingLoader())
+        citymodel = cache.get(model_file)
+        calls = []
+
+        def factory(model):
+            calls.append(model)
+            return len(calls)
+
+        assert cache.get_extra(model_file, citymodel, "index", factory) == 1
+        assert cache.get_extra(model_file, citymodel, "index", factory) == 1
+        assert cache.get_extra(model_file, {}, "index", factory) == 2
@@ -0,0 +1,78 @@
+"""A list of tests to check the parallel conversion of city objects"""
+
+import pytest
+
+from core.geometry import GeometryReader, VerticesCache
+from core.layers import (AttributeFieldsDecorator, BaseFieldsBuilder, FieldMap,
+                         LodFieldsDecorator, create_feature_builder)
+from core.parallel import (ParallelConverter, convert_chunk, fields_to_spec,
+                           init_worker, spec_to_fields)
+
+citymodel = {
+    "type": "CityJSON",
+    "version": "1.1",
+    "CityObjects": {
+        "id-1": {"type": "Building",
+                 "attributes": {"name": "a", "storeys": 3},
+                 "geometry": [{"type": "MultiSurface", "lod": 1,
+                               "boundaries": [[[0, 1, 2, 3]]]},
+                              {"type": "MultiSurface", "lod": 2,
+                               "boundaries": [[[0, 1, 2]], [[0, 2, 3]]]}]},
+        "id-2": {"type": "Building",
+                 "attributes": {"name": "b"}},
+        "id-3": {"type": "Road",
+                 "attributes": {"storeys": 0},
+                 "geometry": [{"type": "MultiSurface", "lod": 1,
+                               "boundaries": [[[3, 2, 1]]]}]}
+    },
+    "vertices": [[0.0, 0.0, 0.0], [1.0, 0.0, 0.0], [1.0, 1.0, 0.5], [0.0, 1.0, 0.5]]
+}
+
+class TestParallelConverter:
+    """A class to test the ParallelConverter class"""
+
+    def test_fields_spec(self):
+        """Are fields rebuilt with the same names, types and lengths?"""
+        fields = BaseFieldsBuilder().get_fields()
+
+        new_fields = spec_to_fields(fields_to_spec(fields))
+
+        assert [f.name() for f in new_fields] == [f.name() for f in fields]
+        assert [f.type() for f in new_fields] == [f.type() for f in fields]
+        assert new_fields[2].length() == 1000
+
+    def test_chunks(self):
+        """Are items split in chunks of the given size?"""
+        converter = ParallelConverter(BaseFieldsBuilder().get_fields(),
+                                      [], chunk_size=2)
+
+        chunks = list(converter.chunks(range(5)))
+
+        assert chunks == [[0, 1], [2, 3], [4]]
+
+    def test_convert_chunk(self):
+        """Are the features of a worker the same as the serial ones, in the
+        same order?
+        """
+        fields = LodFieldsDecorator(AttributeFieldsDecorator(BaseFieldsBuilder(),
+                                                             citymodel)).get_fields()
+        items = list(citymodel["CityObjects"].items())
+
+        geometry_reader = GeometryReader(VerticesCache(vertices=citymodel["vertices"]))
+        feature_builder = create_feature_builder(geometry_reader, 'ATTRIBUTES')
+        field_map = FieldMap(fields)
+        expected = [feature for key, obj in items
+                    for feature in feature_builder.create_features(field_map, key, obj)]
+
+        init_worker(fields_to_spec(fields), citymodel["vertices"], None,
+                    'ATTRIBUTES', False, False, None)
+        results, skipped, count = convert_chunk(items)
+        features = ParallelConverter(fields, []).to_features(results)
+
+        assert (skipped, count) == (0, 3)
+        assert len(features) == len(expected) == 4
+        for feature, expected_feature in zip(features, expected):
+            assert feature.attributes() == expected_feature.attributes()
+            assert feature.hasGeometry() == expected_feature.hasGeometry()
+            if expected_feature.hasGeometry():
+                assert feature.geometry().asWkb() == expected_feature.geometry().asWkb()
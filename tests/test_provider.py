@@ -0,0 +1,90 @@
+import json
+
+import pytest
+from qgis.core import QgsFeatureRequest, QgsRectangle
+
+from core.provider import CityJSONProvider, get_provider_uri, parse_provider_uri
+
+citymodel = {
+    "type": "CityJSON",
+    "version": "1.1",
+    "CityObjects": {
+        "id-1": {"type": "Building",
+                 "attributes": {"name": "a"},
+                 "geometry": [{"type": "MultiSurface", "lod": 1,
+                               "boundaries": [[[0, 1, 2]]]}]},
+        "id-2": {"type": "Building",
+                 "attributes": {"name": "b"},
+                 "geometry": [{"type": "MultiSurface", "lod": 1,
+                               "boundaries": [[[3, 4, 5]]]}]},
+        "id-3": {"type": "Building",
+                 "attributes": {"name": "c"}}
+    },
+    "vertices": [[0, 0, 0], [1, 0, 0], [0, 1, 0],
+                 [10, 10, 0], [11, 10, 0], [10, 11, 0]]
+}
+
+@pytest.fixture
+def provider(tmp_path):
+    """Returns a provider of the model above, read from a file"""
+    filepath = tmp_path / "model.city.json"
+    filepath.write_text(json.dumps(citymodel), encoding="utf-8")
+
+    return CityJSONProvider(str(filepath))
+
+def get_uids(provider, request):
+    """Returns the uids of the features of a request"""
+    return [feature["uid"] for feature in provider.getFeatures(request)]
+
+class TestProviderUri:
+    """A class to test the data source URIs of the on-demand provider"""
+
+    def test_uri_without_crs(self):
+        """Is a file without a CRS referenced by its path only?"""
+        uri = get_provider_uri("/data/city.json")
+
+        assert uri == "/data/city.json"
+        assert parse_provider_uri(uri) == ("/data/city.json", "None")
+
+    def test_uri_with_crs(self):
+        """Does the EPSG code round-trip through the URI?"""
+        uri = get_provider_uri("/data/city.json", "7415")
+
+        assert parse_provider_uri(uri) == ("/data/city.json", "7415")
+
+class TestCityJSONFeatureIterator:
+    """A class to test the features that the on-demand provider creates"""
+
+    def test_feature_count(self, provider):
+        """Is there one feature per city object, in their order?"""
+        assert provider.isValid()
+        assert provider.featureCount() == 3
+        assert get_uids(provider, QgsFeatureRequest()) == ["id-1", "id-2", "id-3"]
+
+    def test_filter_rect(self, provider):
+        """Are only the objects whose bbox intersects the extent created?"""
+        request = QgsFeatureRequest().setFilterRect(QgsRectangle(9, 9, 12, 12))
+
+        assert get_uids(provider, request) == ["id-2"]
+
+    def test_filter_fids(self, provider):
+        """Are the features of the fids created, ignoring unknown fids?"""
+        request = QgsFeatureRequest().setFilterFids([2, 0, 99])
+        features = list(provider.getFeatures(request))
+
+        assert [feature.id() for feature in features] == [0, 2]
+        assert [feature["uid"] for feature in features] == ["id-1", "id-3"]
+
+        feature = next(iter(provider.getFeatures(QgsFeatureRequest(1))))
+        assert (feature.id(), feature["name"]) == (1, "b")
+
+    def test_no_geometry(self, provider):
+        """Are features created without geometries when they aren't needed?"""
+        request = QgsFeatureRequest().setFlags(QgsFeatureRequest.NoGeometry)
+        features = list(provider.getFeatures(request))
+
+        assert [feature["name"] for feature in features] == ["a", "b", "c"]
+        assert not any(feature.hasGeometry() for feature in features)
+
+        features = list(provider.getFeatures(QgsFeatureRequest()))
+        assert [feature.hasGeometry() for feature in features] == [True, True, False]
@@ -0,0 +1,68 @@
+import pytest
+
+from core.schema import ModelSchema, get_value_type, merge_types
+
+typed_citymodel = {"type":"CityJSON","version":"1.0","CityObjects":{
+    "id-1":{"type":"Building","attributes":{"measuredHeight":12.5,"storeys":3,"yearOfConstruction":"1999-05-01","roofType":"flat","isMonument":True},
+            "geometry":[{"type":"MultiSurface","lod":2,"boundaries":[[[0,1,2]]],"semantics":{"surfaces":[{"type":"RoofSurface","slope":30}],"values":[0]}}]},
+    "id-2":{"type":"Building","attributes":{"measuredHeight":9,"storeys":None,"roofType":3,"owner":None}},
+    "id-3":{"type":"Road","attributes":{"storeys":2**40},
+            "geometry":[{"type":"MultiSurface","lod":1,"boundaries":[[[0,1,2]]]}]}},
+    "vertices":[[0,0,0],[1,0,0],[0,1,0]]}
+
+class TestValueTypes:
+    """A class to test the inference of attribute types"""
+
+    @pytest.mark.parametrize("value, expected", [
+        (True, "bool"),
+        (3, "int"),
+        (2**40, "int64"),
+        (1.5, "double"),
+        ("2020-02-29", "date"),
+        ("2021-02-29", "string"),
+        ("text", "string"),
+        ([1, 2], "string"),
+        (None, None)
+    ])
+    def test_value_type(self, value, expected):
+        """Is the narrowest type inferred for every value?"""
+        assert get_value_type(value) == expected
+
+    @pytest.mark.parametrize("current, new, expected", [
+        (None, "int", "int"),
+        ("int", None, "int"),
+        ("int", "int64", "int64"),
+        ("int", "double", "double"),
+        ("int", "bool", "string"),
+        ("date", "string", "string")
+    ])
+    def test_merge_types(self, current, new, expected):
+        """Do mixed types fall back to a type that holds both?"""
+        assert merge_types(current, new) == expected
+
+class TestModelSchema:
+    """A class to test the ModelSchema class"""
+
+    def test_attributes(self):
+        """Are the attributes found in order with their types?"""
+        schema = ModelSchema.from_citymodel(typed_citymodel)
+
+        assert schema.attributes == {"measuredHeight": "double",
+                                     "storeys": "int64",
+                                     "yearOfConstruction": "date",
+                                     "roofType": "string",
+                                     "isMonument": "bool",
+                                     "owner": None}
+
+    def test_semantic_attributes(self):
+        """Are the attributes of semantic surfaces found?"""
+        schema = ModelSchema.from_citymodel(typed_citymodel)
+
+        assert schema.semantic_attributes == {"type": "string", "slope": "int"}
+
+    def test_types_and_lods(self):
+        """Are the object types and LoDs collected in the same pass?"""
+        schema = ModelSchema.from_citymodel(typed_citymodel)
+
+        assert list(schema.object_types) == ["Building", "Road"]
+        assert list(schema.lods) == [2, 1]
@@ -0,0 +1,108 @@
+"""A list of tests to check the spatial indexes of city objects"""
+
+import random
+
+import pytest
+
+from core.spatial import CentroidIndex, CityObjectTable
+from core.utils import get_centroid, get_centroid_index
+
+def brute_force_query(ids, centroids, bbox):
+    """Returns the ids in the bbox by checking every centroid"""
+    return [i for i, c in zip(ids, centroids)
+            if bbox[0] <= c[0] < bbox[2] and bbox[1] <= c[1] < bbox[3]]
+
+class TestCentroidIndex:
+    """A class to test the CentroidIndex class"""
+
+    def test_empty_index(self):
+        """Does an empty index return no objects?"""
+        index = CentroidIndex([], [])
+
+        assert index.query([0, 0, 10, 10]) == []
+
+    def test_query_matches_brute_force(self):
+        """Does the index return the same objects as checking all of them?"""
+        rng = random.Random(42)
+        ids = ["id-{}".format(i) for i in range(1000)]
+        centroids = [[rng.uniform(0, 100), rng.uniform(0, 50), 0] for _ in ids]
+        index = CentroidIndex(ids, centroids)
+
+        for _ in range(50):
+            x, y = rng.uniform(-10, 100), rng.uniform(-10, 50)
+            bbox = [x, y, x + rng.uniform(0, 40), y + rng.uniform(0, 40)]
+            assert index.query(bbox) == brute_force_query(ids, centroids, bbox)
+
+    def test_bounds(self):
+        """Is the minimum inclusive and the maximum exclusive?"""
+        index = CentroidIndex(["a", "b"], [[0, 0, 0], [10, 10, 0]])
+
+        assert index.query([0, 0, 10, 10]) == ["a"]
+        assert index.query([0, 0, 10.1, 10.1]) == ["a", "b"]
+
+    def test_model_index(self):
+        """Are objects without geometry left out of the model's index?"""
+        cm = {"CityObjects": {
+                "id-1": {"type": "Building",
+                         "geometry": [{"type": "MultiSurface", "lod": 1,
+                                       "boundaries": [[[0, 1, 2]]]}]},
+                "id-2": {"type": "Building"}},
+              "vertices": [[0, 0, 0], [3, 0, 0], [0, 3, 3]]}
+
+        index = get_centroid_index(cm)
+
+        assert len(index) == 1
+        assert get_centroid(cm, "id-1") == [1, 1, 1]
+        assert index.query([0, 0, 2, 2]) == ["id-1"]
+
+class TestCityObjectTable:
+    """A class to test the CityObjectTable class"""
+
+    citymodel = {
+        "CityObjects": {
+            "solid": {"type": "Building",
+                      "geometry": [{"type": "Solid", "lod": 1,
+                                    "boundaries": [[[[0, 1, 2]], [[2, 3, 0]]]]}]},
+            "empty": {"type": "CityObjectGroup"},
+            "surface": {"type": "Road",
+                        "geometry": [{"type": "MultiSurface", "lod": 1,
+                                      "boundaries": [[[4, 5, 6], [5, 6, 7]]]},
+                                     {"type": "MultiSurface", "lod": 2,
+                                      "boundaries": [[[7, 6, 5]]]}]}
+        },
+        "vertices": [[0, 0, 0], [10, 0, 0], [10, 10, 5], [0, 10, 5],
+                     [20, 20, 0], [30, 20, 0], [30, 30, 0], [20, 30, 10]],
+        "transform": {"scale": [0.5, 0.5, 0.1], "translate": [100, 200, 0]}
+    }
+
+    def test_centroids_match_get_centroid(self):
+        """Are the centroids the same as the ones of get_centroid?"""
+        table = CityObjectTable.from_model(self.citymodel)
+
+        for coid in ["solid", "surface"]:
+            assert table.get_centroid(coid) == pytest.approx(get_centroid(self.citymodel, coid))
+
+    def test_bboxes(self):
+        """Are the 3D bounding boxes computed per object?"""
+        table = CityObjectTable.from_model(self.citymodel)
+
+        assert table.get_bbox("solid") == pytest.approx([100, 200, 0, 105, 205, 0.5])
+        assert table.get_bbox("surface") == pytest.approx([110, 210, 0, 115, 215, 1])
+        assert table.extent() == pytest.approx([100, 200, 0, 115, 215, 1])
+
+    def test_intersecting_rows(self):
+        """Are the objects whose bbox intersects an extent returned?"""
+        table = CityObjectTable.from_model(self.citymodel)
+
+        assert table.intersecting_rows([104, 204, 111, 211]).tolist() == [0, 2]
+        assert table.intersecting_rows([106, 206, 109, 209]).tolist() == []
+        assert table.intersecting_rows([0, 0, 1000, 1000]).tolist() == [0, 2]
+
+    def test_object_without_geometry(self):
+        """Do objects without geometry have no centroid or bbox?"""
+        table = CityObjectTable.from_model(self.citymodel)
+
+        assert len(table) == 3
+        assert table.get_centroid("empty") is None
+        assert table.get_bbox("empty") is None
+        assert len(table.centroid_index()) == 2
@@ -0,0 +1,188 @@
+import copy
+
+from core.subset import HierarchyIndex, IndexMap, get_subset, select_co_ids
+from core.utils import get_subset_bbox, get_subset_cotype
+
+citymodel = {
+    "type": "CityJSON",
+    "version": "1.0",
+    "CityObjects": {
+        "id-1": {"type": "Building",
+                 "geometry": [{"type": "MultiSurface", "lod": 1,
+                               "boundaries": [[[0, 1, 2]]],
+                               "material": {"irradiation": {"values": [0]}},
+                               "texture": {"winter": {"values": [[[0, 0, 1, 2]]]}}}]},
+        "id-2": {"type": "Road",
+                 "geometry": [{"type": "MultiSurface", "lod": 1,
+                               "boundaries": [[[3, 4, 5]], [[5, 4, 6]]],
+                               "material": {"irradiation": {"values": [1, None]}},
+                               "texture": {"winter": {"values": [[[1, 3, 4, 5]], [[None]]]}}}]},
+        "id-3": {"type": "SolitaryVegetationObject",
+                 "geometry": [{"type": "GeometryInstance", "template": 1,
+                               "boundaries": [7]}]},
+        "id-4": {"type": "Building"}
+    },
+    "vertices": [[0, 0, 0], [1, 0, 0], [0, 1, 0],
+                 [10, 10, 0], [11, 10, 0], [10, 11, 0], [11, 11, 0],
+                 [20, 20, 0]],
+    "geometry-templates": {"templates": [{"type": "MultiSurface", "lod": 2, "boundaries": [[[0, 1, 2]]]},
+                                         {"type": "MultiSurface", "lod": 3, "boundaries": [[[2, 1, 0]]]}],
+                           "vertices-templates": [[0, 0, 0], [1, 0, 0], [0, 1, 0]]},
+    "appearance": {"materials": [{"name": "a"}, {"name": "b"}],
+                   "textures": [{"image": "a.png"}, {"image": "b.png"}],
+                   "vertices-texture": [[0, 0], [1, 0], [0, 1], [0.5, 0], [1, 0.5], [0.5, 1]]},
+    "metadata": {"referenceSystem": "urn:ogc:def:crs:EPSG::7415"}
+}
+
+class TestIndexMap:
+    """A class to test the IndexMap class"""
+
+    def test_renumbering(self):
+        """Are the used indices renumbered in their original order?"""
+        index_map = IndexMap([7, 3, 7, 5])
+
+        assert index_map.old_indices == [3, 5, 7]
+        assert list(index_map.new_indices) == [2, 0, 2, 1]
+        assert index_map.select("abcdefgh") == ["d", "f", "h"]
+
+class TestGetSubset:
+    """A class to test the get_subset function"""
+
+    def test_vertices(self):
+        """Are only the vertices of the objects kept and renumbered?"""
+        subset = get_subset(citymodel, ["id-2"])
+
+        assert list(subset["CityObjects"]) == ["id-2"]
+        assert subset["vertices"] == [[10, 10, 0], [11, 10, 0], [10, 11, 0], [11, 11, 0]]
+        assert subset["CityObjects"]["id-2"]["geometry"][0]["boundaries"] == [[[0, 1, 2]], [[2, 1, 3]]]
+
+    def test_source_unchanged(self):
+        """Is the source model left as it was, so it can be subset again?"""
+        original = copy.deepcopy(citymodel)
+
+        first = get_subset(citymodel, ["id-2", "id-3"])
+        second = get_subset(citymodel, ["id-2", "id-3"])
+
+        assert citymodel == original
+        assert first == second
+
+    def test_templates(self):
+        """Are only the used templates kept and renumbered?"""
+        subset = get_subset(citymodel, ["id-3"])
+
+        assert subset["geometry-templates"]["templates"] == [citymodel["geometry-templates"]["templates"][1]]
+        assert subset["CityObjects"]["id-3"]["geometry"][0]["template"] == 0
+        assert subset["CityObjects"]["id-3"]["geometry"][0]["boundaries"] == [0]
+        assert subset["vertices"] == [[20, 20, 0]]
+
+    def test_appearance(self):
+        """Are the materials, textures and texture vertices renumbered?"""
+        subset = get_subset(citymodel, ["id-2"])
+        geometry = subset["CityObjects"]["id-2"]["geometry"][0]
+
+        assert subset["appearance"]["materials"] == [{"name": "b"}]
+        assert geometry["material"]["irradiation"]["values"] == [0, None]
+        assert subset["appearance"]["textures"] == [{"image": "b.png"}]
+        assert subset["appearance"]["vertices-texture"] == [[0.5, 0], [1, 0.5], [0.5, 1]]
+        assert geometry["texture"]["winter"]["values"] == [[[0, 0, 1, 2]], [[None]]]
+
+    def test_objects_without_geometry(self):
+        """Are objects without geometry kept?"""
+        subset = get_subset(citymodel, ["id-4"])
+
+        assert subset["CityObjects"] == {"id-4": {"type": "Building"}}
+        assert subset["vertices"] == []
+        assert "geometry-templates" not in subset
+
+class TestSubsetFilters:
+    """A class to test the subsets by type and extent"""
+
+    def test_subset_cotype(self):
+        """Are the objects of the type selected, without changing the
+        given list of types?
+        """
+        types = ["Building"]
+
+        subset = get_subset_cotype(citymodel, types)
+
+        assert list(subset["CityObjects"]) == ["id-1", "id-4"]
+        assert types == ["Building"]
+
+    def test_subset_bbox(self):
+        """Are the objects with their centroid in the extent selected?"""
+        original = copy.deepcopy(citymodel)
+
+        subset = get_subset_bbox(citymodel, [9, 9, 12, 12])
+
+        assert list(subset["CityObjects"]) == ["id-2"]
+        assert citymodel == original
+
+hierarchy_citymodel = {
+    "CityObjects": {
+        "b-1": {"type": "Building", "children": ["p-1", "p-2"]},
+        "p-1": {"type": "BuildingPart", "parents": ["b-1"], "children": ["i-1"]},
+        "p-2": {"type": "BuildingPart", "parents": ["b-1"]},
+        "i-1": {"type": "BuildingInstallation", "parents": ["p-1"]},
+        "b-2": {"type": "Building"},
+        "b-3": {"type": "Building"},
+        "g-1": {"type": "CityObjectGroup", "members": ["b-2", "unknown"]},
+        "b-4": {"type": "Building", "parents": ["g-2"], "children": ["p-4"]},
+        "p-4": {"type": "BuildingPart", "parents": ["b-4"]},
+        "b-5": {"type": "Building", "parents": ["g-2"]},
+        "g-2": {"type": "CityObjectGroup", "children": ["b-4", "b-5"]}
+    }
+}
+
+class TestHierarchyIndex:
+    """A class to test the HierarchyIndex class"""
+
+    def test_children(self):
+        """Are the children of an object selected, transitively?"""
+        index = HierarchyIndex.from_model(hierarchy_citymodel)
+
+        assert index.select(["b-1"]) == {"b-1", "p-1", "p-2", "i-1"}
+
+    def test_parents_and_siblings(self):
+        """Is the whole hierarchy of a child selected?"""
+        index = HierarchyIndex.from_model(hierarchy_citymodel)
+
+        assert index.select(["i-1"]) == {"b-1", "p-1", "p-2", "i-1"}
+
+    def test_group_members(self):
+        """Are the members of a group selected, but not their group?"""
+        index = HierarchyIndex.from_model(hierarchy_citymodel)
+
+        assert index.select(["g-1"]) == {"g-1", "b-2"}
+        assert index.select(["b-2"]) == {"b-2"}
+
+    def test_group_parents(self):
+        """Is the group of a building (as a parent, in v2.0) left out, with
+        its other members, unless the group itself is selected?
+        """
+        index = HierarchyIndex.from_model(hierarchy_citymodel)
+
+        assert index.select(["p-4"]) == {"b-4", "p-4"}
+        assert index.select(["g-2"]) == {"g-2", "b-4", "p-4", "b-5"}
+
+    def test_missing_ids(self):
+        """Are ids that aren't in the model ignored?"""
+        ids = ["b-3", "unknown"]
+
+        assert select_co_ids(hierarchy_citymodel, ids) == {"b-3"}
+        assert ids == ["b-3", "unknown"]
+
+    def test_bbox_hierarchy(self):
+        """Are the parents and siblings of the objects in a bbox selected,
+        as for a selection by id?
+        """
+        model = copy.deepcopy(hierarchy_citymodel)
+        model["CityObjects"]["i-1"]["geometry"] = [{"type": "MultiSurface", "lod": 1,
+                                                    "boundaries": [[[0, 1, 2]]]}]
+        model["version"] = "1.1"
+        model["vertices"] = [[0, 0, 0], [1, 0, 0], [0, 1, 0]]
+
+        subset = get_subset_bbox(model, [-1, -1, 2, 2])
+        inverted = get_subset_bbox(model, [-1, -1, 2, 2], invert=True)
+
+        assert set(subset["CityObjects"]) == {"b-1", "p-1", "p-2", "i-1"}
+        assert set(inverted["CityObjects"]) == set(model["CityObjects"])